@@ -0,0 +1,130 @@
+"""Async counterparts of the functions in `crud`.
+
+Each one runs the sync implementation on the AsyncSession's connection via
+`run_sync`, so the query logic lives in `crud` only while the event loop
+never blocks on database I/O. Anything the API reads from the returned
+objects has to be loaded eagerly by the crud function.
+"""
+from typing import Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import crud
+import models
+import schemas
+
+
+async def get_user(db: AsyncSession, user_id: str):
+    return await db.run_sync(crud.get_user, user_id)
+
+
+async def get_user_by_username(db: AsyncSession, username: str):
+    return await db.run_sync(crud.get_user_by_username, username)
+
+
+async def get_user_by_email(db: AsyncSession, email: str):
+    return await db.run_sync(crud.get_user_by_email, email)
+
+
+async def get_users(
+    db: AsyncSession, skip: int = 0, limit: int = 100, cursor: Optional[str] = None
+):
+    return await db.run_sync(crud.get_users, skip=skip, limit=limit, cursor=cursor)
+
+
+async def get_user_summary(db: AsyncSession, user_id: str):
+    return await db.run_sync(crud.get_user_summary, user_id)
+
+
+async def get_recent_post_cards(db: AsyncSession, user_ids: list[str], per_user: int):
+    return await db.run_sync(crud.get_recent_post_cards, user_ids, per_user)
+
+
+async def create_user(db: AsyncSession, user: schemas.UserCreate):
+    return await db.run_sync(crud.create_user, user)
+
+
+async def update_password_hash(
+    db: AsyncSession, db_user: models.User, hashed_password: str
+):
+    return await db.run_sync(crud.update_password_hash, db_user, hashed_password)
+
+
+async def set_user_active(db: AsyncSession, user_id: str, is_active: bool):
+    return await db.run_sync(crud.set_user_active, user_id, is_active)
+
+
+async def get_posts(db: AsyncSession, **filters):
+    return await db.run_sync(crud.get_posts, **filters)
+
+
+async def get_post_cards(db: AsyncSession, **filters):
+    return await db.run_sync(crud.get_post_cards, **filters)
+
+
+async def get_tags_for_posts(db: AsyncSession, post_ids: list[str]):
+    return await db.run_sync(crud.get_tags_for_posts, post_ids)
+
+
+async def create_user_post(db: AsyncSession, user_id: str, item: schemas.PostCreate):
+    return await db.run_sync(crud.create_user_post, user_id, item)
+
+
+async def delete_post(db: AsyncSession, db_post: models.Post):
+    return await db.run_sync(crud.delete_post, db_post)
+
+
+async def search_posts(db: AsyncSession, keyword: str, limit: int = 20):
+    return await db.run_sync(crud.search_posts, keyword, limit)
+
+
+async def get_post(db: AsyncSession, username: str, slug: str):
+    return await db.run_sync(crud.get_post, username, slug)
+
+
+async def get_post_version(db: AsyncSession, username: str, slug: str):
+    return await db.run_sync(crud.get_post_version, username, slug)
+
+
+async def get_post_by_id(db: AsyncSession, post_id: str):
+    return await db.run_sync(crud.get_post_by_id, post_id)
+
+
+async def get_tag(db: AsyncSession, tag_id: str):
+    return await db.run_sync(crud.get_tag, tag_id)
+
+
+async def get_all_tag(db: AsyncSession):
+    return await db.run_sync(crud.get_all_tag)
+
+
+async def get_post_counters(db: AsyncSession, post_id: str):
+    return await db.run_sync(crud.get_post_counters, post_id)
+
+
+async def add_post_counters(db: AsyncSession, deltas: dict[str, dict[str, int]]):
+    return await db.run_sync(crud.add_post_counters, deltas)
+
+
+async def get_post_cards_by_ids(db: AsyncSession, post_ids: list[str]):
+    return await db.run_sync(crud.get_post_cards_by_ids, post_ids)
+
+
+async def get_post_facets(db: AsyncSession, post_id: str):
+    return await db.run_sync(crud.get_post_facets, post_id)
+
+
+async def get_trending_seed(db: AsyncSession):
+    return await db.run_sync(crud.get_trending_seed)
+
+
+async def add_cache_invalidations(db: AsyncSession, namespaces: list[str]):
+    return await db.run_sync(crud.add_cache_invalidations, namespaces)
+
+
+async def get_cache_invalidations(db: AsyncSession, after_id: Optional[int]):
+    return await db.run_sync(crud.get_cache_invalidations, after_id)
+
+
+async def prune_cache_invalidations(db: AsyncSession, before):
+    return await db.run_sync(crud.prune_cache_invalidations, before)
@@ -0,0 +1,126 @@
+"""Fill in the columns derived from existing posts.
+
+    render   content_html, toc and reading_time, for posts whose
+             content_hash is missing or outdated (see rendering.py)
+    summary  summary and meta_title, for posts that have none
+
+Posts are read in chunks of --chunk-size, each chunk is processed by
+--workers processes and written back in one transaction.
+
+usage: python backfill.py {render,summary} [--chunk-size 200] [--workers 4] [--force]
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy import update
+
+import cache
+import invalidation
+import models
+import rendering
+from database import SessionLocal
+
+
+def post_chunks(db, chunk_size: int, *columns):
+    """Posts ordered by post_id, `chunk_size` rows at a time."""
+    last_post_id = None
+    while True:
+        query = (
+            db.query(models.Post.post_id, models.Post.slug, models.User.name, *columns)
+            .join(models.User)
+            .order_by(models.Post.post_id)
+        )
+        if last_post_id is not None:
+            query = query.filter(models.Post.post_id > last_post_id)
+        rows = query.limit(chunk_size).all()
+        if not rows:
+            return
+        yield rows
+        last_post_id = rows[-1].post_id
+
+
+def backfill(args, pool, inputs, derive, is_stale, extra_columns=()) -> list:
+    """Update every post that `is_stale` (all of them with --force) with the
+    columns `derive` computes from the values of the `inputs` columns.
+    `is_stale` may also look at `extra_columns`.
+
+    Returns the cache namespaces of the posts that changed.
+    """
+    db = SessionLocal()
+    changed = []
+    chunks = post_chunks(db, args.chunk_size, *inputs, *extra_columns)
+    try:
+        for number, rows in enumerate(chunks, start=1):
+            started = time.perf_counter()
+            stale = [row for row in rows if args.force or is_stale(row)]
+            updates = []
+            if stale:
+                # Skip post_id, slug and name, which every chunk starts with
+                values = zip(*(row[3 : 3 + len(inputs)] for row in stale))
+                derived = pool.map(
+                    derive, *values, chunksize=max(1, len(stale) // (args.workers * 4))
+                )
+                updates = [
+                    {"post_id": row.post_id, **columns} for row, columns in zip(stale, derived)
+                ]
+                db.execute(update(models.Post), updates)
+                db.commit()
+            changed.extend(cache.post_namespace(row.name, row.slug) for row in stale)
+            elapsed = time.perf_counter() - started
+            print(
+                f"chunk {number}: updated {len(updates)} of {len(rows)} posts "
+                f"in {elapsed:.2f}s"
+            )
+    finally:
+        db.close()
+    return changed
+
+
+def render(args, pool) -> list:
+    return backfill(
+        args,
+        pool,
+        (models.Post.content,),
+        rendering.columns,
+        lambda row: row.content_hash != rendering.content_hash(row.content or ""),
+        (models.Post.content_hash,),
+    )
+
+
+def summary(args, pool) -> list:
+    return backfill(
+        args,
+        pool,
+        (models.Post.title, models.Post.content),
+        rendering.summary_columns,
+        lambda row: row.summary is None or row.meta_title is None,
+        (models.Post.summary, models.Post.meta_title),
+    )
+
+
+COMMANDS = {"render": render, "summary": summary}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fill in derived post columns.")
+    parser.add_argument("command", choices=sorted(COMMANDS))
+    parser.add_argument("--chunk-size", type=int, default=200, help="posts per transaction")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--force", action="store_true", help="redo posts that are up to date")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        changed = COMMANDS[args.command](args, pool)
+    print(f"{args.command}: {len(changed)} posts updated in {time.perf_counter() - started:.2f}s")
+
+    if changed:
+        invalidation.invalidate_from_script(cache.POSTS, *changed)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
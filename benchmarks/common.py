@@ -0,0 +1,48 @@
+"""Helpers shared by the benchmark scripts."""
+import os
+import statistics
+import tempfile
+
+
+def load_app(db_url=None, **env):
+    """Import the app against a scratch database and create its tables.
+
+    Must run before anything imports `database` or `main`. The scratch
+    database has to win over a developer's .env, so .env loading is turned
+    off for the benchmark process.
+    """
+    if db_url is None:
+        db_url = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+    os.environ["BLOG_DB_URL"] = db_url
+    os.environ.setdefault("BLOG_API_KEY", "bench")
+    os.environ.setdefault("BLOG_SECRET_KEY", "bench-secret")
+    os.environ.update(env)
+
+    import dotenv
+
+    dotenv.load_dotenv = lambda *args, **kwargs: False
+
+    import database
+    import main
+    import models
+
+    models.Base.metadata.create_all(bind=database.engine)
+    return main
+
+
+def percentiles(samples: list[float]) -> dict:
+    """p50/p95/p99 and mean of latencies given in seconds, in milliseconds."""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def pick(p):
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000
+
+    return {
+        "count": len(ordered),
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+    }
@@ -0,0 +1,91 @@
+"""Compare two runs of benchmarks.load, endpoint by endpoint.
+
+Prints throughput, p50/p95/p99 latency and SQL statements per request of
+both runs and the change. With --threshold PCT it exits with status 1
+when an endpoint lost more than PCT percent of its throughput or its p95
+grew by more than PCT percent, or when it runs more statements than it
+did.
+
+usage: python -m benchmarks.compare BEFORE.json AFTER.json [--threshold 10]
+"""
+import argparse
+import json
+import sys
+
+COLUMNS = (
+    ("requests_per_second", "req/s"),
+    ("p50_ms", "p50 ms"),
+    ("p95_ms", "p95 ms"),
+    ("p99_ms", "p99 ms"),
+    ("queries_per_request", "queries"),
+)
+
+
+def change(before, after) -> str:
+    if before is None or after is None:
+        return ""
+    if not before:
+        return "" if not after else "new"
+    return f"{(after - before) / before * 100:+.1f}%"
+
+
+def number(value) -> str:
+    return "-" if value is None else f"{value:.1f}"
+
+
+def regressions(before: dict, after: dict, threshold: float) -> list[str]:
+    found = []
+    limit = threshold / 100
+    rps_before, rps_after = before.get("requests_per_second"), after.get("requests_per_second")
+    if rps_before and rps_after is not None and rps_after < rps_before * (1 - limit):
+        found.append("throughput")
+    p95_before, p95_after = before.get("p95_ms"), after.get("p95_ms")
+    if p95_before and p95_after is not None and p95_after > p95_before * (1 + limit):
+        found.append("p95")
+    queries_before = before.get("queries_per_request")
+    queries_after = after.get("queries_per_request")
+    if None not in (queries_before, queries_after) and queries_after > queries_before + 0.5:
+        found.append("queries")
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, help="percent; fail on regressions past it")
+    args = parser.parse_args(argv)
+
+    with open(args.before) as file:
+        before = json.load(file)
+    with open(args.after) as file:
+        after = json.load(file)
+    print(f"before: {before['meta'].get('revision')} {before['meta']['started_at']}")
+    print(f"after:  {after['meta'].get('revision')} {after['meta']['started_at']}")
+
+    for key in ("mode", "target", "concurrency", "duration", "cache"):
+        if before["meta"].get(key) != after["meta"].get(key):
+            print(f"warning: {key} differs: {before['meta'].get(key)} vs {after['meta'].get(key)}")
+
+    failed = False
+    names = list(before["endpoints"])
+    names += [name for name in after["endpoints"] if name not in before["endpoints"]]
+    for name in names:
+        old = before["endpoints"].get(name, {})
+        new = after["endpoints"].get(name, {})
+        print(f"\n{name}")
+        for key, label in COLUMNS:
+            print(
+                f"  {label:<8} {number(old.get(key)):>10} {number(new.get(key)):>10}"
+                f"  {change(old.get(key), new.get(key))}"
+            )
+        if args.threshold is not None and old and new:
+            found = regressions(old, new, args.threshold)
+            if found:
+                failed = True
+                print(f"  REGRESSION: {', '.join(found)}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
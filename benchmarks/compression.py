@@ -0,0 +1,104 @@
+"""Bytes on the wire and CPU per request, by content encoding.
+
+Takes the real bodies of a 100 card GET /posts/ page and of a post page
+from the app, then serves each one --requests times through
+CompressionMiddleware in front of an app that only replays it, so the
+timings are the compression alone and not lost in the noise of the
+database. Compared: no compression, and gzip and Brotli both compressing
+every response ("per request", the compressed body cache switched off) and
+reusing the body compressed for the current ETag ("cached", as shipped).
+
+usage: python -m benchmarks.compression [--requests 1000] [--posts 500]
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks import seed
+from benchmarks.common import load_app
+
+
+def replay(status: int, headers: list, body: bytes):
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": status, "headers": list(headers)})
+        await send({"type": "http.response.body", "body": body})
+
+    return app
+
+
+async def measure(app, path: str, encoding: str, requests: int) -> dict:
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": path,
+        "query_string": b"",
+        "headers": [(b"accept-encoding", encoding.encode())],
+    }
+    sent = []
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            sent.append(len(message["body"]))
+
+    started = time.process_time()
+    for _ in range(requests):
+        await app(scope, None, send)
+    cpu = time.process_time() - started
+    return {"bytes": sent[-1], "cpu_us_per_request": cpu / requests * 1e6}
+
+
+async def capture(client, path: str, headers: dict):
+    response = await client.get(path, headers=dict(headers, **{"Accept-Encoding": "identity"}))
+    response.raise_for_status()
+    raw = [(key.encode(), value.encode()) for key, value in response.headers.items()]
+    return replay(response.status_code, raw, response.content)
+
+
+async def run(args) -> dict:
+    main = load_app(None, BLOG_CACHE_URL="off")
+
+    import httpx
+
+    import compression
+    import database
+
+    db = database.SessionLocal()
+    seed.seed(db, args)
+    db.close()
+
+    api_key = {"X-API-KEY": "bench"}
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        card = (await client.get("/posts/", params={"limit": 1}, headers=api_key)).json()[0]
+        paths = {
+            "posts page": "/posts/",
+            "post": f"/posts/{card['username']}/{card['slug']}/",
+        }
+        apps = {name: await capture(client, path, api_key) for name, path in paths.items()}
+
+    modes = [("identity", "identity", True)]
+    for encoding in compression.encodings():
+        modes += [(f"{encoding} per request", encoding, False), (f"{encoding} cached", encoding, True)]
+
+    results = {}
+    for name, path in paths.items():
+        results[name] = {}
+        for label, encoding, cached in modes:
+            cache = compression.CompressedCache(compression.CACHE_BYTES if cached else 0)
+            app = compression.CompressionMiddleware(apps[name], cache=cache)
+            results[name][label] = await measure(app, path, encoding, args.requests)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=1000, help="per body and encoding")
+    seed.add_arguments(parser)
+    parser.set_defaults(users=10, posts=500)
+    args = parser.parse_args(argv)
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
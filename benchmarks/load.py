@@ -0,0 +1,266 @@
+"""Throughput, latency and SQL statements per request, per endpoint.
+
+Each endpoint is driven on its own by --concurrency clients for
+--duration seconds, after --warmup requests. Without --url the app runs
+in-process (httpx's ASGI transport, startup and shutdown events included)
+against --db-url, seeded with a synthetic corpus (see benchmarks/seed.py)
+when it holds no posts; a temporary SQLite database by default. With
+--url a running server is load-tested over HTTP instead; it must already
+hold a corpus.
+
+SQL statements per request are the difference in the server's
+`blog_db_queries_per_request` histogram across the run, so over HTTP they
+need a server started with BLOG_METRICS=1 and --docs-user/--docs-password
+for GET /metrics; they are null otherwise. The response cache is off
+in-process unless --cache is given.
+
+The JSON written to stdout (and --out) can be compared with
+`python -m benchmarks.compare`.
+
+usage: python -m benchmarks.load [--url http://localhost:8000] [--endpoints posts,post] [--concurrency 8] [--duration 5] [--out run.json]
+"""
+import argparse
+import asyncio
+import datetime
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import Optional
+
+from benchmarks import seed
+from benchmarks.common import load_app, percentiles
+
+DOCS_CREDENTIALS = ("bench", "bench")
+
+
+class Sample:
+    """Real ids to put in the URLs, read through the API itself."""
+
+    def __init__(self, posts: list, tag_ids: list[str]):
+        self.posts = [(post["username"], post["slug"]) for post in posts]
+        self.tag_ids = tag_ids or [""]
+        self.user = posts[0]["username"] if posts else None
+
+    @classmethod
+    async def fetch(cls, client, headers):
+        posts = await client.get("/posts/", params={"limit": 100}, headers=headers)
+        posts.raise_for_status()
+        tags = await client.get("/tags/", headers=headers)
+        tags.raise_for_status()
+        return cls(posts.json(), [tag["tag_id"] for tag in tags.json()])
+
+
+def _post(sample: Sample, n: int):
+    username, slug = sample.posts[n % len(sample.posts)]
+    return "GET", f"/posts/{username}/{slug}/", {}
+
+
+def _login(sample: Sample, n: int):
+    form = {"username": "user0@example.com", "password": seed.PASSWORD}
+    return "POST", "/login", {"data": form}
+
+
+# name -> (sample, request number) -> (method, path, httpx options)
+ENDPOINTS = {
+    "posts": lambda sample, n: ("GET", "/posts/", {}),
+    "posts_by_tag": lambda sample, n: (
+        "GET", "/posts/", {"params": {"tag_id": sample.tag_ids[n % len(sample.tag_ids)]}}
+    ),
+    "post": _post,
+    "search": lambda sample, n: (
+        "GET", "/search/", {"params": {"q": seed.WORDS[n % len(seed.WORDS)]}}
+    ),
+    "trending": lambda sample, n: ("GET", "/posts/trending/", {}),
+    "users": lambda sample, n: ("GET", "/users/", {}),
+    "users_with_posts": lambda sample, n: ("GET", "/users/", {"params": {"posts_limit": 3}}),
+    "tags": lambda sample, n: ("GET", "/tags/", {}),
+    "validate": lambda sample, n: ("GET", "/validate", {}),
+    "login": _login,
+}
+# Logins hash a password each, so they are only run when asked for
+DEFAULT_ENDPOINTS = [name for name in ENDPOINTS if name != "login"]
+
+
+def parse_query_totals(text: str) -> tuple[float, float]:
+    """Sum and count of `blog_db_queries_per_request` over every route but
+    /metrics itself."""
+    total = count = 0.0
+    for line in text.splitlines():
+        name, _, value = line.rpartition(" ")
+        if 'route="/metrics"' in name:
+            continue
+        if name.startswith("blog_db_queries_per_request_sum"):
+            total += float(value)
+        elif name.startswith("blog_db_queries_per_request_count"):
+            count += float(value)
+    return total, count
+
+
+async def query_totals(client, auth) -> Optional[tuple[float, float]]:
+    if auth is None:
+        return None
+    response = await client.get("/metrics", auth=auth)
+    if response.status_code != 200:
+        return None
+    return parse_query_totals(response.text)
+
+
+async def run_endpoint(client, headers, auth, sample: Sample, name: str, args) -> dict:
+    build = ENDPOINTS[name]
+    for n in range(args.warmup):
+        method, path, options = build(sample, n)
+        await client.request(method, path, headers=headers, **options)
+
+    before = await query_totals(client, auth)
+    numbers = itertools.count(args.warmup)
+    samples: list[float] = []
+    statuses: dict[int, int] = {}
+    deadline = time.perf_counter() + args.duration
+
+    async def worker():
+        while time.perf_counter() < deadline:
+            method, path, options = build(sample, next(numbers))
+            started = time.perf_counter()
+            response = await client.request(method, path, headers=headers, **options)
+            elapsed = time.perf_counter() - started
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            if response.status_code < 400:
+                samples.append(elapsed)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+    after = await query_totals(client, auth)
+
+    queries = None
+    if before is not None and after is not None and after[1] > before[1]:
+        queries = (after[0] - before[0]) / (after[1] - before[1])
+    return {
+        "requests_per_second": len(samples) / elapsed,
+        **percentiles(samples),
+        "queries_per_request": queries,
+        "status": {str(code): count for code, count in sorted(statuses.items())},
+    }
+
+
+async def run_all(client, headers, auth, args) -> dict:
+    sample = await Sample.fetch(client, headers)
+    if not sample.posts:
+        raise SystemExit("The database holds no posts; seed it with benchmarks.seed")
+    results = {}
+    for name in args.endpoints:
+        print(f"{name}...", file=sys.stderr)
+        results[name] = await run_endpoint(client, headers, auth, sample, name, args)
+    return results
+
+
+def ensure_corpus(args) -> Optional[dict]:
+    import database
+    import models
+
+    db = database.SessionLocal()
+    try:
+        if db.query(models.Post.post_id).first() is not None:
+            return None
+        print("seeding...", file=sys.stderr)
+        return seed.seed(db, args)
+    finally:
+        db.close()
+
+
+async def run_in_process(args) -> dict:
+    import httpx
+
+    env = {"BLOG_METRICS": "1"}
+    env["BLOG_ADMIN_NAME"], env["BLOG_ADMIN_PASSWORD"] = DOCS_CREDENTIALS
+    if not args.cache:
+        env["BLOG_CACHE_URL"] = "off"
+    main = load_app(args.db_url, **env)
+    corpus = ensure_corpus(args)
+
+    headers = {"X-API-KEY": os.environ["BLOG_API_KEY"]}
+    await main.app.router.startup()
+    try:
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            results = await run_all(client, headers, DOCS_CREDENTIALS, args)
+    finally:
+        await main.app.router.shutdown()
+    return {"corpus": corpus, "endpoints": results}
+
+
+async def run_http(args) -> dict:
+    import httpx
+
+    headers = {"X-API-KEY": args.api_key or ""}
+    auth = (args.docs_user, args.docs_password) if args.docs_user else None
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=30) as client:
+        results = await run_all(client, headers, auth, args)
+    return {"corpus": None, "endpoints": results}
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="load-test a running server instead of the app in-process")
+    parser.add_argument("--db-url", help="in-process database (default: temporary SQLite)")
+    parser.add_argument("--api-key", default=os.environ.get("BLOG_API_KEY"), help="with --url")
+    parser.add_argument("--docs-user", help="with --url, Basic auth for GET /metrics")
+    parser.add_argument("--docs-password")
+    parser.add_argument(
+        "--endpoints",
+        type=lambda value: value.split(","),
+        default=DEFAULT_ENDPOINTS,
+        help=f"comma separated, of: {', '.join(ENDPOINTS)} (default: all but login)",
+    )
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per endpoint")
+    parser.add_argument("--warmup", type=int, default=20, help="requests per endpoint")
+    parser.add_argument("--cache", action="store_true", help="keep the response cache on")
+    parser.add_argument("--out", help="also write the results to this file")
+    seed.add_arguments(parser)
+    args = parser.parse_args(argv)
+    unknown = set(args.endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(sorted(unknown))}")
+
+    run = run_http(args) if args.url else run_in_process(args)
+    result = asyncio.run(run)
+    report = {
+        "meta": {
+            "mode": "http" if args.url else "in-process",
+            "target": args.url or args.db_url or "temporary SQLite",
+            "revision": git_revision(),
+            "started_at": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "cache": args.cache,
+        },
+        **result,
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as file:
+            file.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Read latency with and without a concurrent login storm.
+
+Drives the app in-process: some clients read GET /posts/ in a loop while
+others log in as fast as they can. Compare p99 of the reads with
+--blocking, which verifies passwords on the event loop like the app used
+to, against the default, which uses the bounded hashing pool.
+
+usage: python -m benchmarks.login_storm [--readers 4] [--logins 8] [--duration 5] [--blocking]
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.common import load_app, percentiles
+
+
+async def reader(client, headers, deadline, samples):
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        response = await client.get("/posts/", headers=headers)
+        response.raise_for_status()
+        samples.append(time.perf_counter() - started)
+
+
+async def login(client, deadline, counts):
+    while time.perf_counter() < deadline:
+        response = await client.post(
+            "/login", data={"username": "bench@example.com", "password": "bench"}
+        )
+        counts[response.status_code] = counts.get(response.status_code, 0) + 1
+
+
+async def run_phase(client, headers, args, with_logins):
+    deadline = time.perf_counter() + args.duration
+    samples, counts = [], {}
+    tasks = [reader(client, headers, deadline, samples) for _ in range(args.readers)]
+    if with_logins:
+        tasks += [login(client, deadline, counts) for _ in range(args.logins)]
+    await asyncio.gather(*tasks)
+    result = {"reads": percentiles(samples)}
+    if with_logins:
+        result["logins"] = {
+            "per_second": sum(counts.values()) / args.duration,
+            "status": counts,
+        }
+    return result
+
+
+async def run(args):
+    main = load_app(args.db_url, BLOG_CACHE_URL="off")
+
+    import httpx
+
+    import database
+    import models
+    import passwords
+
+    if args.blocking:
+        # Verify on the event loop, as login did before the hashing pool
+        async def inline(fn, *fn_args):
+            return fn(*fn_args)
+
+        passwords._run = inline
+
+    db = database.SessionLocal()
+    db.add(
+        models.User(
+            user_id="bench",
+            name="bench",
+            email="bench@example.com",
+            hashed_password=passwords.context().hash("bench"),
+            is_active=True,
+        )
+    )
+    db.commit()
+    db.close()
+
+    headers = {"X-API-KEY": "bench"}
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        baseline = await run_phase(client, headers, args, with_logins=False)
+        storm = await run_phase(client, headers, args, with_logins=True)
+    return {
+        "mode": "blocking" if args.blocking else "pool",
+        "baseline": baseline,
+        "storm": storm,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db-url", help="scratch database (default: temporary SQLite)")
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--logins", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per phase")
+    parser.add_argument("--blocking", action="store_true")
+    args = parser.parse_args(argv)
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
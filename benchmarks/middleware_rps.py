@@ -0,0 +1,110 @@
+"""Requests per second through the auth middleware, before and after.
+
+"before" rebuilds the app's middleware stack with the old
+BaseHTTPMiddleware-based guard (the API key then gets checked by the
+`get_api_key` dependency, as it used to); "after" is the app as shipped,
+with the plain ASGI AuthMiddleware. `GET /tags/` is served from memory,
+so the numbers are mostly framework and middleware overhead.
+
+usage: python -m benchmarks.middleware_rps [--path /tags/] [--concurrency 8] [--duration 5]
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.common import load_app, percentiles
+
+
+def legacy_auth_middleware(swagger_creds):
+    import base64
+
+    from starlette.middleware.base import BaseHTTPMiddleware
+    from starlette.responses import Response
+
+    class LegacyAuthMiddleware(BaseHTTPMiddleware):
+        async def dispatch(self, request, call_next):
+            if request.url.path in ["/docs", "/openapi.json"]:
+                auth = request.headers.get("Authorization")
+                try:
+                    _, auth_string = auth.split()
+                    username, password = (
+                        base64.b64decode(auth_string).decode("utf-8").split(":")
+                    )
+                    if swagger_creds.get(username) != password:
+                        raise ValueError()
+                except (AttributeError, ValueError):
+                    return Response(headers={"WWW-Authenticate": "Basic"}, status_code=401)
+            return await call_next(request)
+
+    return LegacyAuthMiddleware
+
+
+def use_middleware(app, auth_cls, **options):
+    from starlette.middleware import Middleware
+
+    cors = next(m for m in app.user_middleware if m.cls.__name__ == "CORSMiddleware")
+    app.user_middleware = [cors, Middleware(auth_cls, **options)]
+    app.middleware_stack = app.build_middleware_stack()
+
+
+async def worker(client, path, headers, deadline, samples):
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        response = await client.get(path, headers=headers)
+        response.raise_for_status()
+        samples.append(time.perf_counter() - started)
+
+
+async def run_phase(app, args):
+    import httpx
+
+    headers = {"X-API-KEY": "bench", "Origin": "http://example.com"}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        # Warm up: builds the middleware stack and the tag catalog
+        (await client.get(args.path, headers=headers)).raise_for_status()
+        samples = []
+        deadline = time.perf_counter() + args.duration
+        await asyncio.gather(
+            *(
+                worker(client, args.path, headers, deadline, samples)
+                for _ in range(args.concurrency)
+            )
+        )
+    return {"requests_per_second": len(samples) / args.duration, **percentiles(samples)}
+
+
+async def run(args):
+    main = load_app(args.db_url, BLOG_CACHE_URL="off")
+
+    import middleware
+
+    results = {}
+    use_middleware(main.app, legacy_auth_middleware(main.swagger_creds))
+    results["before"] = await run_phase(main.app, args)
+    use_middleware(
+        main.app,
+        middleware.AuthMiddleware,
+        api_key=main.API_KEY,
+        docs_credentials=main.swagger_creds,
+    )
+    results["after"] = await run_phase(main.app, args)
+    results["speedup"] = (
+        results["after"]["requests_per_second"] / results["before"]["requests_per_second"]
+    )
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db-url", help="scratch database (default: temporary SQLite)")
+    parser.add_argument("--path", default="/tags/")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per phase")
+    args = parser.parse_args(argv)
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""Fill a database with a synthetic blog.
+
+N users share M posts of Markdown about as long as real ones (headings,
+paragraphs, lists and code blocks), tagged from T tags. Tag popularity is
+skewed like real blogs, a few tags on most posts and a long tail, and each
+post gets up to --tags-per-post of them. The same --seed always makes the
+same corpus, so runs on different branches read the same data.
+
+Every user logs in with `user{n}@example.com` / `bench`.
+
+usage: python -m benchmarks.seed --db-url sqlite:///bench.db [--users 50] [--posts 5000] [--tags 40]
+"""
+import argparse
+import datetime
+import json
+import random
+import time
+import uuid
+
+WORDS = (
+    "async await api cache client database deploy docker endpoint fastapi index "
+    "latency markdown migration model orm pagination postgres python query redis "
+    "request response schema server session sqlite table test thread token worker"
+).split()
+PASSWORD = "bench"
+# Posts are spread over this many days before the seed's fixed "now"
+SPAN_DAYS = 730
+NOW = datetime.datetime(2024, 1, 1)
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    group = parser.add_argument_group("corpus")
+    group.add_argument("--users", type=int, default=50)
+    group.add_argument("--posts", type=int, default=5000)
+    group.add_argument("--tags", type=int, default=40)
+    group.add_argument("--tags-per-post", type=int, default=3, help="at most")
+    group.add_argument("--paragraphs", type=int, default=12, help="per post, on average")
+    group.add_argument("--seed", type=int, default=1)
+
+
+def sentence(rng: random.Random, words: int) -> str:
+    text = " ".join(rng.choice(WORDS) for _ in range(words))
+    return text[0].upper() + text[1:] + "."
+
+
+def markdown(rng: random.Random, paragraphs: int) -> str:
+    blocks = []
+    for _ in range(max(1, int(rng.gauss(paragraphs, paragraphs / 3)))):
+        kind = rng.random()
+        if kind < 0.12:
+            blocks.append("## " + sentence(rng, rng.randint(2, 5))[:-1])
+        elif kind < 0.22:
+            items = ("- " + sentence(rng, rng.randint(3, 9)) for _ in range(rng.randint(2, 5)))
+            blocks.append("\n".join(items))
+        elif kind < 0.30:
+            lines = (
+                f"{rng.choice(WORDS)} = {rng.choice(WORDS)}({rng.randint(0, 99)})"
+                for _ in range(rng.randint(2, 8))
+            )
+            blocks.append("```python\n" + "\n".join(lines) + "\n```")
+        else:
+            sentences = (sentence(rng, rng.randint(6, 18)) for _ in range(rng.randint(3, 7)))
+            blocks.append(" ".join(sentences))
+    return "\n\n".join(blocks)
+
+
+def seed(db, args) -> dict:
+    """Insert the corpus described by `args` and return what was made."""
+    import crud
+    import models
+    import passwords
+    import schemas
+
+    rng = random.Random(args.seed)
+    hashed_password = passwords.context().hash(PASSWORD)
+    user_ids = [str(uuid.UUID(int=rng.getrandbits(128))) for _ in range(args.users)]
+    db.add_all(
+        models.User(
+            user_id=user_id,
+            name=f"user{n}",
+            email=f"user{n}@example.com",
+            hashed_password=hashed_password,
+            is_active=True,
+        )
+        for n, user_id in enumerate(user_ids)
+    )
+    tag_names = [f"tag{n}" for n in range(args.tags)]
+    db.add_all(
+        models.Tag(
+            id=str(uuid.UUID(int=rng.getrandbits(128))),
+            title=name.title(),
+            meta_title=name,
+            icon_image_url=f"https://example.com/{name}.png",
+        )
+        for name in tag_names
+    )
+    db.commit()
+
+    # Zipf-like: tag n is picked about 1/(n+1) as often as tag0
+    tag_weights = [1 / (n + 1) for n in range(args.tags)]
+    items: dict[str, list] = {user_id: [] for user_id in user_ids}
+    for n in range(args.posts):
+        tags = set()
+        if tag_names:
+            count = rng.randint(0, args.tags_per_post)
+            tags = set(rng.choices(tag_names, weights=tag_weights, k=count))
+        items[rng.choice(user_ids)].append(
+            schemas.PostImport(
+                title=sentence(rng, rng.randint(3, 8))[:-1],
+                content=markdown(rng, args.paragraphs),
+                emoji=rng.choice("📝🐍🚀🔧📦"),
+                tags=sorted(tags),
+                category=rng.choice(("tech", "idea")),
+                slug=f"post-{n}",
+                created_at=NOW - datetime.timedelta(seconds=rng.randrange(SPAN_DAYS * 86400)),
+            )
+        )
+    for user_id, user_items in items.items():
+        for start in range(0, len(user_items), 500):
+            crud.bulk_create_posts(db, user_id, user_items[start : start + 500])
+    return {"users": args.users, "posts": args.posts, "tags": args.tags}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db-url", required=True)
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    from benchmarks.common import load_app
+
+    load_app(args.db_url)
+
+    import database
+
+    started = time.perf_counter()
+    db = database.SessionLocal()
+    try:
+        made = seed(db, args)
+    finally:
+        db.close()
+    print(json.dumps({**made, "seconds": round(time.perf_counter() - started, 2)}))
+
+
+if __name__ == "__main__":
+    main()
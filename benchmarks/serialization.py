@@ -0,0 +1,95 @@
+"""Cost of serializing one page of `GET /posts/`, per page size.
+
+"default" is what FastAPI does with a response_model: validate every item,
+run it through `jsonable_encoder` and encode with the json module. "fast"
+is the BLOG_FAST_JSON path: project the rows onto the model's fields and
+encode them with orjson (json when orjson is missing).
+
+usage: python -m benchmarks.serialization [--sizes 10,100,1000] [--repeat 200]
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import time
+from collections import namedtuple
+
+Row = namedtuple("Row", "post_id emoji slug title created_at category username")
+
+
+def make_rows(count: int) -> list:
+    started = datetime.datetime(2023, 1, 1)
+    return [
+        Row(
+            post_id=f"{number:08d}-0000-0000-0000-000000000000",
+            emoji="📝",
+            slug=f"post-{number}",
+            title=f"Post number {number}",
+            created_at=started + datetime.timedelta(minutes=number),
+            category="tech",
+            username="bench",
+        )
+        for number in range(count)
+    ]
+
+
+async def time_per_page(render, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        await render()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+async def run(args):
+    from fastapi.responses import JSONResponse
+    from fastapi.routing import serialize_response
+    from fastapi.utils import create_response_field
+
+    import fastjson
+    import schemas
+
+    field = create_response_field(name="bench", type_=list[schemas.PostCard])
+    results = []
+    for size in args.sizes:
+        rows = make_rows(size)
+
+        async def default():
+            content = await serialize_response(
+                field=field,
+                response_content=[row._asdict() for row in rows],
+                is_coroutine=True,
+            )
+            return JSONResponse(content).body
+
+        async def fast():
+            content = [fastjson.project(row, schemas.PostCard) for row in rows]
+            return fastjson.FastJSONResponse(content).body
+
+        assert json.loads(await default()) == json.loads(await fast())
+        default_ms = await time_per_page(default, args.repeat)
+        fast_ms = await time_per_page(fast, args.repeat)
+        results.append(
+            {
+                "page_size": size,
+                "default_ms": default_ms,
+                "fast_ms": fast_ms,
+                "speedup": default_ms / fast_ms,
+            }
+        )
+    return {"encoder": "orjson" if fastjson.orjson else "json", "pages": results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        type=lambda value: [int(size) for size in value.split(",")],
+        default=[10, 100, 1000],
+    )
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args(argv)
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Cold start: import time, time to ready and first-request latency.
+
+Every run starts a fresh interpreter against a small seeded SQLite
+database and measures, in that process:
+
+    import_ms          `import main`
+    startup_ms         the startup events
+    ready_ms           until the warm-up has finished (GET /startup is 200)
+    first_request_ms   the first GET /posts/
+    second_request_ms  the one after it
+
+"warm" waits for readiness before the first request, as a load balancer
+does; "cold" skips the warm-up and sends it straight after startup.
+Medians over --runs are printed as JSON.
+
+usage: python -m benchmarks.startup [--runs 5] [--path /posts/]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+PROBE = """
+import time
+started = time.perf_counter()
+import dotenv
+dotenv.load_dotenv = lambda *args, **kwargs: False
+import main
+imported = time.perf_counter()
+
+import asyncio
+import json
+import sys
+
+import httpx
+
+from warmup import warm_up
+
+
+async def probe(path, cold):
+    if cold:
+        async def skip(*args):
+            pass
+
+        warm_up.start = skip
+    begun = time.perf_counter()
+    await main.app.router.startup()
+    started_up = time.perf_counter()
+    while not cold and not warm_up.ready:
+        await asyncio.sleep(0.001)
+    ready = time.perf_counter()
+    headers = {"X-API-KEY": "bench"}
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        latencies = []
+        for _ in range(2):
+            sent = time.perf_counter()
+            (await client.get(path, headers=headers)).raise_for_status()
+            latencies.append(time.perf_counter() - sent)
+    await main.app.router.shutdown()
+    print(json.dumps({
+        "import_ms": (imported - started) * 1000,
+        "startup_ms": (started_up - begun) * 1000,
+        "ready_ms": (ready - begun) * 1000,
+        "first_request_ms": latencies[0] * 1000,
+        "second_request_ms": latencies[1] * 1000,
+    }))
+
+
+asyncio.run(probe(sys.argv[1], sys.argv[2] == "cold"))
+"""
+
+
+def run_probe(env: dict, path: str, mode: str) -> dict:
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE, path, mode],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=os.getcwd(),
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--path", default="/posts/")
+    parser.add_argument("--posts", type=int, default=500, help="in the seeded database")
+    args = parser.parse_args(argv)
+
+    db_url = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "startup.db")
+    env = dict(
+        os.environ,
+        BLOG_DB_URL=db_url,
+        BLOG_API_KEY="bench",
+        BLOG_SECRET_KEY="bench-secret",
+        BLOG_CACHE_URL="off",
+        PYTHONPATH=os.getcwd(),
+    )
+    subprocess.run(
+        [sys.executable, "-m", "benchmarks.seed", "--db-url", db_url, "--users", "10",
+         "--posts", str(args.posts)],
+        env=dict(env, BLOG_BCRYPT_ROUNDS="4"),
+        capture_output=True,
+        check=True,
+    )
+
+    results = {}
+    for mode in ("warm", "cold"):
+        runs = [run_probe(env, args.path, mode) for _ in range(args.runs)]
+        results[mode] = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict, defaultdict
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+
+from fastapi.encoders import jsonable_encoder
+from starlette.requests import Request
+
+# "memory://?maxsize=1024", "redis://host:6379/0" or "off"
+CACHE_URL = os.environ.get("BLOG_CACHE_URL", "memory://")
+CACHE_TTL = int(os.environ.get("BLOG_CACHE_TTL", "300"))
+KEY_PREFIX = "blog"
+
+
+class MemoryBackend:
+    """Bounded in-process LRU cache with a TTL per entry."""
+
+    # Other processes only see its invalidations through invalidation.py
+    shared = False
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        # Namespace versions live outside the LRU so they are never evicted
+        self._counters: dict[str, int] = defaultdict(int)
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: str, ttl: int):
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    async def get_counter(self, key: str) -> int:
+        return self._counters[key]
+
+    async def incr(self, key: str) -> int:
+        self._counters[key] += 1
+        return self._counters[key]
+
+    async def clear(self):
+        self._entries.clear()
+        self._counters.clear()
+
+
+class RedisBackend:
+    """Cache stored in Redis, or anything that speaks its protocol.
+
+    `client` is a `redis.asyncio.Redis`-compatible object, so a stand-in such
+    as `fakeredis.aioredis.FakeRedis` can be passed in directly.
+    """
+
+    def __init__(self, client):
+        self._client = client
+
+    @classmethod
+    def from_url(cls, url: str):
+        import redis.asyncio
+
+        return cls(redis.asyncio.from_url(url, decode_responses=True))
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self._client.get(key)
+
+    async def set(self, key: str, value: str, ttl: int):
+        await self._client.set(key, value, ex=ttl)
+
+    async def get_counter(self, key: str) -> int:
+        return int(await self._client.get(key) or 0)
+
+    async def incr(self, key: str) -> int:
+        return await self._client.incr(key)
+
+    async def clear(self):
+        keys = [key async for key in self._client.scan_iter(f"{KEY_PREFIX}:*")]
+        if keys:
+            await self._client.delete(*keys)
+
+
+class ResponseCache:
+    """Read-through cache for GET responses, grouped into namespaces.
+
+    Entries are keyed on the route, its query parameters and the current
+    version of their namespace. Invalidating a namespace bumps its version,
+    so every entry under it is skipped at once and ages out on its own.
+    """
+
+    def __init__(self, backend=None, ttl: int = CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits: dict[str, int] = defaultdict(int)
+        self.misses: dict[str, int] = defaultdict(int)
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None
+
+    async def key(self, namespace: str, request: Request) -> str:
+        version = await self.backend.get_counter(f"{KEY_PREFIX}:version:{namespace}")
+        query = sorted(request.query_params.multi_items())
+        raw = json.dumps([request.url.path, query], separators=(",", ":"))
+        digest = hashlib.sha1(raw.encode()).hexdigest()
+        return f"{KEY_PREFIX}:{namespace}:{version}:{digest}"
+
+    async def lookup(self, namespace: str, request: Request):
+        """Return (key, entry); entry is None on a miss or when disabled."""
+        if not self.enabled:
+            return None, None
+        key = await self.key(namespace, request)
+        value = await self.backend.get(key)
+        if value is None:
+            self.misses[namespace.split(":")[0]] += 1
+            return key, None
+        self.hits[namespace.split(":")[0]] += 1
+        return key, json.loads(value)
+
+    async def store(self, key: Optional[str], body, headers: Optional[dict] = None):
+        if key is None:
+            return
+        entry = {"body": jsonable_encoder(body), "headers": headers or {}}
+        await self.backend.set(key, json.dumps(entry), self.ttl)
+
+    async def invalidate(self, *namespaces: str):
+        if not self.enabled:
+            return
+        for namespace in namespaces:
+            await self.backend.incr(f"{KEY_PREFIX}:version:{namespace}")
+
+    def stats(self) -> dict:
+        namespaces = sorted(set(self.hits) | set(self.misses))
+        return {
+            "enabled": self.enabled,
+            "hits": sum(self.hits.values()),
+            "misses": sum(self.misses.values()),
+            "namespaces": {
+                namespace: {
+                    "hits": self.hits[namespace],
+                    "misses": self.misses[namespace],
+                }
+                for namespace in namespaces
+            },
+        }
+
+
+def backend_from_url(url: str):
+    if not url or url == "off":
+        return None
+    parsed = urlparse(url)
+    if parsed.scheme == "memory":
+        maxsize = parse_qs(parsed.query).get("maxsize", ["1024"])[0]
+        return MemoryBackend(maxsize=int(maxsize))
+    if parsed.scheme in ("redis", "rediss", "unix"):
+        return RedisBackend.from_url(url)
+    raise ValueError(f"Unsupported BLOG_CACHE_URL: {url}")
+
+
+response_cache = ResponseCache(backend_from_url(CACHE_URL))
+
+
+# Namespaces
+POSTS = "posts"
+
+
+def post_namespace(username: str, slug: str) -> str:
+    return f"post:{username}:{slug}"
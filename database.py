@@ -1,4 +1,6 @@
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
@@ -10,9 +12,60 @@ load_dotenv(override=True)
 # SQLALCHEMY_DATABASE_URL = "sqlite:///./sql_app.db"
 SQLALCHEMY_DATABASE_URL = os.environ.get('BLOG_DB_URL')
 
+# Connection pool settings (ignored for SQLite)
+POOL_SIZE = int(os.environ.get("BLOG_DB_POOL_SIZE", "10"))
+MAX_OVERFLOW = int(os.environ.get("BLOG_DB_MAX_OVERFLOW", "20"))
+POOL_TIMEOUT = int(os.environ.get("BLOG_DB_POOL_TIMEOUT", "30"))
+POOL_RECYCLE = int(os.environ.get("BLOG_DB_POOL_RECYCLE", "1800"))
+POOL_PRE_PING = os.environ.get("BLOG_DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+# Read replicas, comma separated. Read-only routes are spread over them
+# (see replicas.py); without any everything goes to BLOG_DB_URL.
+REPLICA_URLS = [
+    url.strip() for url in os.environ.get("BLOG_DB_REPLICA_URLS", "").split(",") if url.strip()
+]
+
+# Async drivers used in place of the sync ones from BLOG_DB_URL
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+def engine_options(url: str) -> dict:
+    options = {"pool_pre_ping": POOL_PRE_PING, "pool_recycle": POOL_RECYCLE}
+    if make_url(url).get_backend_name() != "sqlite":
+        options.update(
+            pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW, pool_timeout=POOL_TIMEOUT
+        )
+    return options
+
+
+def async_url(url: str):
+    """Swap the driver of a sync database URL for its asyncio counterpart."""
+    url = make_url(url)
+    driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    if driver is None or url.get_driver_name() in ("asyncpg", "aiosqlite"):
+        return url
+    return url.set(drivername=driver)
+
+
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL
+    SQLALCHEMY_DATABASE_URL, **engine_options(SQLALCHEMY_DATABASE_URL)
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Used by the API. Objects stay usable after commit because lazy refreshes
+# can't run outside of the session's greenlet.
+async_engine = create_async_engine(
+    async_url(SQLALCHEMY_DATABASE_URL), **engine_options(SQLALCHEMY_DATABASE_URL)
+)
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, autoflush=False, expire_on_commit=False
+)
+
+replica_engines = [
+    create_async_engine(async_url(url), **engine_options(url)) for url in REPLICA_URLS
+]
+
 Base = declarative_base()
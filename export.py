@@ -0,0 +1,260 @@
+"""Export the public blog as static JSON files and sitemaps.
+
+The files mirror the read-only routes, so a CDN or any static file server
+can answer every public read:
+
+    posts/index.json                  GET /posts/ (first page)
+    posts/pages/{n}.json              GET /posts/, page n
+    posts/{username}/{slug}/index.json
+                                      GET /posts/{username}/{slug}/
+    tags/index.json                   GET /tags/
+    tags/{tag_id}.json                GET /tags/{tag_id}
+    sitemap.xml                       every post (a sitemap index past 50,000)
+
+Runs are incremental: the ETag of every exported post is kept in
+`.export-state.json`, and only posts that were added, changed or removed
+since the last run are written or deleted. Posts are exported in batches
+by --workers threads, each with its own database session. Files are only
+rewritten when their content changes, so their mtimes stay useful for
+syncing.
+
+Usernames, slugs and tag ids become path segments, so only ones made of
+letters, digits, `_` and `-` are exported; others are skipped with a
+warning, and no file is written or removed outside OUT_DIR.
+
+usage: python export.py OUT_DIR --base-url https://blog.example.com [--workers 8] [--full]
+"""
+import argparse
+import datetime
+import json
+import os
+import pathlib
+import re
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from xml.sax.saxutils import escape
+
+import conditional
+import crud
+import fastjson
+import pagination
+import schemas
+from database import SessionLocal
+from tag_catalog import TagCatalog
+
+STATE_FILE = ".export-state.json"
+SITEMAP_URLS = 50000
+SAFE_SEGMENT = re.compile(r"[A-Za-z0-9_-]+")
+
+
+class UnsafePath(ValueError):
+    pass
+
+
+def segment(value: str) -> str:
+    """`value` as a single path segment, if it is a plain name."""
+    if not isinstance(value, str) or not SAFE_SEGMENT.fullmatch(value):
+        raise UnsafePath(f"unsafe path segment {value!r}")
+    return value
+
+
+def under(root: pathlib.Path, path: pathlib.Path) -> pathlib.Path:
+    """`path`, if it resolves to somewhere inside `root`."""
+    if not path.resolve().is_relative_to(root.resolve()):
+        raise UnsafePath(f"{path} is outside {root}")
+    return path
+
+
+def warn(message: str):
+    print(f"skipped: {message}", file=sys.stderr)
+
+
+def write(path: pathlib.Path, data: bytes) -> bool:
+    """Atomically write `data`, unless the file already holds it."""
+    try:
+        if path.read_bytes() == data:
+            return False
+    except FileNotFoundError:
+        path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+    with os.fdopen(fd, "wb") as file:
+        file.write(data)
+    os.replace(tmp, path)
+    return True
+
+
+def post_path(out: pathlib.Path, username: str, slug: str) -> pathlib.Path:
+    return under(out, out / "posts" / segment(username) / segment(slug) / "index.json")
+
+
+def load_state(out: pathlib.Path) -> dict:
+    try:
+        return json.loads((out / STATE_FILE).read_text())["posts"]
+    except (FileNotFoundError, KeyError, ValueError):
+        return {}
+
+
+def export_posts(out: pathlib.Path, post_ids: list[str]) -> int:
+    """Write the pages of `post_ids`; runs in a worker thread."""
+    db = SessionLocal()
+    try:
+        written = 0
+        for post in crud.get_posts_by_ids(db, post_ids):
+            body = schemas.PostShow(**crud.post_detail(post)).dict()
+            written += write(post_path(out, post.user.name, post.slug), fastjson.dumps(body))
+        return written
+    finally:
+        db.close()
+
+
+def export_listing(db, out: pathlib.Path, page_size: int) -> int:
+    pages = []
+    cursor = None
+    while True:
+        cards = crud.get_post_cards(db, limit=page_size, cursor=cursor)
+        pages.append([fastjson.project(card, schemas.PostCard) for card in cards])
+        cursor = pagination.next_cursor(cards, page_size, "created_at", "post_id")
+        if not cursor:
+            break
+    written = write(out / "posts" / "index.json", fastjson.dumps(pages[0]))
+    for number, page in enumerate(pages, start=1):
+        written += write(out / "posts" / "pages" / f"{number}.json", fastjson.dumps(page))
+    # Pages past the end from a time when there were more posts
+    for path in (out / "posts" / "pages").glob("*.json"):
+        if path.stem.isdigit() and int(path.stem) > len(pages):
+            path.unlink()
+    return written
+
+
+def export_tags(db, out: pathlib.Path) -> int:
+    catalog = TagCatalog()
+    catalog.load(db)
+    tags = catalog.all()
+    written = write(out / "tags" / "index.json", fastjson.dumps(tags))
+    for tag in tags:
+        try:
+            path = under(out, out / "tags" / f"{segment(tag['tag_id'])}.json")
+        except UnsafePath as error:
+            warn(f"tag: {error}")
+            continue
+        written += write(path, fastjson.dumps(tag))
+    return written
+
+
+def sitemap(urls: list[tuple[str, datetime.datetime]]) -> bytes:
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>']
+    lines.append('<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">')
+    for url, modified in urls:
+        lastmod = f"<lastmod>{modified.date().isoformat()}</lastmod>" if modified else ""
+        lines.append(f"<url><loc>{escape(url)}</loc>{lastmod}</url>")
+    lines.append("</urlset>")
+    return "\n".join(lines).encode("utf-8")
+
+
+def export_sitemaps(out: pathlib.Path, versions, args) -> int:
+    urls = [
+        (
+            args.post_url.format(
+                base_url=args.base_url.rstrip("/"), username=row.username, slug=row.slug
+            ),
+            row.updated_at or row.created_at,
+        )
+        for row in versions
+    ]
+    if len(urls) <= SITEMAP_URLS:
+        return write(out / "sitemap.xml", sitemap(urls))
+
+    written = 0
+    index = ['<?xml version="1.0" encoding="UTF-8"?>']
+    index.append('<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">')
+    for number, start in enumerate(range(0, len(urls), SITEMAP_URLS), start=1):
+        name = f"sitemap-{number}.xml"
+        written += write(out / name, sitemap(urls[start : start + SITEMAP_URLS]))
+        index.append(f"<sitemap><loc>{escape(args.base_url.rstrip('/'))}/{name}</loc></sitemap>")
+    index.append("</sitemapindex>")
+    return written + write(out / "sitemap.xml", "\n".join(index).encode("utf-8"))
+
+
+def remove_post(out: pathlib.Path, path: str):
+    # The path comes from the state file, so it is checked like a new one
+    try:
+        file = under(out / "posts", out / path)
+    except UnsafePath as error:
+        warn(f"removing a post: {error}")
+        return
+    file.unlink(missing_ok=True)
+    # Drop the directories the post leaves empty
+    for parent in file.parents:
+        if parent == out or any(parent.iterdir()):
+            break
+        parent.rmdir()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the blog as static JSON files.")
+    parser.add_argument("out_dir", type=pathlib.Path)
+    parser.add_argument("--base-url", required=True, help="public URL of the blog, for sitemaps")
+    parser.add_argument(
+        "--post-url",
+        default="{base_url}/{username}/{slug}",
+        help="public URL of a post page (default: %(default)s)",
+    )
+    parser.add_argument("--workers", type=int, default=min(32, (os.cpu_count() or 1) * 2))
+    parser.add_argument("--batch-size", type=int, default=200, help="posts per worker task")
+    parser.add_argument("--page-size", type=int, default=100, help="posts per listing page")
+    parser.add_argument("--full", action="store_true", help="export every post again")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    out = args.out_dir
+    out.mkdir(parents=True, exist_ok=True)
+    previous = {} if args.full else load_state(out)
+
+    db = SessionLocal()
+    try:
+        versions = crud.get_all_post_versions(db)
+        state = {}
+        for row in versions:
+            try:
+                path = post_path(out, row.username, row.slug)
+            except UnsafePath as error:
+                warn(f"post {row.post_id}: {error}")
+                continue
+            state[row.post_id] = {
+                "etag": conditional.post_validators(row)[0],
+                "path": str(path.relative_to(out)),
+            }
+        changed = [post_id for post_id, entry in state.items() if previous.get(post_id) != entry]
+        removed = [
+            entry["path"]
+            for post_id, entry in previous.items()
+            if state.get(post_id, {}).get("path") != entry["path"]
+        ]
+
+        for path in removed:
+            remove_post(out, path)
+        batches = [
+            changed[start : start + args.batch_size]
+            for start in range(0, len(changed), args.batch_size)
+        ]
+        with ThreadPoolExecutor(max_workers=args.workers) as pool:
+            written = sum(pool.map(lambda batch: export_posts(out, batch), batches))
+
+        written += export_listing(db, out, args.page_size)
+        written += export_tags(db, out)
+        written += export_sitemaps(out, versions, args)
+    finally:
+        db.close()
+
+    write(out / STATE_FILE, json.dumps({"posts": state}, indent=0).encode("utf-8"))
+    print(
+        f"exported {len(changed)} changed posts of {len(state)}, removed {len(removed)}, "
+        f"{written} files written in {time.perf_counter() - started:.2f}s"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
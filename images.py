@@ -0,0 +1,194 @@
+"""Uploaded images: the original without its metadata, and responsive
+derivatives.
+
+Every upload is decoded before anything is stored, so a file that is not
+an image is refused without leaving anything behind. The original is
+stored encoded again without EXIF (GPS included), XMP or comments: JPEGs
+keep their quantization tables, so they lose next to nothing, PNG, GIF
+and WebP are lossless, and other formats are stored as PNG.
+
+The CPU-heavy work runs in a process pool so it never blocks the API. This
+module is imported by the pool's worker processes, so it must stay free of
+app imports.
+"""
+import asyncio
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+WIDTHS = tuple(
+    int(width) for width in os.environ.get("BLOG_IMAGE_WIDTHS", "320,640,1280").split(",")
+)
+WORKERS = int(os.environ.get("BLOG_IMAGE_WORKERS", "2"))
+QUALITY = int(os.environ.get("BLOG_IMAGE_QUALITY", "80"))
+
+CONTENT_TYPES = {"WEBP": "image/webp", "AVIF": "image/avif"}
+ORIGINAL_TYPES = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+    "GIF": "image/gif",
+    "WEBP": "image/webp",
+}
+
+
+class InvalidImage(Exception):
+    pass
+
+
+def _formats() -> list[str]:
+    from PIL import features
+
+    formats = ["WEBP"]
+    try:
+        if features.check("avif"):
+            formats.append("AVIF")
+    except ValueError:
+        # Pillow without AVIF support doesn't know the feature name
+        pass
+    return formats
+
+
+def _open(path: str):
+    from PIL import Image, UnidentifiedImageError
+
+    try:
+        source = Image.open(path)
+        source.load()
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as e:
+        raise InvalidImage(str(e)) from e
+    return source
+
+
+def _without_metadata(image):
+    image.info = {
+        key: image.info[key]
+        for key in ("transparency", "icc_profile", "duration", "loop")
+        if key in image.info
+    }
+    return image
+
+
+def strip_original(source, path: str) -> str:
+    """Write `source` to `path` encoded again in its format (or PNG) without
+    metadata. Returns its content type."""
+    from PIL import ImageOps, ImageSequence, JpegImagePlugin
+
+    # MPO is what cameras make of a JPEG with a preview or a second view
+    fmt = "JPEG" if source.format == "MPO" else source.format
+    if fmt not in ORIGINAL_TYPES:
+        fmt = "PNG"
+    params = {}
+    if getattr(source, "n_frames", 1) > 1 and fmt != "JPEG":
+        frames = [_without_metadata(frame.copy()) for frame in ImageSequence.Iterator(source)]
+        image = frames[0]
+        params.update(save_all=True, append_images=frames[1:])
+    else:
+        # Apply the EXIF orientation, since the tag itself is dropped
+        image = _without_metadata(ImageOps.exif_transpose(source))
+    if fmt == "JPEG":
+        params.update(
+            qtables=source.quantization,
+            subsampling=JpegImagePlugin.get_sampling(source),
+        )
+    elif fmt == "WEBP":
+        params.update(lossless=True)
+    params.update(image.info)
+
+    image.save(path, format=fmt, **params)
+    return ORIGINAL_TYPES[fmt]
+
+
+def _derivatives(source, widths, quality: int) -> list[dict]:
+    """`source` encoded at every width no larger than the original, in WebP
+    (and AVIF when available), without metadata."""
+    from PIL import Image, ImageOps
+
+    # Apply the EXIF orientation, since the tag itself is dropped
+    image = ImageOps.exif_transpose(source)
+    if image.mode not in ("RGB", "RGBA"):
+        has_alpha = image.mode in ("LA", "PA") or "transparency" in image.info
+        image = image.convert("RGBA" if has_alpha else "RGB")
+    # Nothing of the original's metadata is written with the derivatives
+    image.info = {}
+
+    sizes = sorted({width for width in widths if width < image.width} | {image.width})
+    formats = _formats()
+    derivatives = []
+    # Largest first, each size scaled down from the previous one
+    current = image
+    for width in reversed(sizes):
+        height = max(1, round(image.height * width / image.width))
+        if current.width != width:
+            current = current.resize((width, height), Image.LANCZOS, reducing_gap=3.0)
+        for fmt in formats:
+            buffer = io.BytesIO()
+            current.save(buffer, format=fmt, quality=quality)
+            derivatives.append(
+                {
+                    "width": width,
+                    "height": height,
+                    "format": fmt.lower(),
+                    "content_type": CONTENT_TYPES[fmt],
+                    "data": buffer.getvalue(),
+                }
+            )
+    derivatives.reverse()
+    return derivatives
+
+
+_executor = None
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _executor
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(cancel_futures=True)
+        _executor = None
+
+
+def prepare_upload(
+    path: str, original_path: str, widths=WIDTHS, quality: int = QUALITY
+) -> tuple[str, list[dict]]:
+    """Decode the upload at `path` once, write it without metadata to
+    `original_path` and render its derivatives (none without `widths`).
+    Returns the original's content type and the derivatives. Raises
+    InvalidImage for anything that is not an image."""
+    with _open(path) as source:
+        content_type = strip_original(source, original_path)
+        derivatives = _derivatives(source, widths, quality) if widths else []
+    return content_type, derivatives
+
+
+async def prepare(path: str, original_path: str, widths=WIDTHS) -> tuple[str, list[dict]]:
+    # Files, not bytes, go to the worker, so the upload is never held in
+    # memory or pickled by the API process
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_executor(), prepare_upload, path, original_path, widths
+    )
+
+
+def manifest(items: list[dict]) -> dict:
+    """`srcset` strings per content type, plus every derivative's details."""
+    srcset: dict[str, list[str]] = {}
+    for item in items:
+        srcset.setdefault(item["content_type"], []).append(
+            f'{item["url"]} {item["width"]}w'
+        )
+    return {
+        "images": [
+            {key: item[key] for key in ("url", "width", "height", "content_type")}
+            for item in items
+        ],
+        "srcset": {content_type: ", ".join(urls) for content_type, urls in srcset.items()},
+    }
@@ -0,0 +1,135 @@
+"""Bulk import posts from a Markdown export.
+
+Each `*.md` file under the export directory becomes one post. An optional
+front matter block sets the post fields; anything missing falls back to the
+file name and the command line defaults:
+
+    ---
+    title: My post
+    slug: my-post
+    category: tech
+    emoji: 📝
+    tags: [python, fastapi]
+    date: 2023-11-02T10:00:00
+    ---
+    Markdown body...
+
+A `date` without an offset is taken to be UTC. Files with an invalid date
+or an unknown category are reported and skipped.
+
+usage: python import_posts.py EXPORT_DIR --email author@example.com
+"""
+import argparse
+import datetime
+import pathlib
+import sys
+import time
+
+import cache
+import crud
+import invalidation
+import schemas
+from database import SessionLocal
+
+
+def parse_front_matter(text: str) -> tuple[dict, str]:
+    if not text.startswith("---"):
+        return {}, text
+    header, sep, body = text[3:].partition("\n---")
+    if not sep:
+        return {}, text
+    meta = {}
+    for line in header.strip().splitlines():
+        key, sep, value = line.partition(":")
+        if sep:
+            meta[key.strip().lower()] = value.strip().strip("\"'")
+    return meta, body.lstrip("\n")
+
+
+def parse_tags(value: str) -> list[str]:
+    value = value.strip().lstrip("[").rstrip("]")
+    return [tag.strip().strip("\"'") for tag in value.split(",") if tag.strip()]
+
+
+def load_post(path: pathlib.Path, args) -> schemas.PostImport:
+    meta, body = parse_front_matter(path.read_text(encoding="utf-8"))
+    created_at = None
+    if meta.get("date"):
+        try:
+            created_at = datetime.datetime.fromisoformat(meta["date"])
+        except ValueError:
+            raise ValueError(f"invalid date {meta['date']}") from None
+    return schemas.PostImport(
+        title=meta.get("title") or path.stem,
+        slug=meta.get("slug") or path.stem,
+        content=body,
+        category=meta.get("category") or args.category,
+        emoji=meta.get("emoji") or args.emoji,
+        tags=parse_tags(meta.get("tags", "")),
+        created_at=created_at,
+    )
+
+
+def chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import posts from Markdown files.")
+    parser.add_argument("export_dir", type=pathlib.Path)
+    parser.add_argument("--email", required=True, help="email of the author")
+    parser.add_argument("--chunk-size", type=int, default=500, help="posts per transaction")
+    parser.add_argument("--category", default="tech", choices=crud.CATEGORIES)
+    parser.add_argument("--emoji", default="📝")
+    args = parser.parse_args(argv)
+
+    paths = sorted(args.export_dir.rglob("*.md"))
+    if not paths:
+        print(f"No .md files found under {args.export_dir}", file=sys.stderr)
+        return 1
+
+    db = SessionLocal()
+    try:
+        user = crud.get_user_by_email(db, args.email)
+        if user is None:
+            print(f"No user with email {args.email}", file=sys.stderr)
+            return 1
+
+        started = time.perf_counter()
+        imported = 0
+        for number, chunk in enumerate(chunks(paths, args.chunk_size), start=1):
+            chunk_started = time.perf_counter()
+            items = []
+            for path in chunk:
+                try:
+                    item = load_post(path, args)
+                except ValueError as error:
+                    print(f"{path}: {error}", file=sys.stderr)
+                    continue
+                if item.category not in crud.CATEGORIES:
+                    print(f"{path}: unknown category {item.category}", file=sys.stderr)
+                    continue
+                items.append(item)
+            inserted = crud.bulk_create_posts(db, user.user_id, items)
+            imported += inserted
+            elapsed = time.perf_counter() - chunk_started
+            print(
+                f"chunk {number}: {inserted}/{len(items)} posts "
+                f"in {elapsed:.2f}s ({inserted / elapsed:.0f} posts/s)"
+            )
+    finally:
+        db.close()
+
+    total = time.perf_counter() - started
+    print(
+        f"imported {imported} of {len(paths)} posts in {total:.2f}s "
+        f"({imported / total:.0f} posts/s), {len(paths) - imported} skipped"
+    )
+    # The app's workers reload their search index from the database too
+    invalidation.invalidate_from_script(cache.POSTS, invalidation.SEARCH_INDEX)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,150 @@
+"""Cache invalidation that reaches every process.
+
+With the default memory:// backend each worker has its own response
+cache, and import_posts.py and backfill.py run in processes of their own,
+so bumping a namespace only reaches the process that did it. `invalidate`
+therefore also logs the namespaces in the cache_invalidations table.
+Every app process reads the rows added since its last look every
+BLOG_INVALIDATION_INTERVAL seconds (default 1) and bumps the same
+namespaces in its own cache, so no worker serves a stale entry for longer
+than that. With a Redis cache the bump itself is shared and the log is not
+applied a second time.
+
+The principal cache (principals.py) is always per process; a
+`principal_namespace` in the log drops a user's cached tokens everywhere,
+e.g. once they are deactivated. So is the SQLite search index
+(search.py): a `search_post_namespace` has the other processes read that
+post into it again, or drop it once it is deleted, and SEARCH_INDEX has
+them reload the whole index.
+
+Rows are pruned once they are older than the cache TTL.
+"""
+import asyncio
+import datetime
+import logging
+import os
+import time
+from typing import Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import async_crud
+import crud
+import search
+from cache import CACHE_TTL, response_cache
+from database import SessionLocal
+from principals import principal_cache
+
+INTERVAL = float(os.environ.get("BLOG_INVALIDATION_INTERVAL", "1"))
+PRUNE_INTERVAL = 60
+
+PRINCIPALS = "principal:"
+SEARCH_INDEX = "search-index"
+SEARCH_POSTS = "search-post:"
+
+logger = logging.getLogger(__name__)
+
+
+def principal_namespace(user_id: str) -> str:
+    return f"{PRINCIPALS}{user_id}"
+
+
+def search_post_namespace(post_id: str) -> str:
+    return f"{SEARCH_POSTS}{post_id}"
+
+
+async def _apply(namespaces, shared: bool):
+    """Drop what this process caches under `namespaces`, and with `shared`
+    what a shared response cache holds too."""
+    responses = []
+    for namespace in namespaces:
+        if namespace.startswith(PRINCIPALS):
+            principal_cache.evict_user(namespace[len(PRINCIPALS) :])
+        elif namespace == SEARCH_INDEX:
+            search.index.clear()
+        elif namespace.startswith(SEARCH_POSTS):
+            # The writing process updated its index already; the others
+            # read the post again in InvalidationLog.apply
+            continue
+        else:
+            responses.append(namespace)
+    if responses and response_cache.enabled and (shared or not response_cache.backend.shared):
+        await response_cache.invalidate(*responses)
+
+
+async def invalidate(db: AsyncSession, *namespaces: str):
+    """Invalidate `namespaces` in this process now, in the others within
+    BLOG_INVALIDATION_INTERVAL."""
+    await _apply(namespaces, shared=True)
+    await async_crud.add_cache_invalidations(db, list(namespaces))
+
+
+def invalidate_from_script(*namespaces: str):
+    """`invalidate` for the command line tools."""
+    asyncio.run(response_cache.invalidate(*namespaces))
+    db = SessionLocal()
+    try:
+        crud.add_cache_invalidations(db, list(namespaces))
+    finally:
+        db.close()
+
+
+class InvalidationLog:
+    def __init__(self, interval: float = INTERVAL, retention: float = CACHE_TTL):
+        self.interval = interval
+        self.retention = retention
+        self.last_id: Optional[int] = None
+        self.applied = 0
+        self._pruned = time.monotonic()
+        self._task: Optional[asyncio.Task] = None
+
+    async def apply(self, db: AsyncSession, namespaces: list[str]):
+        await _apply(namespaces, shared=False)
+        post_ids = [
+            namespace[len(SEARCH_POSTS) :]
+            for namespace in namespaces
+            if namespace.startswith(SEARCH_POSTS)
+        ]
+        if post_ids:
+            await db.run_sync(search.reindex_posts, post_ids)
+        self.applied += len(namespaces)
+
+    async def poll(self, db: AsyncSession):
+        # The first poll only finds where the log ends; a process that just
+        # started has nothing cached yet
+        namespaces, self.last_id = await async_crud.get_cache_invalidations(db, self.last_id)
+        if namespaces:
+            await self.apply(db, namespaces)
+        if time.monotonic() - self._pruned > PRUNE_INTERVAL:
+            self._pruned = time.monotonic()
+            now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+            await async_crud.prune_cache_invalidations(
+                db, now - datetime.timedelta(seconds=self.retention)
+            )
+
+    async def start(self, session_factory):
+        self._task = asyncio.create_task(self._run(session_factory))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self, session_factory):
+        while True:
+            try:
+                async with session_factory() as db:
+                    await self.poll(db)
+            except Exception:
+                logger.exception("Reading the cache invalidations failed")
+            await asyncio.sleep(self.interval)
+
+    def stats(self) -> dict:
+        return {"last_id": self.last_id, "applied": self.applied}
+
+
+invalidation_log = InvalidationLog()
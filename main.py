@@ -1,30 +1,43 @@
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form
+from fastapi import FastAPI, Depends, HTTPException, Query, status, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import SecurityScopes
-from sqlalchemy.orm import Session
-from typing import Optional
-from fastapi.security import HTTPBasic, HTTPBasicCredentials
-from starlette.middleware.base import BaseHTTPMiddleware
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Literal, Optional
+from fastapi.security import HTTPBasic
 from starlette.requests import Request
 from starlette.responses import Response
-import base64
-import secrets
+import asyncio
 import os
+import uuid
+import async_crud
 import crud
+import compression
+import conditional
+from counters import counter_buffer
+import fastjson
+import images
+import invalidation
+from invalidation import invalidation_log
+import metrics
+from middleware import AuthMiddleware, is_from_swagger_ui
 import models
+from cache import response_cache
+import cache
+import pagination
+import passwords
+import replicas
+from replicas import replica_router
+from principals import principal_cache
 import schemas
-from database import SessionLocal, engine
+import storage
+from tag_catalog import tag_catalog
+from trending import trending
+from warmup import warm_up
+from database import AsyncSessionLocal, async_engine, engine
 from datetime import datetime, timedelta
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from jose import JWTError, jwt
-from passlib.context import CryptContext
 from pydantic import BaseModel
 from dotenv import load_dotenv
-import boto3
-from botocore.exceptions import NoCredentialsError
-
-
-models.Base.metadata.create_all(bind=engine)
 
 
 # .envファイルの内容を読み込見込む
@@ -34,6 +47,10 @@ API_KEY = os.environ.get("BLOG_API_KEY")
 admin_name = os.environ.get("BLOG_ADMIN_NAME")
 admin_password = os.environ.get("BLOG_ADMIN_PASSWORD")
 swagger_creds = {admin_name: admin_password}
+# Users allowed to manage other users, comma separated
+ADMIN_EMAILS = {
+    email.strip() for email in os.environ.get("BLOG_ADMIN_EMAILS", "").split(",") if email.strip()
+}
 
 # to get a string like this run:
 # openssl rand -hex 32
@@ -59,8 +76,6 @@ class UserInDB(BaseModel):
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 
 app = FastAPI()
 
@@ -68,22 +83,12 @@ app = FastAPI()
 security = HTTPBasic()
 
 
-def verify_credentials(credentials: HTTPBasicCredentials) -> bool:
-    correct_password = swagger_creds.get(credentials.username)
-    if not correct_password or not secrets.compare_digest(
-        correct_password, credentials.password
-    ):
-        return False
-    return True
-
-
-def is_from_swagger_ui(request: Request):
-    referrer = request.headers.get("referer")
-    return referrer and ("/docs" in referrer or "/redoc" in referrer)
-
-
 def get_api_key(request: Request, security_scopes: SecurityScopes):
-    if is_from_swagger_ui(request):
+    # AuthMiddleware has already checked the key for every non-public path
+    api_key = request.scope.get("state", {}).get("api_key")
+    if api_key is not None:
+        return api_key
+    if is_from_swagger_ui(request.headers.get("referer")):
         return API_KEY
     api_key = request.headers.get("X-API-KEY")
     if not api_key or api_key != API_KEY:
@@ -93,27 +98,39 @@ def get_api_key(request: Request, security_scopes: SecurityScopes):
     return api_key
 
 
-# Utilities for JWT and password hashing
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+# Utilities for JWT and password hashing. Hashing runs in a bounded thread
+# pool (see passwords.py) so bcrypt never blocks the event loop.
+async def verify_password(plain_password, hashed_password):
+    matches, _ = await passwords.verify_and_update(plain_password, hashed_password)
+    return matches
 
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def get_password_hash(password):
+    return await passwords.hash_password(password)
 
 
-def get_user(db: Session, email: str):
-    return crud.get_user_by_email(db, email=email)
+async def get_user(db: AsyncSession, email: str):
+    return await async_crud.get_user_by_email(db, email=email)
 
 
-def authenticate_user(db: Session, email: str, password: str):
-    user = get_user(db, email)
-    if not user or not verify_password(password, user.hashed_password):
+async def authenticate_user(db: AsyncSession, email: str, password: str):
+    user = await get_user(db, email)
+    if not user:
         return False
+    matches, new_hash = await passwords.verify_and_update(password, user.hashed_password)
+    if not matches:
+        return False
+    if new_hash:
+        # The hash uses outdated parameters; store one made with the current ones
+        await async_crud.update_password_hash(db, user, new_hash)
     return user
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
+    # python-jose loads the cryptography backends, so it is imported on the
+    # first token rather than with the app
+    from jose import jwt
+
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
@@ -124,22 +141,55 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return access_token
 
 
+def list_response(content, response: Response):
+    # The rows come straight from our own queries, so with BLOG_FAST_JSON the
+    # response_model validation of every item is skipped.
+    if fastjson.FAST_JSON:
+        return fastjson.respond(content, response)
+    return content
+
+
+async def cache_lookup(namespace: str, request: Request):
+    # A client reading its own writes skips the cache both ways: an entry
+    # may have been filled from a replica that did not have the write yet
+    if replicas.sticks_to_primary(request):
+        return None, None
+    return await response_cache.lookup(namespace, request)
+
+
+def set_next_cursor(response: Response, cursor: Optional[str]):
+    # Passed as a header so the list body stays unchanged for existing clients
+    if cursor:
+        response.headers[pagination.NEXT_CURSOR_HEADER] = cursor
+
+
 # Dependency
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+# Dependency for routes that only read: a replica when there are any, the
+# primary for a client that just wrote (see replicas.py)
+async def get_read_db(request: Request):
+    async with replica_router.session(primary=replicas.sticks_to_primary(request)) as db:
         yield db
-    finally:
-        db.close()
 
 
 # Dependency to get the current user
-async def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
+async def get_current_user(db: AsyncSession = Depends(get_db), token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    # Tokens verified before skip both the signature check and the user query
+    user = principal_cache.get(token)
+    if user is not None:
+        return user
+
+    from jose import JWTError, jwt
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
@@ -148,41 +198,26 @@ async def get_current_user(db: Session = Depends(get_db), token: str = Depends(o
         token_data = TokenData(email=email)
     except JWTError:
         raise credentials_exception
-    user = get_user(db, email=token_data.email)  # Use email to fetch the user
-    if user is None:
+    user = await get_user(db, email=token_data.email)  # Use email to fetch the user
+    if user is None or not user.is_active:
         raise credentials_exception
+    principal_cache.put(token, user, expires_at=payload.get("exp"))
     return user
 
 
-class AuthMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        if request.url.path in ["/docs", "/openapi.json"]:
-            auth = request.headers.get("Authorization")
-            if not auth:
-                response = Response(
-                    headers={"WWW-Authenticate": "Basic"}, status_code=401
-                )
-                return response
-
-            try:
-                # credentials = HTTPBasicCredentials.parse_raw(auth)
-                auth_scheme, auth_string = auth.split()
-                username, password = (
-                    base64.b64decode(auth_string).decode("utf-8").split(":")
-                )
-                credentials = HTTPBasicCredentials(username=username, password=password)
-
-                if not verify_credentials(credentials):
-                    raise HTTPException(status_code=401, detail="Unauthorized")
-            except HTTPException:
-                response = Response(
-                    headers={"WWW-Authenticate": "Basic"}, status_code=401
-                )
-                return response
-
-        response = await call_next(request)
-        return response
+# Dependency for routes that manage other users
+async def get_current_admin(current_user: models.User = Depends(get_current_user)):
+    if current_user.email not in ADMIN_EMAILS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admins only")
+    return current_user
+
 
+if compression.ENABLED:
+    # Innermost: only compresses what the routes return
+    app.add_middleware(compression.CompressionMiddleware)
+
+# Added before CORS so that CORS wraps it and its 401s still carry CORS headers
+app.add_middleware(AuthMiddleware, api_key=API_KEY, docs_credentials=swagger_creds)
 
 app.add_middleware(
     CORSMiddleware,
@@ -190,23 +225,84 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[pagination.NEXT_CURSOR_HEADER],
 )
 
-app.add_middleware(AuthMiddleware)
+if metrics.ENABLED:
+    # Outermost, so the latency includes every other middleware
+    metrics.instrument(
+        engine,
+        async_engine.sync_engine,
+        *(replica.sync_engine for replica in replica_router.engines),
+    )
+    app.add_middleware(metrics.MetricsMiddleware)
+
 
+@app.on_event("startup")
+async def load_tag_catalog():
+    async with AsyncSessionLocal() as db:
+        await tag_catalog.refresh(db)
 
+
+@app.on_event("startup")
+async def start_counter_flusher():
+    await counter_buffer.start(AsyncSessionLocal)
+
+
+@app.on_event("startup")
+async def load_trending():
+    await trending.start(AsyncSessionLocal)
+
+
+@app.on_event("startup")
+async def start_invalidation_log():
+    await invalidation_log.start(AsyncSessionLocal)
+
+
+@app.on_event("startup")
+async def start_replica_checks():
+    await replica_router.start()
+
+
+@app.on_event("startup")
+async def start_warm_up():
+    await warm_up.start(async_engine, AsyncSessionLocal)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def read_metrics():
+    # Basic auth like /docs, see middleware.py
+    if not metrics.ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+# Readiness: 503 until the warm-up (see warmup.py) has finished
 @app.get("/startup")
-def startup_server(
+async def startup_server(
     security_scopes: SecurityScopes,
     api_key: str = Depends(get_api_key),
 ):
+    if not warm_up.ready:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Warming up",
+            headers={"Retry-After": "1"},
+        )
     return "startup completed"
 
 
 # Login endpoint
 @app.post("/login", response_model=Token)
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = authenticate_user(db, form_data.username, form_data.password)
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
+    try:
+        user = await authenticate_user(db, form_data.username, form_data.password)
+    except passwords.HashingBusy:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many logins, try again shortly",
+            headers={"Retry-After": "1"},
+        )
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -221,7 +317,7 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
 
 
 @app.get("/validate")
-def validate_api_key(
+async def validate_api_key(
     api_key: str = Depends(get_api_key)
 ):
     # If the function `get_api_key` doesn't raise an HTTPException, the API key is valid.
@@ -230,160 +326,329 @@ def validate_api_key(
 
 
 @app.post("/users/", response_model=schemas.User)
-def create_user(
+async def create_user(
     user: schemas.UserCreate,
-    db: Session = Depends(get_db),
+    response: Response,
+    db: AsyncSession = Depends(get_db),
     api_key: str = Depends(get_api_key),
 ):
-    db_user = crud.get_user_by_email(db, email=user.email)
+    db_user = await async_crud.get_user_by_email(db, email=user.email)
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
-    return crud.create_user(db=db, user=user)
+    db_user = await async_crud.create_user(db=db, user=user)
+    replicas.stick_to_primary(response)
+    return db_user
+
+
+@app.put("/users/{user_id}/active")
+async def set_user_active(
+    user_id: str,
+    is_active: bool,
+    response: Response,
+    db: AsyncSession = Depends(get_db),
+    api_key: str = Depends(get_api_key),
+    admin: models.User = Depends(get_current_admin),
+):
+    db_user = await async_crud.set_user_active(db, user_id=user_id, is_active=is_active)
+    if db_user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    if not is_active:
+        # Every worker drops the user's cached tokens (see invalidation.py)
+        await invalidation.invalidate(db, invalidation.principal_namespace(user_id))
+    replicas.stick_to_primary(response)
+    return {"user_id": db_user.user_id, "is_active": db_user.is_active}
+
+
+def user_summary(user, cards=None) -> dict:
+    posts = None
+    if cards is not None:
+        posts = [fastjson.project(card, schemas.PostCard) for card in cards]
+    return fastjson.project(user, schemas.UserSummary, posts=posts)
 
 
-@app.get("/users/", response_model=list[schemas.User])
-def read_users(
+@app.get("/users/", response_model=list[schemas.UserSummary])
+async def read_users(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = None,
+    posts_limit: int = 0,
+    db: AsyncSession = Depends(get_read_db),
     api_key: str = Depends(get_api_key),
 ):
-    users = crud.get_users(db, skip=skip, limit=limit)
-    return users
+    # One query for the users and their post counts, and with posts_limit
+    # one more for the newest cards of all of them, whatever the page size
+    try:
+        users = await async_crud.get_users(db, skip=skip, limit=limit, cursor=cursor)
+    except pagination.InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    set_next_cursor(response, pagination.next_cursor(users, limit, "user_id"))
+    if posts_limit > 0:
+        cards = await async_crud.get_recent_post_cards(
+            db, [user.user_id for user in users], min(posts_limit, 20)
+        )
+        content = [user_summary(user, cards[user.user_id]) for user in users]
+    else:
+        content = [user_summary(user) for user in users]
+    return list_response(content, response)
 
 
-@app.get("/users/{user_id}", response_model=schemas.User)
-def read_user(
-    user_id: int, db: Session = Depends(get_db), api_key: str = Depends(get_api_key)
+@app.get("/users/{user_id}", response_model=schemas.UserSummary)
+async def read_user(
+    response: Response,
+    user_id: str,
+    posts_limit: int = 0,
+    posts_cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db),
+    api_key: str = Depends(get_api_key),
 ):
-    db_user = crud.get_user(db, user_id=user_id)
+    db_user = await async_crud.get_user_summary(db, user_id=user_id)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
-    return db_user
+    if posts_limit <= 0:
+        return user_summary(db_user)
+    # The posts page like GET /posts/?user_id=..., the next one via X-Next-Cursor
+    limit = min(posts_limit, 100)
+    try:
+        cards = await async_crud.get_post_cards(
+            db, user_id=user_id, limit=limit, cursor=posts_cursor
+        )
+    except pagination.InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    set_next_cursor(response, pagination.next_cursor(cards, limit, "created_at", "post_id"))
+    return user_summary(db_user, cards)
 
 
 @app.post("/post/")
-def create_item_for_user(
+async def create_item_for_user(
     item: schemas.PostCreate,
-    db: Session = Depends(get_db),
+    response: Response,
+    db: AsyncSession = Depends(get_db),
     api_key: str = Depends(get_api_key),
     current_user: models.User = Depends(get_current_user)
 ):
-    if item.category not in ["tech", "idea"]:
+    if item.category not in crud.CATEGORIES:
         raise HTTPException(status_code=400, detail="specify category")
-    return crud.create_user_post(db=db, user_id=current_user.user_id, item=item)
+    db_post = await async_crud.create_user_post(db=db, user_id=current_user.user_id, item=item)
+    await invalidation.invalidate(
+        db,
+        cache.POSTS, cache.post_namespace(current_user.name, item.slug),
+        invalidation.search_post_namespace(db_post.post_id),
+    )
+    replicas.stick_to_primary(response)
+    return db_post
 
 
 @app.get("/posts/{username}/{slug}/", response_model=schemas.PostShow)
-def get_post(
+async def get_post(
+    request: Request,
+    response: Response,
     username: str,
     slug: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
     api_key: str = Depends(get_api_key),
 ):
-    post = crud.get_post(db, username, slug)
+    cache_key, cached = await cache_lookup(
+        cache.post_namespace(username, slug), request
+    )
+    if cached:
+        return conditional.check_cached(request, response, cached["headers"]) or cached["body"]
+
+    # Revalidation only needs the post's timestamps, not its content
+    if conditional.is_conditional(request):
+        version = await async_crud.get_post_version(db, username, slug)
+        if version is not None:
+            not_modified = conditional.check(
+                request, response, *conditional.post_validators(version)
+            )
+            if not_modified:
+                return not_modified
+
+    post = await async_crud.get_post(db, username, slug)
     if post is None:
         raise HTTPException(status_code=404, detail="Post not found")
 
-    result = {
-        "username": post.user.name,
-        "emoji": post.emoji,
-        "content": post.content,
-        "post_id": post.post_id,
-        "title": post.title,
-        "created_at": post.created_at,
-        "tag_urls": [
-            {
-                "tag_id": post_tag.tag.id,
-                "tag_name": post_tag.tag.meta_title,
-                "url": post_tag.tag.icon_image_url,
-            }
-            for post_tag in post.post_tags
-        ],
-    }
+    result = crud.post_detail(post)
 
+    headers = conditional.validator_headers(*conditional.post_validators(post))
+    response.headers.update(headers)
+    await response_cache.store(cache_key, result, headers)
     return result
 
 
 @app.get("/posts/", response_model=list[schemas.PostCard])
-def read_posts(
+async def read_posts(
+    request: Request,
+    response: Response,
     skip: int = 0,
     limit: int = 100,
     user_id: Optional[str] = None,
     category: Optional[str] = None,
     keyword: Optional[str] = None,
     tag_id: Optional[str] = None,
-    db: Session = Depends(get_db),
+    tag_ids: Optional[list[str]] = Query(None),
+    tag_match: Literal["any", "all"] = "any",
+    cursor: Optional[str] = None,
+    include_tags: bool = False,
+    db: AsyncSession = Depends(get_read_db),
     api_key: str = Depends(get_api_key),
 ):
-    posts = crud.get_posts(
-        db, skip=skip, limit=limit, category=category, keyword=keyword, tag_id=tag_id, user_id=user_id
+    cache_key, cached = await cache_lookup(cache.POSTS, request)
+    if cached:
+        return conditional.check_cached(
+            request, response, cached["headers"]
+        ) or list_response(cached["body"], response)
+
+    try:
+        posts = await async_crud.get_post_cards(
+            db, skip=skip, limit=limit, category=category, keyword=keyword, tag_id=tag_id, tag_ids=tag_ids, tag_match=tag_match, user_id=user_id, cursor=cursor
+        )
+    except pagination.InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    set_next_cursor(
+        response, pagination.next_cursor(posts, limit, "created_at", "post_id")
     )
-    result_posts = []
-    for post in posts:
-        result = {
-            "username": post.user.name,
-            "emoji": post.emoji,
-            "post_id": post.post_id,
-            "title": post.title,
-            "created_at": post.created_at,
-            "category": post.category,
-            "slug": post.slug,
-        }
-        result_posts.append(result)
-    return result_posts
+    tags = {}
+    if include_tags:
+        tags = await async_crud.get_tags_for_posts(db, [post.post_id for post in posts])
+    result_posts = [
+        fastjson.project(
+            post, schemas.PostCard, tag_urls=tags[post.post_id] if include_tags else None
+        )
+        for post in posts
+    ]
+
+    # The page is its own version, so no query over the whole table is
+    # needed; Last-Modified is left out, a removed post would not move it
+    etag = conditional.make_etag(result_posts, response.headers.get(pagination.NEXT_CURSOR_HEADER))
+    not_modified = conditional.check(request, response, etag)
+    if not_modified:
+        return not_modified
+
+    headers = conditional.validator_headers(etag)
+    if pagination.NEXT_CURSOR_HEADER in response.headers:
+        headers[pagination.NEXT_CURSOR_HEADER] = response.headers[pagination.NEXT_CURSOR_HEADER]
+    await response_cache.store(cache_key, result_posts, headers)
+    return list_response(result_posts, response)
+
+
+@app.get("/search/", response_model=list[schemas.SearchResult])
+async def search_posts(
+    q: str,
+    limit: int = 20,
+    db: AsyncSession = Depends(get_read_db),
+    api_key: str = Depends(get_api_key),
+):
+    return await async_crud.search_posts(db, keyword=q, limit=min(limit, 100))
+
+
+@app.get("/posts/trending/", response_model=list[schemas.TrendingPost])
+async def read_trending_posts(
+    limit: int = Query(10, ge=1, le=100),
+    category: Optional[str] = None,
+    tag_id: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db),
+    api_key: str = Depends(get_api_key),
+):
+    # Ranked in memory (see trending.py); only the top posts are queried
+    ranked = await trending.top(limit, category=category, tag_id=tag_id)
+    cards = await async_crud.get_post_cards_by_ids(db, [post_id for post_id, _ in ranked])
+    return [
+        fastjson.project(cards[post_id], schemas.TrendingPost, score=score)
+        for post_id, score in ranked
+        if post_id in cards
+    ]
 
 
 @app.get("/tags/{tag_id}", response_model=schemas.TagURL)
-def read_tag(
-    tag_id: str, db: Session = Depends(get_db), api_key: str = Depends(get_api_key)
+async def read_tag(
+    request: Request, response: Response, tag_id: str, db: AsyncSession = Depends(get_read_db), api_key: str = Depends(get_api_key)
 ):
-    tag = crud.get_tag(db, tag_id=tag_id)
-    if tag is None:
-        raise HTTPException(status_code=404, detail="Tag not found")
-    return {"tag_id": tag.id, "tag_name": tag.meta_title, "url": tag.icon_image_url}
+    await tag_catalog.ensure_fresh(db)
+    result = tag_catalog.get(tag_id)
+    if result is None:
+        # Not in the catalog yet if it was added since the last reload
+        if await async_crud.get_tag(db, tag_id=tag_id) is None:
+            raise HTTPException(status_code=404, detail="Tag not found")
+        await tag_catalog.refresh(db)
+        result = tag_catalog.get(tag_id)
+    return conditional.check(
+        request, response, tag_catalog.etag, tag_catalog.last_modified
+    ) or result
 
 
 @app.get("/tags/", response_model=list[schemas.TagURL])
-def read_all_tag(
-    db: Session = Depends(get_db), api_key: str = Depends(get_api_key)
+async def read_all_tag(
+    request: Request, response: Response, db: AsyncSession = Depends(get_read_db), api_key: str = Depends(get_api_key)
 ):
-    tags = crud.get_all_tag(db)
-    all_tags = []
-    for tag in tags:
-        all_tags.append(
-            {
-                "tag_id": tag.id,
-                "tag_name": tag.meta_title,
-                "url": tag.icon_image_url
-            }
-        )
-    return all_tags
+    await tag_catalog.ensure_fresh(db)
+    return conditional.check(
+        request, response, tag_catalog.etag, tag_catalog.last_modified
+    ) or list_response(tag_catalog.all(), response)
+
+
+@app.get("/cache/stats")
+async def read_cache_stats(api_key: str = Depends(get_api_key)):
+    return {
+        "responses": response_cache.stats(),
+        "principals": principal_cache.stats(),
+        "counters": counter_buffer.stats(),
+        "warm_up": warm_up.stats(),
+        "compression": compression.compressed_cache.stats(),
+        "replicas": replica_router.stats(),
+        "invalidations": invalidation_log.stats(),
+    }
+
+
+@app.post("/posts/{post_id}/{counter}")
+async def count_post(
+    post_id: str,
+    counter: Literal["like", "dislike", "views"],
+    db: AsyncSession = Depends(get_db),
+    api_key: str = Depends(get_api_key),
+):
+    # Buffered and written in batches; see counters.py
+    row = await async_crud.get_post_counters(db, post_id)
+    if row is None:
+        raise HTTPException(status_code=404, detail="Post not found")
+    counter_buffer.add(post_id, counter)
+    await trending.record(db, post_id, counter)
+    return counter_buffer.merge(row)
+
+
+@app.get("/posts/{post_id}/counters")
+async def read_post_counters(
+    post_id: str, db: AsyncSession = Depends(get_db), api_key: str = Depends(get_api_key)
+):
+    row = await async_crud.get_post_counters(db, post_id)
+    if row is None:
+        raise HTTPException(status_code=404, detail="Post not found")
+    return counter_buffer.merge(row)
 
 
 @app.delete("/posts/{post_id}/")
-def delete_post(
-    post_id: str, db: Session = Depends(get_db), api_key: str = Depends(get_api_key), current_user: models.User = Depends(get_current_user)
+async def delete_post(
+    post_id: str, response: Response, db: AsyncSession = Depends(get_db), api_key: str = Depends(get_api_key), current_user: models.User = Depends(get_current_user)
 ):
-    db_post = crud.get_post_by_id(db, post_id=post_id)
+    db_post = await async_crud.get_post_by_id(db, post_id=post_id)
     if db_post is None:
         raise HTTPException(status_code=404, detail="Post not found")
-    db.delete(db_post)
-    db.commit()
+    await async_crud.delete_post(db, db_post)
+    await trending.remove(post_id)
+    await invalidation.invalidate(
+        db,
+        cache.POSTS, cache.post_namespace(db_post.user.name, db_post.slug),
+        invalidation.search_post_namespace(post_id),
+    )
+    replicas.stick_to_primary(response)
     return {"status": "success", "message": "Post deleted successfully"}
 
 
-s3_client = boto3.client(
-    's3',
-    aws_access_key_id=os.environ.get("AWS_ACCESS_KEY_ID"),
-    aws_secret_access_key=os.environ.get("AWS_SECRET_ACCESS_KEY"),
-)
-
-
 @app.post("/upload_image/")
-def upload_image_to_s3(
+async def upload_image_to_s3(
+    request: Request,
     file: UploadFile = File(...),
-    db: Session = Depends(get_db),
+    derivatives: bool = True,
     api_key: str = Depends(get_api_key),
     # current_user: str = Depends(get_current_user)
 ) :
@@ -391,33 +656,97 @@ def upload_image_to_s3(
     if not file.content_type.startswith('image/'):
         raise HTTPException(status_code=400, detail="Invalid file type. Must be an image.")
 
+    # Refuse obviously oversized bodies before reading any of them
+    content_length = request.headers.get("content-length")
+    if content_length and int(content_length) > storage.UPLOAD_MAX_BYTES + 64 * 1024:
+        raise HTTPException(status_code=413, detail="File too large")
+
     user_id = "aaa"
 
-    # Generate a datetime string for the filename
+    # A timestamp for sorting and a random part so no two uploads share a
+    # key, not even in the same second
     datetime_str = datetime.now().strftime("%Y%m%d%H%M%S")
-    filename = f"{datetime_str}"
+    filename = f"{datetime_str}-{uuid.uuid4().hex}"
 
     # Generate the file path
     file_path = f"{user_id}/{filename}"
 
+    # The upload is copied to disk and handed to the image workers as a
+    # file, so only one part of it is ever held in memory here
     try:
-        # Read the content of the file
-        file_content = file.file.read()
-
-        # Upload file to S3 to the user's folder
-        s3_client.put_object(
-            Bucket='haruki-blog-image',
-            Key=file_path,
-            Body=file_content,
-            ContentType=file.content_type  # Set the ContentType for the uploaded file
-        )
-    except NoCredentialsError:
-        raise HTTPException(status_code=500, detail="Could not connect to S3")
+        upload_path = await storage.save_upload(file)
+    except storage.UploadTooLarge:
+        raise HTTPException(status_code=413, detail="File too large")
+    original_path = f"{upload_path}.original"
+    try:
+        try:
+            # Decoded before anything is stored: the original without its
+            # metadata and, unless turned off, resized WebP/AVIF copies for srcset
+            content_type, rendered = await images.prepare(
+                upload_path, original_path, images.WIDTHS if derivatives else ()
+            )
+        except images.InvalidImage:
+            raise HTTPException(status_code=400, detail="Invalid image")
+
+        for item in rendered:
+            item["key"] = f"{file_path}-{item['width']}w.{item['format']}"
+            item["url"] = storage.public_url(item["key"])
+        try:
+            await storage.upload_file(original_path, file_path, content_type)
+            # Every upload is let finish, so none lands after the clean-up below
+            results = await asyncio.gather(
+                *(
+                    storage.upload_bytes(item["data"], item["key"], item["content_type"])
+                    for item in rendered
+                ),
+                return_exceptions=True,
+            )
+            for result in results:
+                if isinstance(result, BaseException):
+                    raise result
+        except storage.StorageUnavailable:
+            # Nothing of a failed upload is left in the bucket
+            await storage.delete_objects([file_path] + [item["key"] for item in rendered])
+            raise HTTPException(status_code=500, detail="Could not connect to S3")
+    finally:
+        storage.remove_files(upload_path, original_path)
 
-    # Assuming 'haruki-blog-image' is your bucket name and the region is 'us-west-2'
-    uploaded_file_url = f"https://haruki-blog-image.s3.ap-northeast-1.amazonaws.com/{file_path}"
+    uploaded_file_url = storage.public_url(file_path)
 
     # If you want to save the file info to your database, create an instance of your item model.
-    # You could also generate a unique file name before uploading to avoid name collisions.
 
-    return {"message": "Image uploaded successfully", "url": uploaded_file_url}
+    return {
+        "message": "Image uploaded successfully",
+        "url": uploaded_file_url,
+        **images.manifest(rendered),
+    }
+
+
+@app.on_event("shutdown")
+def shutdown_image_workers():
+    images.shutdown()
+
+
+@app.on_event("shutdown")
+async def flush_counters():
+    await counter_buffer.stop(AsyncSessionLocal)
+
+
+@app.on_event("shutdown")
+async def stop_trending():
+    await trending.stop()
+
+
+@app.on_event("shutdown")
+async def stop_warm_up():
+    await warm_up.stop()
+
+
+@app.on_event("shutdown")
+async def stop_invalidation_log():
+    await invalidation_log.stop()
+
+
+@app.on_event("shutdown")
+async def stop_replica_checks():
+    await replica_router.stop()
@@ -0,0 +1,207 @@
+"""Request and SQL instrumentation, exposed in the Prometheus text format.
+
+Turned on with BLOG_METRICS=1. When it is off nothing is installed: no
+middleware, no engine event listeners, and GET /metrics answers 404.
+
+Per request, by route template:
+
+    blog_http_request_duration_seconds   latency, by method, route and status
+    blog_db_queries_per_request          SQL statements run
+    blog_db_query_seconds_per_request    time spent in those statements
+    blog_db_n_plus_one_total             requests that ran one statement
+                                         BLOG_METRICS_N_PLUS_ONE times or more
+
+The gap between the request latency and its SQL time is spent hydrating
+ORM objects, validating and serializing.
+"""
+import contextvars
+import logging
+import os
+import time
+from collections import Counter
+from typing import Optional
+
+from sqlalchemy import event
+
+ENABLED = os.environ.get("BLOG_METRICS", "").lower() in ("1", "true", "yes", "on")
+# The same statement this many times in one request is reported as an N+1
+N_PLUS_ONE = int(os.environ.get("BLOG_METRICS_N_PLUS_ONE", "5"))
+
+CONTENT_TYPE = "text/plain; version=0.0.4"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+logger = logging.getLogger(__name__)
+
+
+def _labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = (
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in zip(names, values)
+    )
+    return "{" + ",".join(pairs) + "}"
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: tuple, buckets: tuple):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # labels -> [count per bucket..., sum, count]
+        self._series: dict[tuple, list] = {}
+
+    def observe(self, labels: tuple, value: float):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self._series.items()):
+            for bound, count in zip(self.buckets, series):
+                bucket_labels = _labels(self.labelnames + ("le",), labels + (bound,))
+                lines.append(f"{self.name}_bucket{bucket_labels} {count}")
+            inf_labels = _labels(self.labelnames + ("le",), labels + ("+Inf",))
+            lines.append(f"{self.name}_bucket{inf_labels} {series[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {series[-2]}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {series[-1]}")
+        return lines
+
+
+class CounterMetric:
+    def __init__(self, name: str, help: str, labelnames: tuple):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: Counter = Counter()
+
+    def inc(self, labels: tuple, amount: float = 1):
+        self._values[labels] += amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+request_duration = Histogram(
+    "blog_http_request_duration_seconds",
+    "Time to answer a request.",
+    ("method", "route", "status"),
+    LATENCY_BUCKETS,
+)
+queries_per_request = Histogram(
+    "blog_db_queries_per_request",
+    "SQL statements run by one request.",
+    ("route",),
+    QUERY_COUNT_BUCKETS,
+)
+query_seconds_per_request = Histogram(
+    "blog_db_query_seconds_per_request",
+    "Time one request spent running SQL statements.",
+    ("route",),
+    LATENCY_BUCKETS,
+)
+n_plus_one = CounterMetric(
+    "blog_db_n_plus_one_total",
+    "Requests that ran the same SQL statement repeatedly.",
+    ("route",),
+)
+METRICS = (request_duration, queries_per_request, query_seconds_per_request, n_plus_one)
+
+
+def render() -> str:
+    return "\n".join(line for metric in METRICS for line in metric.render()) + "\n"
+
+
+class RequestStats:
+    __slots__ = ("queries", "seconds", "statements")
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+        self.statements: Counter = Counter()
+
+
+_current: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar(
+    "blog_request_stats", default=None
+)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("blog_query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["blog_query_started"].pop()
+    stats = _current.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.seconds += time.perf_counter() - started
+        stats.statements[statement] += 1
+
+
+def instrument(*engines):
+    """Count the statements run on `engines` (sync engines; pass
+    `async_engine.sync_engine` for an async one)."""
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+class MetricsMiddleware:
+    """Times every HTTP request and collects the SQL it runs."""
+
+    def __init__(self, app, n_plus_one_threshold: int = N_PLUS_ONE):
+        self.app = app
+        self.n_plus_one_threshold = n_plus_one_threshold
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _current.set(stats)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            _current.reset(token)
+            # FastAPI puts the matched route in the scope
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            request_duration.observe((scope["method"], route, status), elapsed)
+            queries_per_request.observe((route,), stats.queries)
+            query_seconds_per_request.observe((route,), stats.seconds)
+            self._check_n_plus_one(route, stats)
+
+    def _check_n_plus_one(self, route: str, stats: RequestStats):
+        if not stats.statements:
+            return
+        statement, count = stats.statements.most_common(1)[0]
+        if count >= self.n_plus_one_threshold:
+            n_plus_one.inc((route,))
+            logger.warning(
+                "Possible N+1 on %s: ran %d times: %s",
+                route,
+                count,
+                " ".join(statement.split())[:300],
+            )
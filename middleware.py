@@ -0,0 +1,113 @@
+"""Request guards as plain ASGI middleware.
+
+They only look at the path and the request headers and either answer
+straight away or pass the untouched `receive`/`send` on to the app, so
+neither the request nor the response body is ever wrapped.
+"""
+import base64
+import binascii
+import json
+import secrets
+from typing import Iterable, Optional
+
+# Swagger UI, the schema it loads and the metrics; guarded with Basic auth
+DOCS_PATHS = ("/docs", "/openapi.json", "/metrics")
+# Reachable without an API key
+PUBLIC_PATHS = ("/login", "/docs/oauth2-redirect", "/redoc") + DOCS_PATHS
+
+
+def _header(scope, name: bytes) -> Optional[str]:
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+async def _reject(send, status: int, headers: list, body: bytes = b""):
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": headers + [(b"content-length", str(len(body)).encode())],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+def basic_credentials(authorization: Optional[str]) -> Optional[tuple[str, str]]:
+    if not authorization:
+        return None
+    scheme, _, encoded = authorization.partition(" ")
+    if scheme.lower() != "basic":
+        return None
+    try:
+        username, sep, password = base64.b64decode(encoded).decode("utf-8").partition(":")
+    except (binascii.Error, UnicodeDecodeError):
+        return None
+    return (username, password) if sep else None
+
+
+def is_from_swagger_ui(referer: Optional[str]) -> bool:
+    return bool(referer) and ("/docs" in referer or "/redoc" in referer)
+
+
+class AuthMiddleware:
+    """Basic auth in front of the docs, and the `X-API-KEY` check for the API.
+
+    The accepted key is left in `scope["state"]["api_key"]`, where
+    `main.get_api_key` picks it up instead of checking it again.
+    """
+
+    def __init__(
+        self,
+        app,
+        api_key: Optional[str],
+        docs_credentials: dict,
+        docs_paths: Iterable[str] = DOCS_PATHS,
+        public_paths: Iterable[str] = PUBLIC_PATHS,
+    ):
+        self.app = app
+        self.api_key = api_key
+        self.docs_credentials = docs_credentials
+        self.docs_paths = frozenset(docs_paths)
+        self.public_paths = frozenset(public_paths)
+
+    def verify_docs_credentials(self, authorization: Optional[str]) -> bool:
+        credentials = basic_credentials(authorization)
+        if credentials is None:
+            return False
+        username, password = credentials
+        correct_password = self.docs_credentials.get(username)
+        return bool(correct_password) and secrets.compare_digest(
+            correct_password.encode(), password.encode()
+        )
+
+    def verify_api_key(self, api_key: Optional[str]) -> bool:
+        return bool(api_key and self.api_key) and secrets.compare_digest(
+            api_key.encode(), self.api_key.encode()
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        path = scope["path"]
+        if path in self.docs_paths:
+            if not self.verify_docs_credentials(_header(scope, b"authorization")):
+                await _reject(send, 401, [(b"www-authenticate", b"Basic")])
+                return
+        elif path not in self.public_paths and scope["method"] != "OPTIONS":
+            if is_from_swagger_ui(_header(scope, b"referer")):
+                api_key = self.api_key
+            else:
+                api_key = _header(scope, b"x-api-key")
+                if not self.verify_api_key(api_key):
+                    body = json.dumps({"detail": "Invalid API key"}).encode()
+                    await _reject(
+                        send, 401, [(b"content-type", b"application/json")], body
+                    )
+                    return
+            scope.setdefault("state", {})["api_key"] = api_key
+
+        await self.app(scope, receive, send)
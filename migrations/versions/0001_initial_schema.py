@@ -0,0 +1,157 @@
+"""initial schema
+
+The tables as `models.Base.metadata.create_all` used to create them when
+the app was imported. Databases made that way already have them, so
+tables and indexes that exist are left alone and `alembic upgrade head`
+works on those too.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17 12:41:19.559032
+
+"""
+from typing import Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _existing() -> set:
+    """Names of the tables and of their indexes already in the database."""
+    if context.is_offline_mode():
+        return set()
+    inspector = sa.inspect(op.get_bind())
+    names = set(inspector.get_table_names())
+    for table in ('tag', 'users', 'posts', 'post_tag'):
+        if table in names:
+            names |= {index['name'] for index in inspector.get_indexes(table)}
+    return names
+
+
+def _create_indexes(table: str, indexes: dict, existing: set) -> None:
+    with op.batch_alter_table(table, schema=None) as batch_op:
+        for name, (columns, unique) in indexes.items():
+            if name not in existing:
+                batch_op.create_index(name, columns, unique=unique)
+
+
+def upgrade() -> None:
+    existing = _existing()
+    if 'tag' not in existing:
+        op.create_table(
+            'tag',
+            sa.Column('id', sa.String(), nullable=False),
+            sa.Column('title', sa.String(), nullable=True),
+            sa.Column('meta_title', sa.String(), nullable=True),
+            sa.Column('icon_image_url', sa.String(length=500), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+        )
+    _create_indexes('tag', {
+        'ix_tag_id': (['id'], False),
+        'ix_tag_meta_title': (['meta_title'], False),
+        'ix_tag_title': (['title'], False),
+    }, existing)
+
+    if 'users' not in existing:
+        op.create_table(
+            'users',
+            sa.Column('user_id', sa.String(), nullable=False),
+            sa.Column('name', sa.String(), nullable=True),
+            sa.Column('email', sa.String(), nullable=True),
+            sa.Column('hashed_password', sa.String(), nullable=True),
+            sa.Column('is_active', sa.Boolean(), nullable=True),
+            sa.PrimaryKeyConstraint('user_id'),
+        )
+    _create_indexes('users', {
+        'ix_users_email': (['email'], True),
+        'ix_users_name': (['name'], True),
+        'ix_users_user_id': (['user_id'], False),
+    }, existing)
+
+    if 'posts' not in existing:
+        op.create_table(
+            'posts',
+            sa.Column('post_id', sa.String(), nullable=False),
+            sa.Column('user_id', sa.String(), nullable=True),
+            sa.Column('emoji', sa.String(), nullable=True),
+            sa.Column('title', sa.String(), nullable=True),
+            sa.Column('meta_title', sa.String(), nullable=True),
+            sa.Column('slug', sa.String(), nullable=True),
+            sa.Column('content', sa.String(), nullable=True),
+            sa.Column('summary', sa.String(), nullable=True),
+            sa.Column('category', sa.String(), nullable=True),
+            sa.Column('is_published', sa.Boolean(), nullable=True),
+            sa.Column('like', sa.Integer(), nullable=True),
+            sa.Column('dislike', sa.Integer(), nullable=True),
+            sa.Column('created_at', sa.TIMESTAMP(), nullable=True),
+            sa.Column('updated_at', sa.TIMESTAMP(), nullable=True),
+            sa.Column('published_at', sa.TIMESTAMP(), nullable=True),
+            sa.ForeignKeyConstraint(['user_id'], ['users.user_id'], ),
+            sa.PrimaryKeyConstraint('post_id'),
+            sa.UniqueConstraint('slug', 'user_id', name='uix_slug_user_id'),
+        )
+    _create_indexes('posts', {
+        'ix_posts_category': (['category'], False),
+        'ix_posts_content': (['content'], False),
+        'ix_posts_dislike': (['dislike'], False),
+        'ix_posts_emoji': (['emoji'], False),
+        'ix_posts_like': (['like'], False),
+        'ix_posts_meta_title': (['meta_title'], False),
+        'ix_posts_post_id': (['post_id'], False),
+        'ix_posts_slug': (['slug'], False),
+        'ix_posts_summary': (['summary'], False),
+        'ix_posts_title': (['title'], False),
+    }, existing)
+
+    if 'post_tag' not in existing:
+        op.create_table(
+            'post_tag',
+            sa.Column('post_tag_id', sa.String(), nullable=False),
+            sa.Column('post_id', sa.String(), nullable=True),
+            sa.Column('tag_id', sa.String(), nullable=True),
+            sa.ForeignKeyConstraint(['post_id'], ['posts.post_id'], ),
+            sa.ForeignKeyConstraint(['tag_id'], ['tag.id'], ),
+            sa.PrimaryKeyConstraint('post_tag_id'),
+        )
+    _create_indexes('post_tag', {
+        'ix_post_tag_post_tag_id': (['post_tag_id'], False),
+    }, existing)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('post_tag', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_post_tag_post_tag_id'))
+
+    op.drop_table('post_tag')
+    with op.batch_alter_table('posts', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_posts_title'))
+        batch_op.drop_index(batch_op.f('ix_posts_summary'))
+        batch_op.drop_index(batch_op.f('ix_posts_slug'))
+        batch_op.drop_index(batch_op.f('ix_posts_post_id'))
+        batch_op.drop_index(batch_op.f('ix_posts_meta_title'))
+        batch_op.drop_index(batch_op.f('ix_posts_like'))
+        batch_op.drop_index(batch_op.f('ix_posts_emoji'))
+        batch_op.drop_index(batch_op.f('ix_posts_dislike'))
+        batch_op.drop_index(batch_op.f('ix_posts_content'))
+        batch_op.drop_index(batch_op.f('ix_posts_category'))
+
+    op.drop_table('posts')
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_users_user_id'))
+        batch_op.drop_index(batch_op.f('ix_users_name'))
+        batch_op.drop_index(batch_op.f('ix_users_email'))
+
+    op.drop_table('users')
+    with op.batch_alter_table('tag', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_tag_title'))
+        batch_op.drop_index(batch_op.f('ix_tag_meta_title'))
+        batch_op.drop_index(batch_op.f('ix_tag_id'))
+
+    op.drop_table('tag')
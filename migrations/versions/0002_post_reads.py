@@ -0,0 +1,105 @@
+"""post reads
+
+Everything the read paths added to the schema: the derived post columns
+(rendered HTML, table of contents, reading time, content hash), the view
+counter, the listing, per-user and tag indexes, and on Postgres the GIN
+index for full-text search. The index on posts.content is dropped; no
+query filters on it and it made every write slower.
+
+Databases created by `create_all` after some of this was added already
+have part of it, so whatever exists is left alone.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 12:41:21.063704
+
+"""
+from typing import Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# models.SEARCH_DOCUMENT when this revision was written
+SEARCH_DOCUMENT = (
+    "to_tsvector('simple', coalesce(title, '') || ' ' || coalesce(content, ''))"
+)
+
+
+def _existing(table: str) -> set:
+    """Names of the columns, indexes and unique constraints of `table`."""
+    if context.is_offline_mode():
+        return {'ix_posts_content'}
+    inspector = sa.inspect(op.get_bind())
+    return (
+        {column['name'] for column in inspector.get_columns(table)}
+        | {index['name'] for index in inspector.get_indexes(table)}
+        | {unique['name'] for unique in inspector.get_unique_constraints(table)}
+    )
+
+
+def upgrade() -> None:
+    existing = _existing('post_tag')
+    if 'uix_tag_id_post_id' not in existing:
+        # Keep one row of each tag/post pair so the constraint can be added
+        op.execute(
+            'DELETE FROM post_tag WHERE post_tag_id NOT IN '
+            '(SELECT MIN(post_tag_id) FROM post_tag GROUP BY tag_id, post_id)'
+        )
+    with op.batch_alter_table('post_tag', schema=None) as batch_op:
+        if 'ix_post_tag_post_id' not in existing:
+            batch_op.create_index('ix_post_tag_post_id', ['post_id'], unique=False)
+        if 'uix_tag_id_post_id' not in existing:
+            batch_op.create_unique_constraint('uix_tag_id_post_id', ['tag_id', 'post_id'])
+
+    existing = _existing('posts')
+    columns = [
+        sa.Column('content_html', sa.String(), nullable=True),
+        sa.Column('toc', sa.JSON(), nullable=True),
+        sa.Column('reading_time', sa.Integer(), nullable=True),
+        sa.Column('content_hash', sa.String(length=64), nullable=True),
+        sa.Column('views', sa.Integer(), nullable=True),
+    ]
+    indexes = {
+        'ix_posts_created_at_post_id': ['created_at', 'post_id'],
+        'ix_posts_user_id_created_at': ['user_id', 'created_at', 'post_id'],
+    }
+    with op.batch_alter_table('posts', schema=None) as batch_op:
+        for column in columns:
+            if column.name not in existing:
+                batch_op.add_column(column)
+        if 'ix_posts_content' in existing:
+            batch_op.drop_index('ix_posts_content')
+        for name, index_columns in indexes.items():
+            if name not in existing:
+                batch_op.create_index(name, index_columns, unique=False)
+
+    if op.get_context().dialect.name == 'postgresql' and 'ix_posts_search' not in existing:
+        op.create_index(
+            'ix_posts_search', 'posts', [sa.text(SEARCH_DOCUMENT)], postgresql_using='gin'
+        )
+
+
+def downgrade() -> None:
+    if op.get_context().dialect.name == 'postgresql':
+        op.drop_index('ix_posts_search', table_name='posts')
+
+    with op.batch_alter_table('posts', schema=None) as batch_op:
+        batch_op.drop_index('ix_posts_user_id_created_at')
+        batch_op.drop_index('ix_posts_created_at_post_id')
+        batch_op.create_index('ix_posts_content', ['content'], unique=False)
+        batch_op.drop_column('views')
+        batch_op.drop_column('content_hash')
+        batch_op.drop_column('reading_time')
+        batch_op.drop_column('toc')
+        batch_op.drop_column('content_html')
+
+    with op.batch_alter_table('post_tag', schema=None) as batch_op:
+        batch_op.drop_constraint('uix_tag_id_post_id', type_='unique')
+        batch_op.drop_index('ix_post_tag_post_id')
@@ -0,0 +1,42 @@
+"""cache invalidations
+
+The log of invalidated cache namespaces that every process reads (see
+invalidation.py).
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 13:20:04.518311
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'cache_invalidations',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('namespace', sa.String(), nullable=False),
+        sa.Column('created_at', sa.TIMESTAMP(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    with op.batch_alter_table('cache_invalidations', schema=None) as batch_op:
+        batch_op.create_index(
+            batch_op.f('ix_cache_invalidations_created_at'), ['created_at'], unique=False
+        )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('cache_invalidations', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_cache_invalidations_created_at'))
+
+    op.drop_table('cache_invalidations')
@@ -2,15 +2,26 @@ from sqlalchemy import (
     Boolean,
     Column,
     ForeignKey,
+    Index,
     Integer,
+    JSON,
     String,
     TIMESTAMP,
     UniqueConstraint,
+    text,
 )
 from sqlalchemy.orm import relationship
 
 from database import Base
 
+# Full-text search document for posts (Postgres only). Queries must use the
+# exact same expression for the planner to pick up the GIN index.
+SEARCH_CONFIG = "simple"
+SEARCH_DOCUMENT = (
+    f"to_tsvector('{SEARCH_CONFIG}', "
+    "coalesce(title, '') || ' ' || coalesce(content, ''))"
+)
+
 
 class User(Base):
     __tablename__ = "users"
@@ -33,17 +44,33 @@ class Post(Base):
     title = Column(String, index=True)
     meta_title = Column(String, index=True)
     slug = Column(String, index=True)
-    content = Column(String, index=True)
+    content = Column(String)
+    # Derived from `content` when the post is written (see rendering.py)
+    content_html = Column(String)
+    toc = Column(JSON)
+    reading_time = Column(Integer)
+    content_hash = Column(String(64))
     summary = Column(String, index=True)
     category = Column(String, index=True)
     is_published = Column(Boolean, default=True)
     like = Column(Integer, index=True)
     dislike = Column(Integer, index=True)
+    # Bumped on every view, so deliberately not indexed
+    views = Column(Integer)
     created_at = Column(TIMESTAMP)
     updated_at = Column(TIMESTAMP)
     published_at = Column(TIMESTAMP)
 
-    __table_args__ = (UniqueConstraint("slug", "user_id", name="uix_slug_user_id"),)
+    __table_args__ = (
+        UniqueConstraint("slug", "user_id", name="uix_slug_user_id"),
+        # Serves the listing order and keyset pagination of GET /posts/
+        Index("ix_posts_created_at_post_id", "created_at", "post_id"),
+        # A user's post count and newest posts
+        Index("ix_posts_user_id_created_at", "user_id", "created_at", "post_id"),
+        Index(
+            "ix_posts_search", text(SEARCH_DOCUMENT), postgresql_using="gin"
+        ).ddl_if(dialect="postgresql"),
+    )
 
     user = relationship("User", back_populates="posts")
     post_tags = relationship(
@@ -60,6 +87,12 @@ class PostTag(Base):
     post_id = Column(String, ForeignKey("posts.post_id"))
     tag_id = Column(String, ForeignKey("tag.id"))
 
+    __table_args__ = (
+        # Also the index for filtering posts by tag
+        UniqueConstraint("tag_id", "post_id", name="uix_tag_id_post_id"),
+        Index("ix_post_tag_post_id", "post_id"),
+    )
+
     post = relationship("Post", back_populates="post_tags")
     tag = relationship("Tag", back_populates="post_tags")
 
@@ -73,3 +106,13 @@ class Tag(Base):
     icon_image_url = Column(String(500))  # new column for the S3 URL
 
     post_tags = relationship("PostTag", back_populates="tag")
+
+
+class CacheInvalidation(Base):
+    """Invalidated cache namespaces, read by every process (see invalidation.py)."""
+
+    __tablename__ = "cache_invalidations"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    namespace = Column(String, nullable=False)
+    created_at = Column(TIMESTAMP, nullable=False, index=True)
@@ -0,0 +1,61 @@
+import base64
+import datetime
+import json
+from typing import Sequence
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _default(value):
+    if isinstance(value, datetime.datetime):
+        return {"dt": value.isoformat()}
+    raise TypeError(f"Cannot encode {type(value).__name__} in a cursor")
+
+
+def _object_hook(obj):
+    if "dt" in obj:
+        return datetime.datetime.fromisoformat(obj["dt"])
+    return obj
+
+
+def encode_cursor(values: Sequence) -> str:
+    """Pack the sort key of the last row of a page into an opaque token."""
+    raw = json.dumps(list(values), default=_default, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, *types: type) -> list:
+    """The values packed by `encode_cursor`, one of each of `types`.
+
+    Checked here, since a value of the wrong type would only fail once it
+    reaches the database (e.g. a string compared with a timestamp column
+    is an error on Postgres).
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(
+            base64.urlsafe_b64decode(padded.encode()), object_hook=_object_hook
+        )
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor("Malformed cursor") from e
+    if not isinstance(values, list) or len(values) != len(types):
+        raise InvalidCursor("Malformed cursor")
+    for value, type_ in zip(values, types):
+        if not isinstance(value, type_):
+            raise InvalidCursor("Malformed cursor")
+        # Stored timestamps are naive
+        if isinstance(value, datetime.datetime) and value.tzinfo is not None:
+            raise InvalidCursor("Malformed cursor")
+    return values
+
+
+def next_cursor(rows: Sequence, limit: int, *keys: str):
+    """Cursor pointing after the last row, or None if this was the last page."""
+    if limit <= 0 or len(rows) < limit:
+        return None
+    last = rows[-1]
+    return encode_cursor([getattr(last, key) for key in keys])
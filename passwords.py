@@ -0,0 +1,79 @@
+import asyncio
+import os
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+# bcrypt releases the GIL, so threads give real parallelism here
+HASH_CONCURRENCY = int(os.environ.get("BLOG_HASH_CONCURRENCY", str(os.cpu_count() or 2)))
+# Seconds a login may wait for a free hashing slot before getting a 503
+HASH_QUEUE_TIMEOUT = float(os.environ.get("BLOG_HASH_QUEUE_TIMEOUT", "5"))
+
+BCRYPT_ROUNDS = int(os.environ.get("BLOG_BCRYPT_ROUNDS", "12"))
+
+_context = None
+
+_executor = ThreadPoolExecutor(max_workers=HASH_CONCURRENCY, thread_name_prefix="passwords")
+# One semaphore per event loop; asyncio primitives can't be shared across loops
+_slots: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def context():
+    """The passlib context, created on first use so importing the app stays
+    cheap. Hashes made with other parameters (e.g. a different number of
+    rounds) are replaced on the user's next login."""
+    global _context
+    if _context is None:
+        from passlib.context import CryptContext
+
+        _context = CryptContext(
+            schemes=["bcrypt"],
+            deprecated="auto",
+            bcrypt__rounds=BCRYPT_ROUNDS,
+            bcrypt__min_rounds=BCRYPT_ROUNDS,
+            bcrypt__max_rounds=BCRYPT_ROUNDS,
+        )
+    return _context
+
+
+class HashingBusy(Exception):
+    """Every hashing slot stayed busy for longer than the queue timeout."""
+
+
+async def _run(fn, *args):
+    loop = asyncio.get_running_loop()
+    slots = _slots.get(loop)
+    if slots is None:
+        slots = _slots[loop] = asyncio.Semaphore(HASH_CONCURRENCY)
+    try:
+        await asyncio.wait_for(slots.acquire(), HASH_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HashingBusy()
+    try:
+        return await loop.run_in_executor(_executor, fn, *args)
+    finally:
+        slots.release()
+
+
+def _verify_and_update(plain_password: str, hashed_password: Optional[str]):
+    try:
+        return context().verify_and_update(plain_password, hashed_password)
+    except ValueError:
+        # Not a hash this context knows
+        return False, None
+
+
+def _hash(password: str) -> str:
+    return context().hash(password)
+
+
+async def verify_and_update(plain_password: str, hashed_password: Optional[str]):
+    """Returns (matches, new_hash); new_hash is set when the stored hash
+    uses outdated parameters and should be replaced."""
+    return await _run(_verify_and_update, plain_password, hashed_password)
+
+
+async def hash_password(password: str) -> str:
+    return await _run(_hash, password)
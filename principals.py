@@ -0,0 +1,85 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import models
+
+PRINCIPAL_CACHE_SIZE = int(os.environ.get("BLOG_PRINCIPAL_CACHE_SIZE", "1024"))
+PRINCIPAL_CACHE_TTL = int(os.environ.get("BLOG_PRINCIPAL_CACHE_TTL", "300"))
+
+
+def token_key(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class PrincipalCache:
+    """Users behind access tokens that were already verified.
+
+    Keyed by a hash of the token, so the token itself is never kept. An
+    entry lives for at most `ttl` seconds and never past the token's `exp`.
+    """
+
+    def __init__(self, maxsize: int = PRINCIPAL_CACHE_SIZE, ttl: int = PRINCIPAL_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, tuple[float, models.User]] = OrderedDict()
+        self._keys_by_user: dict[str, set[str]] = {}
+
+    def get(self, token: str) -> Optional[models.User]:
+        key = token_key(token)
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.time():
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, token: str, user: models.User, expires_at: Optional[float] = None):
+        """`expires_at` is the token's `exp` claim (a unix timestamp)."""
+        if self.maxsize <= 0:
+            return
+        deadline = time.time() + self.ttl
+        if expires_at is not None:
+            deadline = min(deadline, expires_at)
+        key = token_key(token)
+        self._entries[key] = (deadline, user)
+        self._entries.move_to_end(key)
+        self._keys_by_user.setdefault(user.user_id, set()).add(key)
+        while len(self._entries) > self.maxsize:
+            self._remove(next(iter(self._entries)))
+
+    def evict_user(self, user_id: str):
+        """Forget every token of a user, e.g. once they are deactivated."""
+        for key in self._keys_by_user.pop(user_id, ()):
+            self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+        self._keys_by_user.clear()
+
+    def _remove(self, key: str):
+        _, user = self._entries.pop(key)
+        keys = self._keys_by_user.get(user.user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_user[user.user_id]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+principal_cache = PrincipalCache()
@@ -0,0 +1,208 @@
+"""Markdown rendering for posts.
+
+Posts are rendered once, when they are written, and the result is stored
+next to the Markdown (see `models.Post`), so reading a post never parses
+anything. `content_hash` tells whether the stored HTML is up to date;
+it changes with the content and with RENDERER_VERSION.
+
+`backfill.py render` uses this module from worker processes, so it must
+stay free of app imports.
+"""
+import hashlib
+import os
+import re
+import unicodedata
+from typing import NamedTuple
+
+# Bump whenever the output changes, so `backfill.py render` redoes every post
+RENDERER_VERSION = "1"
+
+# Headings that make it into the table of contents
+TOC_LEVELS = (1, 2, 3)
+# Card summaries and <title>s are cut to these many characters
+SUMMARY_CHARS = int(os.environ.get("BLOG_SUMMARY_CHARS", "160"))
+META_TITLE_CHARS = int(os.environ.get("BLOG_META_TITLE_CHARS", "60"))
+# Reading speeds: words per minute for latin scripts, characters per minute
+# for Japanese/Chinese text
+WORDS_PER_MINUTE = 200
+CJK_CHARS_PER_MINUTE = 500
+
+ALLOWED_TAGS = set(
+    "a blockquote br code del em h1 h2 h3 h4 h5 h6 hr img li ol p pre s span "
+    "strong table tbody td th thead tr ul".split()
+)
+ALLOWED_ATTRIBUTES = {
+    "a": {"href", "title"},
+    "img": {"src", "alt", "title"},
+    "code": {"class"},
+    "span": {"class"},
+    "pre": {"class"},
+    "td": {"style"},
+    "th": {"style"},
+    **{f"h{level}": {"id"} for level in range(1, 7)},
+}
+
+_CJK = re.compile("[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]")
+_WORD = re.compile(r"[^\W_]+", re.UNICODE)
+
+
+class Rendered(NamedTuple):
+    html: str
+    toc: list
+    reading_time: int
+    content_hash: str
+
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(f"{RENDERER_VERSION}\0{content}".encode("utf-8")).hexdigest()
+
+
+def reading_time(content: str) -> int:
+    """Minutes it takes to read `content`, at least 1."""
+    cjk = len(_CJK.findall(content))
+    words = len(_WORD.findall(_CJK.sub(" ", content)))
+    minutes = words / WORDS_PER_MINUTE + cjk / CJK_CHARS_PER_MINUTE
+    return max(1, round(minutes))
+
+
+def slugify(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = re.sub(r"[^\w\s-]", "", text)
+    return re.sub(r"[\s_-]+", "-", text).strip("-") or "section"
+
+
+def _highlight(code: str, lang: str, attrs) -> str:
+    from pygments import highlight
+    from pygments.formatters import HtmlFormatter
+    from pygments.lexers import get_lexer_by_name
+    from pygments.util import ClassNotFound
+
+    try:
+        lexer = get_lexer_by_name(lang) if lang else None
+    except ClassNotFound:
+        lexer = None
+    if lexer is None:
+        return ""  # markdown-it escapes the code itself
+    return highlight(code, lexer, HtmlFormatter(nowrap=True))
+
+
+_parser = None
+
+
+def _markdown():
+    global _parser
+    if _parser is None:
+        from markdown_it import MarkdownIt
+
+        _parser = MarkdownIt(
+            "commonmark", {"html": False, "linkify": False, "highlight": _highlight}
+        ).enable(["table", "strikethrough"])
+    return _parser
+
+
+def _add_heading_ids(tokens) -> list:
+    """Give headings unique ids and collect them as the table of contents."""
+    toc = []
+    seen: dict[str, int] = {}
+    for index, token in enumerate(tokens):
+        if token.type != "heading_open":
+            continue
+        # Text without the Markdown markup around it
+        text = "".join(
+            child.content
+            for child in tokens[index + 1].children or ()
+            if child.type in ("text", "code_inline")
+        )
+        anchor = slugify(text)
+        if anchor in seen:
+            seen[anchor] += 1
+            anchor = f"{anchor}-{seen[anchor]}"
+        else:
+            seen[anchor] = 0
+        token.attrSet("id", anchor)
+        level = int(token.tag[1])
+        if level in TOC_LEVELS:
+            toc.append({"level": level, "id": anchor, "text": text})
+    return toc
+
+
+def sanitize(markup: str) -> str:
+    import nh3
+
+    return nh3.clean(
+        markup,
+        tags=ALLOWED_TAGS,
+        attributes=ALLOWED_ATTRIBUTES,
+        url_schemes={"http", "https", "mailto"},
+        link_rel="noopener noreferrer nofollow",
+        # Table cells keep markdown-it's alignment and nothing else
+        filter_style_properties={"text-align"},
+    )
+
+
+def render(content: str) -> Rendered:
+    """Sanitized HTML, table of contents and reading time of a post."""
+    content = content or ""
+    parser = _markdown()
+    env: dict = {}
+    tokens = parser.parse(content, env)
+    toc = _add_heading_ids(tokens)
+    markup = parser.renderer.render(tokens, parser.options, env)
+    return Rendered(
+        html=sanitize(markup),
+        toc=toc,
+        reading_time=reading_time(content),
+        content_hash=content_hash(content),
+    )
+
+
+def columns(content: str) -> dict:
+    """The derived `Post` columns for `content`."""
+    rendered = render(content)
+    return {
+        "content_html": rendered.html,
+        "toc": rendered.toc,
+        "reading_time": rendered.reading_time,
+        "content_hash": rendered.content_hash,
+    }
+
+
+def truncate(text: str, limit: int) -> str:
+    """`text` cut to at most `limit` characters, at a word boundary when the
+    text has spaces nearby, with an ellipsis if anything was cut."""
+    text = " ".join(text.split())
+    if len(text) <= limit:
+        return text
+    cut = text[: limit - 1]
+    if not text[limit - 1].isspace() and " " in cut[-20:]:
+        cut = cut.rsplit(" ", 1)[0]
+    return cut.rstrip(" ,.;:、。") + "…"
+
+
+def summary(content: str, limit: int = SUMMARY_CHARS) -> str:
+    """The opening paragraphs of a post as plain text, for post cards."""
+    tokens = _markdown().parse(content or "")
+    parts = []
+    length = 0
+    for index, token in enumerate(tokens):
+        # Only paragraph text; headings, code blocks and tables are skipped
+        if token.type != "inline" or tokens[index - 1].type != "paragraph_open":
+            continue
+        text = "".join(
+            " " if child.type in ("softbreak", "hardbreak") else child.content
+            for child in token.children or ()
+            if child.type in ("text", "code_inline", "softbreak", "hardbreak")
+        )
+        parts.append(text)
+        length += len(text)
+        if length > limit:
+            break
+    return truncate(" ".join(parts), limit)
+
+
+def summary_columns(title: str, content: str) -> dict:
+    """The `Post` columns for cards and <title>s."""
+    return {
+        "summary": summary(content),
+        "meta_title": truncate(title or "", META_TITLE_CHARS),
+    }
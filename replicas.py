@@ -0,0 +1,156 @@
+"""Routing of read-only requests to read replicas.
+
+With BLOG_DB_REPLICA_URLS set, routes that only read take their session
+from `get_read_db`, which hands out the replicas round-robin. Writes keep
+using `get_db` and the primary. Every BLOG_DB_REPLICA_HEALTH_INTERVAL
+seconds each replica runs a `SELECT 1`; one that fails or takes longer
+than BLOG_DB_REPLICA_HEALTH_TIMEOUT seconds gets no reads until it passes
+again, and with no healthy replica reads go to the primary.
+
+Replicas lag behind the primary, so a client that just wrote could read
+its own change as missing. After a write the route calls
+`stick_to_primary`, which sets a cookie (BLOG_READ_YOUR_WRITES_COOKIE)
+that sends that client's reads to the primary, past the response cache,
+for BLOG_READ_YOUR_WRITES_SECONDS (default 5, 0 turns it off). Other clients
+still see the change once it has replicated, though a response cached
+from a replica that was behind can stay stale for up to BLOG_CACHE_TTL.
+
+Two SQLite files work for trying it out: BLOG_DB_URL=sqlite:///primary.db
+and BLOG_DB_REPLICA_URLS=sqlite:///replica.db, where replica.db is a copy.
+"""
+import asyncio
+import itertools
+import logging
+import os
+import time
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from starlette.requests import Request
+from starlette.responses import Response
+
+from database import AsyncSessionLocal, replica_engines
+
+HEALTH_INTERVAL = float(os.environ.get("BLOG_DB_REPLICA_HEALTH_INTERVAL", "5"))
+HEALTH_TIMEOUT = float(os.environ.get("BLOG_DB_REPLICA_HEALTH_TIMEOUT", "2"))
+READ_YOUR_WRITES_SECONDS = float(os.environ.get("BLOG_READ_YOUR_WRITES_SECONDS", "5"))
+READ_YOUR_WRITES_COOKIE = os.environ.get("BLOG_READ_YOUR_WRITES_COOKIE", "blog_primary_until")
+
+logger = logging.getLogger(__name__)
+
+
+class ReplicaRouter:
+    def __init__(
+        self,
+        primary: async_sessionmaker,
+        engines: list,
+        health_interval: float = HEALTH_INTERVAL,
+        health_timeout: float = HEALTH_TIMEOUT,
+    ):
+        self.primary = primary
+        self.engines = engines
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self._sessions = [
+            async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+            for engine in engines
+        ]
+        self.healthy = [True] * len(engines)
+        self._turn = itertools.count()
+        self._task: Optional[asyncio.Task] = None
+        self.reads = {"primary": 0, **{str(index): 0 for index in range(len(engines))}}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.engines)
+
+    def session(self, primary: bool = False) -> AsyncSession:
+        """A session on the next healthy replica, or on the primary."""
+        healthy = [index for index, ok in enumerate(self.healthy) if ok]
+        if primary or not healthy:
+            self.reads["primary"] += 1
+            return self.primary()
+        index = healthy[next(self._turn) % len(healthy)]
+        self.reads[str(index)] += 1
+        return self._sessions[index]()
+
+    async def _ping(self, engine) -> bool:
+        try:
+            async with engine.connect() as connection:
+                await asyncio.wait_for(
+                    connection.execute(text("SELECT 1")), self.health_timeout
+                )
+            return True
+        except Exception:
+            return False
+
+    async def check(self):
+        results = await asyncio.gather(*(self._ping(engine) for engine in self.engines))
+        for index, ok in enumerate(results):
+            if ok != self.healthy[index]:
+                url = self.engines[index].url.render_as_string(hide_password=True)
+                if ok:
+                    logger.warning("Replica %s is back", url)
+                else:
+                    logger.warning("Replica %s failed its health check", url)
+            self.healthy[index] = ok
+
+    async def start(self):
+        if not self.enabled:
+            return
+        await self.check()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            try:
+                await self.check()
+            except Exception:
+                logger.exception("Checking the replicas failed")
+
+    def stats(self) -> dict:
+        return {
+            "replicas": [
+                {
+                    "url": engine.url.render_as_string(hide_password=True),
+                    "healthy": self.healthy[index],
+                }
+                for index, engine in enumerate(self.engines)
+            ],
+            "reads": self.reads,
+        }
+
+
+def sticks_to_primary(request: Request) -> bool:
+    try:
+        until = float(request.cookies.get(READ_YOUR_WRITES_COOKIE, 0))
+    except ValueError:
+        return False
+    return until > time.time()
+
+
+def stick_to_primary(response: Response):
+    """Send this client's reads to the primary for a while, after it wrote."""
+    if not replica_router.enabled or READ_YOUR_WRITES_SECONDS <= 0:
+        return
+    response.set_cookie(
+        READ_YOUR_WRITES_COOKIE,
+        str(time.time() + READ_YOUR_WRITES_SECONDS),
+        max_age=max(1, int(READ_YOUR_WRITES_SECONDS)),
+        httponly=True,
+        samesite="lax",
+    )
+
+
+replica_router = ReplicaRouter(AsyncSessionLocal, replica_engines)
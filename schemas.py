@@ -15,6 +15,10 @@ class PostCreate(PostBase):
     slug: str
 
 
+class PostImport(PostCreate):
+    created_at: datetime.datetime | None = None
+
+
 class TagURL(BaseModel):
     tag_id: str
     tag_name: str
@@ -26,11 +30,28 @@ class PostCard(BaseModel):
     post_id: str | None = None
     slug: str
     title: str | None = None
+    summary: str | None = None
     username: str
     created_at: datetime.datetime
     updated_at: str | None = None
     published_at: str | None = None
     category: str
+    tag_urls: List[TagURL] | None = None
+
+
+class SearchResult(PostCard):
+    rank: float
+    snippet: str
+
+
+class TrendingPost(PostCard):
+    score: float
+
+
+class TocEntry(BaseModel):
+    level: int
+    id: str
+    text: str
 
 
 class PostShow(PostBase):
@@ -39,18 +60,22 @@ class PostShow(PostBase):
     username: str
     title: str | None = None
     tag_urls: List[TagURL] | None = None
+    # Rendered when the post was written; None until `backfill.py render` ran
+    content_html: str | None = None
+    toc: List[TocEntry] | None = None
+    reading_time: int | None = None
 
 
 class Post(PostBase):
     description: str | None = None
     summary: str | None = None
-    is_published: str
+    is_published: bool | None = None
     slug: str | None = None
-    like: str | None = None
-    dislike: str | None = None
-    created_at: str | None = None
-    updated_at: str | None = None
-    published_at: str | None = None
+    like: int | None = None
+    dislike: int | None = None
+    created_at: datetime.datetime | None = None
+    updated_at: datetime.datetime | None = None
+    published_at: datetime.datetime | None = None
 
     class Config:
         orm_mode = True
@@ -72,3 +97,12 @@ class User(UserBase):
 
     class Config:
         orm_mode = True
+
+
+class UserSummary(UserBase):
+    user_id: str
+    name: str
+    is_active: bool
+    post_count: int
+    # Newest posts first; only with ?posts_limit=N
+    posts: List[PostCard] | None = None
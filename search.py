@@ -0,0 +1,275 @@
+import heapq
+import html
+import math
+import re
+import threading
+from collections import defaultdict
+from typing import Optional
+
+from sqlalchemy import func, literal_column
+from sqlalchemy.orm import Session
+
+import models
+
+# CJK text has no spaces between words, so runs of it are indexed as
+# character bigrams instead of whole "words".
+CJK = "\u3040-\u30ff\u3400-\u9fff\uf900-\ufaff"
+TOKEN_RE = re.compile(r"([%s]+)|[^\W%s]+" % (CJK, CJK))
+
+SNIPPET_WIDTH = 160
+HIGHLIGHT_START = "<b>"
+HIGHLIGHT_STOP = "</b>"
+# Put around matches by ts_headline in place of the tags, so the rest of
+# the headline can be escaped first
+HEADLINE_START = "\x02"
+HEADLINE_STOP = "\x03"
+HEADLINE_OPTIONS = (
+    f'MaxWords=35, MinWords=15, StartSel="{HEADLINE_START}", StopSel="{HEADLINE_STOP}"'
+)
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+
+def tokenize(text: Optional[str]) -> list[str]:
+    tokens = []
+    for match in TOKEN_RE.finditer((text or "").lower()):
+        word = match.group(0)
+        if match.group(1) and len(word) > 1:
+            tokens.extend(word[i : i + 2] for i in range(len(word) - 1))
+        else:
+            tokens.append(word)
+    return tokens
+
+
+def is_postgres(db: Session) -> bool:
+    return db.get_bind().dialect.name == "postgresql"
+
+
+class InvertedIndex:
+    """In-process BM25 index over post titles and bodies.
+
+    Used when the database has no full-text search (SQLite). Every worker
+    process keeps its own copy, loaded from the database on first use and
+    kept current by `index_post` / `remove_post`. Posts written or deleted
+    by another process get in by `reindex_posts` or a reload, see
+    invalidation.py.
+    """
+
+    def __init__(self):
+        self._postings: dict[str, dict[str, int]] = defaultdict(dict)
+        self._lengths: dict[str, int] = {}
+        self._doc_terms: dict[str, tuple[str, ...]] = {}
+        self._total_length = 0
+        self._lock = threading.RLock()
+        self.loaded = False
+
+    def __len__(self):
+        return len(self._lengths)
+
+    def add(self, post_id: str, title: Optional[str], content: Optional[str]):
+        tokens = tokenize(title) + tokenize(content)
+        counts: dict[str, int] = defaultdict(int)
+        for token in tokens:
+            counts[token] += 1
+        with self._lock:
+            self.remove(post_id)
+            for term, tf in counts.items():
+                self._postings[term][post_id] = tf
+            self._lengths[post_id] = len(tokens)
+            self._doc_terms[post_id] = tuple(counts)
+            self._total_length += len(tokens)
+
+    def remove(self, post_id: str):
+        with self._lock:
+            length = self._lengths.pop(post_id, None)
+            if length is None:
+                return
+            self._total_length -= length
+            for term in self._doc_terms.pop(post_id):
+                postings = self._postings[term]
+                del postings[post_id]
+                if not postings:
+                    del self._postings[term]
+
+    def clear(self):
+        with self._lock:
+            self._postings.clear()
+            self._lengths.clear()
+            self._doc_terms.clear()
+            self._total_length = 0
+            self.loaded = False
+
+    def _candidates(self, terms: list[str]) -> set[str]:
+        postings = [self._postings.get(term) for term in terms]
+        if not terms or any(p is None for p in postings):
+            return set()
+        # Intersect starting from the rarest term to keep the sets small
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates.intersection_update(posting)
+            if not candidates:
+                break
+        return candidates
+
+    def matching_ids(self, query: str) -> set[str]:
+        with self._lock:
+            return self._candidates(sorted(set(tokenize(query))))
+
+    def search(self, query: str, limit: int = 20) -> list[tuple[str, float]]:
+        """Return the `limit` best (post_id, score) pairs, best first."""
+        terms = sorted(set(tokenize(query)))
+        with self._lock:
+            candidates = self._candidates(terms)
+            if not candidates:
+                return []
+            n_docs = len(self._lengths)
+            avg_length = self._total_length / n_docs or 1
+            idf = {}
+            for term in terms:
+                df = len(self._postings[term])
+                idf[term] = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+
+            def score(post_id):
+                norm = K1 * (1 - B + B * self._lengths[post_id] / avg_length)
+                total = 0.0
+                for term in terms:
+                    tf = self._postings[term][post_id]
+                    total += idf[term] * tf * (K1 + 1) / (tf + norm)
+                return total
+
+            return heapq.nlargest(
+                limit, ((post_id, score(post_id)) for post_id in candidates),
+                key=lambda hit: hit[1],
+            )
+
+
+index = InvertedIndex()
+
+
+def ensure_loaded(db: Session, batch_size: int = 500):
+    if index.loaded:
+        return
+    with index._lock:
+        if index.loaded:
+            return
+        rows = (
+            db.query(models.Post.post_id, models.Post.title, models.Post.content)
+            .execution_options(yield_per=batch_size)
+        )
+        for post_id, title, content in rows:
+            index.add(post_id, title, content)
+        index.loaded = True
+
+
+def index_post(db: Session, post: models.Post):
+    """Keep the fallback index in sync after a post is written."""
+    if index.loaded and not is_postgres(db):
+        index.add(post.post_id, post.title, post.content)
+
+
+def index_posts(db: Session, posts: list[dict]):
+    """`index_post` for rows inserted in bulk."""
+    if index.loaded and not is_postgres(db):
+        for post in posts:
+            index.add(post["post_id"], post["title"], post["content"])
+
+
+def remove_post(db: Session, post_id: str):
+    if index.loaded and not is_postgres(db):
+        index.remove(post_id)
+
+
+def reindex_posts(db: Session, post_ids: list[str]):
+    """Read posts written by another process into the fallback index, and
+    drop the ones that no longer exist."""
+    if not index.loaded or is_postgres(db):
+        return
+    rows = db.query(models.Post.post_id, models.Post.title, models.Post.content).filter(
+        models.Post.post_id.in_(post_ids)
+    )
+    found = set()
+    for post_id, title, content in rows:
+        index.add(post_id, title, content)
+        found.add(post_id)
+    for post_id in set(post_ids) - found:
+        index.remove(post_id)
+
+
+def document():
+    return literal_column(models.SEARCH_DOCUMENT)
+
+
+def ts_query(keyword: str):
+    return func.plainto_tsquery(models.SEARCH_CONFIG, keyword)
+
+
+def match_clause(db: Session, keyword: str):
+    """SQL filter for posts matching `keyword`, backed by an index."""
+    if is_postgres(db):
+        return document().op("@@")(ts_query(keyword))
+    return models.Post.post_id.in_(matching_ids(db, keyword))
+
+
+def matching_ids(db: Session, keyword: str) -> set[str]:
+    """Ids of the posts matching `keyword` in the in-process index."""
+    ensure_loaded(db)
+    return index.matching_ids(keyword)
+
+
+def few_matches(matches: set[str], wanted: int) -> bool:
+    """Whether `wanted` of `matches` are found faster with an IN list of all
+    of them than by walking the listing, which takes about
+    wanted * len(index) / len(matches) rows."""
+    return len(matches) ** 2 <= wanted * len(index)
+
+
+def first_matches(post_ids, matches: set[str], wanted: int) -> list[str]:
+    """The first `wanted` ids of the ordered `post_ids` that are in `matches`."""
+    found = []
+    if wanted <= 0:
+        return found
+    for (post_id,) in post_ids:
+        if post_id in matches:
+            found.append(post_id)
+            if len(found) == wanted:
+                break
+    return found
+
+
+def make_snippet(text: Optional[str], query: str, width: int = SNIPPET_WIDTH) -> str:
+    """Cut a window of `text` around the first query term and highlight it.
+
+    Snippets are HTML: the post's text is escaped, only the highlight tags
+    are markup.
+    """
+    text = text or ""
+    terms = sorted(set(tokenize(query)), key=len, reverse=True)
+    if not terms:
+        return html.escape(text[:width])
+    pattern = re.compile("|".join(re.escape(term) for term in terms), re.IGNORECASE)
+    first = pattern.search(text)
+    start = max(0, first.start() - width // 4) if first else 0
+    window = text[start : start + width]
+    parts = []
+    end = 0
+    for match in pattern.finditer(window):
+        parts.append(html.escape(window[end : match.start()]))
+        parts.append(f"{HIGHLIGHT_START}{html.escape(match.group(0))}{HIGHLIGHT_STOP}")
+        end = match.end()
+    parts.append(html.escape(window[end:]))
+    highlighted = "".join(parts)
+    prefix = "..." if start > 0 else ""
+    suffix = "..." if start + width < len(text) else ""
+    return f"{prefix}{highlighted}{suffix}"
+
+
+def highlight_headline(headline: Optional[str]) -> str:
+    """A ts_headline made with HEADLINE_OPTIONS as an escaped snippet."""
+    return (
+        html.escape(headline or "")
+        .replace(HEADLINE_START, HIGHLIGHT_START)
+        .replace(HEADLINE_STOP, HIGHLIGHT_STOP)
+    )
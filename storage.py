@@ -0,0 +1,197 @@
+import logging
+import os
+import tempfile
+from typing import Optional
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import UploadFile
+
+S3_BUCKET = os.environ.get("BLOG_S3_BUCKET", "haruki-blog-image")
+# Set to a MinIO or moto server URL to run against a local S3
+S3_ENDPOINT_URL = os.environ.get("BLOG_S3_ENDPOINT_URL")
+S3_PUBLIC_URL = os.environ.get(
+    "BLOG_S3_PUBLIC_URL", f"https://{S3_BUCKET}.s3.ap-northeast-1.amazonaws.com"
+)
+
+UPLOAD_MAX_BYTES = int(os.environ.get("BLOG_UPLOAD_MAX_BYTES", str(20 * 1024 * 1024)))
+# Files bigger than one part go up as a multipart upload. S3 needs >= 5 MiB.
+PART_BYTES = max(
+    int(os.environ.get("BLOG_S3_PART_BYTES", str(8 * 1024 * 1024))), 5 * 1024 * 1024
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class StorageUnavailable(Exception):
+    pass
+
+
+_s3_client = None
+
+
+def get_s3_client():
+    """The S3 client, created on first use so importing the app stays cheap."""
+    global _s3_client
+    if _s3_client is None:
+        import boto3
+
+        _s3_client = boto3.client(
+            "s3",
+            endpoint_url=S3_ENDPOINT_URL,
+            aws_access_key_id=os.environ.get("AWS_ACCESS_KEY_ID"),
+            aws_secret_access_key=os.environ.get("AWS_SECRET_ACCESS_KEY"),
+        )
+    return _s3_client
+
+
+def set_s3_client(client):
+    """Use another client, e.g. one created inside moto's `mock_s3`."""
+    global _s3_client
+    _s3_client = client
+
+
+def public_url(key: str) -> str:
+    return f"{S3_PUBLIC_URL}/{key}"
+
+
+async def upload_bytes(data: bytes, key: str, content_type: Optional[str] = None):
+    from botocore.exceptions import BotoCoreError, ClientError
+
+    extra = {"ContentType": content_type} if content_type else {}
+    try:
+        await run_in_threadpool(
+            get_s3_client().put_object, Bucket=S3_BUCKET, Key=key, Body=data, **extra
+        )
+    except (BotoCoreError, ClientError) as e:
+        raise StorageUnavailable(str(e)) from e
+
+
+async def save_upload(file: UploadFile, max_bytes: int = UPLOAD_MAX_BYTES) -> str:
+    """Copy `file` to a temporary file one part at a time, refusing more than
+    `max_bytes`. Returns its path; remove it with `remove_files`."""
+    fp = tempfile.NamedTemporaryFile(prefix="upload-", delete=False)
+    try:
+        total = 0
+        while chunk := await _read_part(file, PART_BYTES, total, max_bytes):
+            total += len(chunk)
+            await run_in_threadpool(fp.write, chunk)
+    except BaseException:
+        fp.close()
+        remove_files(fp.name)
+        raise
+    fp.close()
+    return fp.name
+
+
+def remove_files(*paths: str):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+async def delete_objects(keys: list[str]):
+    """Remove what a failed upload had already stored; failures are only logged."""
+    from botocore.exceptions import BotoCoreError, ClientError
+
+    if not keys:
+        return
+    try:
+        await run_in_threadpool(
+            get_s3_client().delete_objects,
+            Bucket=S3_BUCKET,
+            Delete={"Objects": [{"Key": key} for key in keys], "Quiet": True},
+        )
+    except (BotoCoreError, ClientError):
+        logger.exception("Could not remove %s", ", ".join(keys))
+
+
+async def _read_part(file: UploadFile, size: int, total: int, max_bytes: int) -> bytes:
+    chunk = await file.read(size)
+    if total + len(chunk) > max_bytes:
+        raise UploadTooLarge(f"File is larger than {max_bytes} bytes")
+    return chunk
+
+
+async def upload_stream(
+    file: UploadFile,
+    key: str,
+    content_type: Optional[str] = None,
+    max_bytes: int = UPLOAD_MAX_BYTES,
+) -> int:
+    """Stream `file` to S3 one part at a time, off the event loop.
+
+    At most one part is held in memory. Returns the number of bytes stored.
+    """
+    from botocore.exceptions import BotoCoreError, ClientError
+
+    client = get_s3_client()
+    extra = {"ContentType": content_type} if content_type else {}
+    try:
+        chunk = await _read_part(file, PART_BYTES, 0, max_bytes)
+        if len(chunk) < PART_BYTES:
+            await run_in_threadpool(
+                client.put_object, Bucket=S3_BUCKET, Key=key, Body=chunk, **extra
+            )
+            return len(chunk)
+
+        upload = await run_in_threadpool(
+            client.create_multipart_upload, Bucket=S3_BUCKET, Key=key, **extra
+        )
+        upload_id = upload["UploadId"]
+        try:
+            parts = []
+            total = 0
+            while chunk:
+                total += len(chunk)
+                part = await run_in_threadpool(
+                    client.upload_part,
+                    Bucket=S3_BUCKET,
+                    Key=key,
+                    UploadId=upload_id,
+                    PartNumber=len(parts) + 1,
+                    Body=chunk,
+                )
+                parts.append({"ETag": part["ETag"], "PartNumber": len(parts) + 1})
+                chunk = await _read_part(file, PART_BYTES, total, max_bytes)
+            await run_in_threadpool(
+                client.complete_multipart_upload,
+                Bucket=S3_BUCKET,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": parts},
+            )
+            return total
+        except BaseException:
+            await run_in_threadpool(
+                client.abort_multipart_upload,
+                Bucket=S3_BUCKET,
+                Key=key,
+                UploadId=upload_id,
+            )
+            raise
+    except (BotoCoreError, ClientError) as e:
+        raise StorageUnavailable(str(e)) from e
+
+
+class _FileReader:
+    def __init__(self, fp):
+        self._fp = fp
+
+    async def read(self, size: int) -> bytes:
+        return await run_in_threadpool(self._fp.read, size)
+
+
+async def upload_file(path: str, key: str, content_type: Optional[str] = None) -> int:
+    """`upload_stream` for a file on disk: one part at a time, as a
+    multipart upload when there is more than one."""
+    with open(path, "rb") as fp:
+        return await upload_stream(
+            _FileReader(fp), key, content_type, max_bytes=os.path.getsize(path)
+        )
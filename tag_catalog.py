@@ -0,0 +1,78 @@
+import asyncio
+import datetime
+import os
+import time
+from typing import Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+import conditional
+import models
+
+# Tags are edited directly in the DB, so the catalog also reloads itself
+# after this many seconds.
+CATALOG_TTL = int(os.environ.get("BLOG_TAG_CATALOG_TTL", "300"))
+
+
+class TagCatalog:
+    """All tags, kept in memory in the shape the API returns them.
+
+    Loaded at startup and reloaded after `CATALOG_TTL` seconds or when
+    `refresh` is called after a tag is written.
+    """
+
+    def __init__(self, ttl: int = CATALOG_TTL):
+        self.ttl = ttl
+        self.etag: Optional[str] = None
+        self.last_modified: Optional[datetime.datetime] = None
+        self._tags: dict[str, dict] = {}
+        self._list: list[dict] = []
+        self._loaded_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded_at is not None
+
+    def is_stale(self) -> bool:
+        return not self.loaded or time.monotonic() - self._loaded_at > self.ttl
+
+    def load(self, db: Session) -> bool:
+        """Reload from the DB. Returns True if the tags changed."""
+        tags = [
+            {"tag_id": tag_id, "tag_name": tag_name, "url": url}
+            for tag_id, tag_name, url in db.query(
+                models.Tag.id, models.Tag.meta_title, models.Tag.icon_image_url
+            ).order_by(models.Tag.id)
+        ]
+        etag = conditional.make_etag(tags)
+        changed = etag != self.etag
+        if changed:
+            self._list = tags
+            self._tags = {tag["tag_id"]: tag for tag in tags}
+            self.etag = etag
+            self.last_modified = conditional.last_modified(
+                datetime.datetime.utcnow()
+            )
+        self._loaded_at = time.monotonic()
+        return changed
+
+    async def refresh(self, db: AsyncSession) -> bool:
+        async with self._lock:
+            return await db.run_sync(self.load)
+
+    async def ensure_fresh(self, db: AsyncSession):
+        if self.is_stale():
+            async with self._lock:
+                if self.is_stale():
+                    await db.run_sync(self.load)
+
+    def get(self, tag_id: str) -> Optional[dict]:
+        return self._tags.get(tag_id)
+
+    def all(self) -> list[dict]:
+        return self._list
+
+
+tag_catalog = TagCatalog()
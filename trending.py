@@ -0,0 +1,292 @@
+"""Trending posts: likes and views with exponential time decay.
+
+Every like or view adds `weight * 2 ** ((t - epoch) / half_life)` to the
+post's score, so older activity counts for less without ever touching the
+scores again: ranking by the stored scores is the same as ranking by the
+decayed ones at any moment. `maintain` rescales everything to a newer
+epoch before the numbers get too big, and drops posts whose score has
+decayed to nothing.
+
+Scores live in sorted sets, one per board: every post, each category and
+each tag, matching the `category` and `tag_id` filters of GET /posts/.
+Top-k is read off the end of a sorted set in O(k). `SortedSets` keeps
+them in process; it has the coroutines and arguments of redis.asyncio, so
+a Redis client (with `decode_responses=True`) can stand in for it. The
+epoch and the post facets stay in the process, so each process needs its
+own key prefix.
+
+Each process ranks the clicks it serves as they come in. Every
+`REFRESH_INTERVAL` seconds it reads the counters stored in the database
+again and adds the clicks other processes have flushed since, and drops
+posts that were deleted.
+"""
+import asyncio
+import bisect
+import datetime
+import fnmatch
+import logging
+import os
+import time
+from typing import Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import async_crud
+
+HALF_LIFE = float(os.environ.get("BLOG_TRENDING_HALF_LIFE_HOURS", "24")) * 3600
+REFRESH_INTERVAL = float(os.environ.get("BLOG_TRENDING_REFRESH_INTERVAL", "60"))
+WEIGHTS = {"views": 1.0, "like": 5.0}
+# Rescale once a new click would be worth 2 ** MAX_DOUBLINGS old ones
+MAX_DOUBLINGS = 64
+# Posts whose decayed score falls below this are dropped
+MIN_SCORE = 0.01
+
+ALL = "all"
+
+logger = logging.getLogger(__name__)
+
+
+def category_board(category: str) -> str:
+    return f"category:{category}"
+
+
+def tag_board(tag_id: str) -> str:
+    return f"tag:{tag_id}"
+
+
+class SortedSets:
+    """Just enough of Redis' sorted sets, in memory."""
+
+    def __init__(self):
+        self._scores: dict[str, dict[str, float]] = {}
+        # (score, member), ascending
+        self._order: dict[str, list[tuple[float, str]]] = {}
+
+    def _drop_if_empty(self, name: str):
+        if not self._order.get(name):
+            self._scores.pop(name, None)
+            self._order.pop(name, None)
+
+    async def keys(self, pattern: str = "*") -> list[str]:
+        return [name for name in self._scores if fnmatch.fnmatchcase(name, pattern)]
+
+    async def zincrby(self, name: str, amount: float, value: str) -> float:
+        scores = self._scores.setdefault(name, {})
+        order = self._order.setdefault(name, [])
+        old = scores.get(value)
+        if old is not None:
+            del order[bisect.bisect_left(order, (old, value))]
+        score = (old or 0.0) + amount
+        scores[value] = score
+        bisect.insort(order, (score, value))
+        return score
+
+    async def zrevrange(self, name: str, start: int, end: int, withscores: bool = False):
+        """Members from the highest score down, `end` inclusive."""
+        order = self._order.get(name, [])
+        if end < 0:
+            end += len(order)
+        stop = len(order) - start
+        begin = max(0, len(order) - end - 1)
+        ranked = reversed(order[begin:stop])
+        if withscores:
+            return [(member, score) for score, member in ranked]
+        return [member for _, member in ranked]
+
+    async def zrem(self, name: str, *values: str) -> int:
+        scores = self._scores.get(name, {})
+        removed = 0
+        for value in values:
+            old = scores.pop(value, None)
+            if old is not None:
+                del self._order[name][bisect.bisect_left(self._order[name], (old, value))]
+                removed += 1
+        self._drop_if_empty(name)
+        return removed
+
+    async def zremrangebyscore(self, name: str, min: float, max: float) -> int:
+        order = self._order.get(name, [])
+        begin = bisect.bisect_left(order, (min, ""))
+        end = bisect.bisect_right(order, (max, chr(0x10FFFF)))
+        for _, member in order[begin:end]:
+            del self._scores[name][member]
+        del order[begin:end]
+        self._drop_if_empty(name)
+        return end - begin
+
+    async def zunionstore(self, dest: str, keys, aggregate: Optional[str] = None) -> int:
+        """Sum the sets `keys` (a list, or a dict of key to weight) into `dest`."""
+        weights = keys if isinstance(keys, dict) else dict.fromkeys(keys, 1)
+        scores: dict[str, float] = {}
+        for name, weight in weights.items():
+            for member, score in self._scores.get(name, {}).items():
+                scores[member] = scores.get(member, 0.0) + score * weight
+        self._scores[dest] = scores
+        self._order[dest] = sorted((score, member) for member, score in scores.items())
+        self._drop_if_empty(dest)
+        return len(scores)
+
+
+class Trending:
+    def __init__(
+        self,
+        sets=None,
+        half_life: float = HALF_LIFE,
+        prefix: str = "trending:",
+    ):
+        self.sets = sets or SortedSets()
+        self.half_life = half_life
+        self.prefix = prefix
+        self.epoch = time.time()
+        # post_id -> (category, tag_ids), for the posts on any board
+        self._facets: dict[str, tuple[Optional[str], list[str]]] = {}
+        # post_id -> points already on the boards, stored or clicked here;
+        # kept after a post decays off the boards so they aren't added again
+        self._counted: dict[str, float] = {}
+        # Posts with counters in the database at the last refresh
+        self._stored: set[str] = set()
+        self._refreshed = False
+        self._task: Optional[asyncio.Task] = None
+
+    def _key(self, board: str) -> str:
+        return self.prefix + board
+
+    def _boards(self, post_id: str) -> list[str]:
+        category, tag_ids = self._facets[post_id]
+        boards = [ALL, *(tag_board(tag_id) for tag_id in tag_ids)]
+        if category is not None:
+            boards.append(category_board(category))
+        return [self._key(board) for board in boards]
+
+    def _weight(self, at: float) -> float:
+        return 2 ** ((at - self.epoch) / self.half_life)
+
+    async def _add(self, post_id: str, points: float, at: float):
+        points *= self._weight(at)
+        for key in self._boards(post_id):
+            await self.sets.zincrby(key, points, post_id)
+
+    async def record(self, db: AsyncSession, post_id: str, counter: str, amount: int = 1):
+        weight = WEIGHTS.get(counter)
+        if not weight:
+            return
+        if post_id not in self._facets:
+            facets = await async_crud.get_post_facets(db, post_id)
+            if facets is None:
+                return
+            self._facets[post_id] = facets
+        points = weight * amount
+        self._counted[post_id] = self._counted.get(post_id, 0.0) + points
+        await self._add(post_id, points, time.time())
+
+    async def top(
+        self, limit: int, category: Optional[str] = None, tag_id: Optional[str] = None
+    ) -> list[tuple[str, float]]:
+        """The `limit` best (post_id, score) pairs, scores decayed to now."""
+        # zrevrange(key, 0, -1) would be the whole board
+        if limit < 1:
+            return []
+        if tag_id is not None:
+            board = tag_board(tag_id)
+        elif category is not None:
+            board = category_board(category)
+        else:
+            board = ALL
+        key = self._key(board)
+        decay = 1 / self._weight(time.time())
+        if tag_id is None or category is None:
+            ranked = await self.sets.zrevrange(key, 0, limit - 1, withscores=True)
+        else:
+            # Both facets: walk the tag board for posts in the category
+            ranked = [
+                (post_id, score)
+                for post_id, score in await self.sets.zrevrange(key, 0, -1, withscores=True)
+                if post_id in self._facets and self._facets[post_id][0] == category
+            ][:limit]
+        return [(post_id, score * decay) for post_id, score in ranked]
+
+    async def remove(self, post_id: str):
+        if post_id in self._facets:
+            for key in self._boards(post_id):
+                await self.sets.zrem(key, post_id)
+            del self._facets[post_id]
+        self._counted.pop(post_id, None)
+        self._stored.discard(post_id)
+
+    async def refresh(self, db: AsyncSession):
+        """Bring the boards up to the counters stored in the database.
+
+        On the first call the stored clicks count as if they had happened
+        when the post was published; later, clicks stored since the last
+        refresh that this process did not record itself count as now.
+        """
+        posts, tags = await async_crud.get_trending_seed(db)
+        tag_ids: dict[str, list[str]] = {}
+        for post_id, tag_id in tags:
+            tag_ids.setdefault(post_id, []).append(tag_id)
+        first = not self._refreshed
+        now = time.time()
+        for post in posts:
+            points = sum((getattr(post, name) or 0) * w for name, w in WEIGHTS.items())
+            new = points - self._counted.get(post.post_id, 0.0)
+            if new <= 0:
+                # Clicks recorded here that are not flushed yet
+                continue
+            self._counted[post.post_id] = points
+            self._facets[post.post_id] = (post.category, tag_ids.get(post.post_id, []))
+            at = now
+            if first:
+                at = self.epoch
+                if post.created_at:
+                    # Stored as naive UTC
+                    at = post.created_at.replace(tzinfo=datetime.timezone.utc).timestamp()
+            await self._add(post.post_id, new, at)
+        stored = {post.post_id for post in posts}
+        for post_id in self._stored - stored:
+            # Deleted by another process
+            await self.remove(post_id)
+        self._stored = stored
+        self._refreshed = True
+        await self.maintain()
+
+    async def maintain(self, now: Optional[float] = None):
+        """Move to a newer epoch when due and drop posts that decayed away."""
+        now = now or time.time()
+        keys = await self.sets.keys(self._key("*"))
+        if (now - self.epoch) / self.half_life > MAX_DOUBLINGS:
+            factor = 1 / self._weight(now)
+            for key in keys:
+                await self.sets.zunionstore(key, {key: factor})
+            self.epoch = now
+        threshold = MIN_SCORE * self._weight(now)
+        for key in keys:
+            await self.sets.zremrangebyscore(key, float("-inf"), threshold)
+        ranked = set(await self.sets.zrevrange(self._key(ALL), 0, -1))
+        for post_id in set(self._facets) - ranked:
+            del self._facets[post_id]
+
+    async def start(self, session_factory):
+        async with session_factory() as db:
+            await self.refresh(db)
+        self._task = asyncio.create_task(self._run(session_factory))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self, session_factory):
+        while True:
+            await asyncio.sleep(REFRESH_INTERVAL)
+            try:
+                async with session_factory() as db:
+                    await self.refresh(db)
+            except Exception:
+                logger.exception("Refreshing the trending boards failed")
+
+
+trending = Trending()
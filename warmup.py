@@ -0,0 +1,94 @@
+"""Startup warm-up and readiness.
+
+Importing the app does no I/O; the schema is managed by migrations (see
+migrations/) and heavy clients are created on first use. Once the app has
+started, the warm-up runs in the background and gets the first requests
+ready to be served like any other:
+
+- opens BLOG_WARMUP_CONNECTIONS pooled database connections,
+- runs the hot read queries once, so SQLAlchemy has them compiled,
+- loads the in-process search index (SQLite only),
+- imports python-jose and builds the passlib context, for the first login.
+
+Until it has finished GET /startup answers 503, so a load balancer only
+sends traffic to a warmed-up process. A failing warm-up (e.g. the database
+is not up yet) is retried every BLOG_WARMUP_RETRY_INTERVAL seconds.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Optional
+
+from sqlalchemy import text
+
+import async_crud
+import passwords
+import search
+
+CONNECTIONS = int(os.environ.get("BLOG_WARMUP_CONNECTIONS", "4"))
+RETRY_INTERVAL = float(os.environ.get("BLOG_WARMUP_RETRY_INTERVAL", "2"))
+
+logger = logging.getLogger(__name__)
+
+
+def _load_crypto():
+    import jose.jwt  # noqa: F401
+
+    passwords.context()
+
+
+class WarmUp:
+    def __init__(self, connections: int = CONNECTIONS, retry_interval: float = RETRY_INTERVAL):
+        self.connections = connections
+        self.retry_interval = retry_interval
+        self.ready = False
+        self.seconds: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def prime_pool(self, engine):
+        async def connect():
+            async with engine.connect() as connection:
+                await connection.execute(text("SELECT 1"))
+
+        # All at once, so the pool is left holding that many connections
+        await asyncio.gather(*(connect() for _ in range(self.connections)))
+
+    async def run(self, engine, session_factory):
+        started = time.perf_counter()
+        await self.prime_pool(engine)
+        async with session_factory() as db:
+            await async_crud.get_post_cards(db, limit=1)
+            if not await db.run_sync(search.is_postgres):
+                await db.run_sync(search.ensure_loaded)
+        await asyncio.to_thread(_load_crypto)
+        self.seconds = time.perf_counter() - started
+        self.ready = True
+        logger.info("Warmed up in %.2fs", self.seconds)
+
+    async def start(self, engine, session_factory):
+        self._task = asyncio.create_task(self._run(engine, session_factory))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self, engine, session_factory):
+        while True:
+            try:
+                await self.run(engine, session_factory)
+                return
+            except Exception:
+                logger.exception("Warm-up failed, retrying")
+            await asyncio.sleep(self.retry_interval)
+
+    def stats(self) -> dict:
+        return {"ready": self.ready, "seconds": self.seconds}
+
+
+warm_up = WarmUp()